@@ -4,7 +4,8 @@ from aiogram.types import Message, ReplyKeyboardRemove
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from utils.ai_engine import ask_brain, safe_reply
+from utils.ai_engine import ask_brain, queue_notifier, safe_reply
+from utils.ai_scheduler import PRIORITY_BATCH
 
 router = Router()
 
@@ -14,17 +15,23 @@ class ProjectBriefing(StatesGroup):
     ready_to_launch = State()         # Готовы запускать консилиум
 
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
-async def run_agent(role: str, prompt: str):
+async def run_agent(role: str, prompt: str, status_msg: Message = None):
     current_dir = os.path.dirname(__file__)
     try:
         with open(os.path.join(current_dir, "profiles", f"{role}.txt"), "r") as f:
             system_prompt = f.read()
     except:
         system_prompt = "Ты эксперт."
-    content, model, source = await ask_brain(system_prompt, prompt)
+    # Консилиум — пакетная работа, короткие ответы идут вперёд
+    content, model, source = await ask_brain(
+        system_prompt, prompt, priority=PRIORITY_BATCH,
+        on_queue=queue_notifier(status_msg) if status_msg else None, route="ai_team.agent",
+        # Консилиум на повторный вопрос должен думать заново, а не отдавать старый ответ
+        cache=False
+    )
     return content, f"{model} | {source}"
 
-async def analyze_input(user_text: str):
+async def analyze_input(user_text: str, status_msg: Message = None):
     """
     PM проверяет, понятна ли задача.
     Возвращает: (is_good: bool, reason: str)
@@ -36,7 +43,11 @@ async def analyze_input(user_text: str):
         "Если запрос плохой или непонятный, задай 2-3 уточняющих вопроса.\n"
         "Если запрос хороший, ответь одним словом: APPROVED."
     )
-    content, _, _ = await ask_brain(system_prompt, user_text)
+    # Шлюз-классификатор: короткий ответ, маленькая быстрая модель
+    content, _, _ = await ask_brain(
+        system_prompt, user_text, on_queue=queue_notifier(status_msg) if status_msg else None,
+        route="ai_team.analyze_input"
+    )
     
     if "APPROVED" in content:
         return True, ""
@@ -69,7 +80,7 @@ async def initial_check(message: Message, state: FSMContext):
     msg = await message.answer("🧐 PM читает ТЗ...")
 
     # PM анализирует ввод
-    is_good, response = await analyze_input(user_idea)
+    is_good, response = await analyze_input(user_idea, msg)
     
     await msg.delete()
 
@@ -103,26 +114,27 @@ async def start_consilium_logic(message: Message, full_task: str):
     try:
         # 1. PM (План)
         pm_msg = await message.answer("1️⃣ **PM** строит структуру...")
-        pm_text, pm_info = await run_agent("pm", f"Задача: {full_task}")
+        pm_text, pm_info = await run_agent("pm", f"Задача: {full_task}", pm_msg)
         await pm_msg.delete()
         await safe_reply(message, "👷‍♂️ **PM (План):**", pm_text, pm_info)
 
         # 2. Аналитик
         an_msg = await message.answer("2️⃣ **Аналитик** ищет риски...")
-        an_text, an_info = await run_agent("analyst", f"Задача: {full_task}\n\nПлан PM: {pm_text}")
+        an_text, an_info = await run_agent("analyst", f"Задача: {full_task}\n\nПлан PM: {pm_text}", an_msg)
         await an_msg.delete()
         await safe_reply(message, "🕵️‍♂️ **Аналитик:**", an_text, an_info)
 
         # 3. Маркетолог
         mark_msg = await message.answer("🤑 **Маркетолог** считает...")
-        mark_text, mark_info = await run_agent("marketer", f"Задача: {full_task}\n\nКонтекст: {pm_text}")
+        mark_text, mark_info = await run_agent("marketer", f"Задача: {full_task}\n\nКонтекст: {pm_text}", mark_msg)
         await mark_msg.delete()
         await safe_reply(message, "🤑 **Маркетолог:**", mark_text, mark_info)
 
         # 4. Финал (PM v2)
         fin_msg = await message.answer("🏁 **PM** подводит итог...")
         fin_text, fin_info = await run_agent("pm", 
-            f"Финальный план.\nЗадача: {full_task}\nКритика: {an_text}\nМаркетинг: {mark_text}"
+            f"Финальный план.\nЗадача: {full_task}\nКритика: {an_text}\nМаркетинг: {mark_text}",
+            fin_msg
         )
         await fin_msg.delete()
         await safe_reply(message, "🚀 **Roadmap:**", fin_text, fin_info)
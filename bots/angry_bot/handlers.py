@@ -1,7 +1,7 @@
 from aiogram import Router
 from aiogram.types import Message
 from aiogram.filters import CommandStart
-from utils.ai_engine import ask_brain, safe_reply
+from utils.ai_engine import BrainStream, queue_notifier, stream_reply
 
 router = Router()
 
@@ -11,11 +11,15 @@ async def cmd_start(message: Message):
 
 @router.message()
 async def handle_roast(message: Message):
+    if not message.text:
+        await message.answer("Пришлите идею текстом — её и разнесу.")
+        return
     msg = await message.answer("🔥 Ищу недостатки...")
     
     sys_prompt = "Ты злой, циничный критик. Унижай идею пользователя фактами и сарказмом. Будь краток."
     
-    text, model, src = await ask_brain(sys_prompt, message.text)
-    
-    await msg.delete()
-    await safe_reply(message, "💀 **Вердикт:**", text, f"{model} | {src}")
+    # Ответ появляется по мере генерации прямо в статус-сообщении
+    await stream_reply(message, "💀 **Вердикт:**", BrainStream(
+        sys_prompt, message.text, cache_ttl=6 * 3600, on_queue=queue_notifier(msg),
+        route="angry_bot.verdict"
+    ), status_msg=msg)
@@ -0,0 +1,116 @@
+"""
+Движки распознавания речи для голосовых Незабудки
+
+Все движки принимают PCM 16 бит моно (SAMPLE_RATE) и возвращают текст
+("" — речи не распознано). Вызываются внутри воркеров пула процессов
+(bots/nezabudka/voice.py), поэтому могут блокировать.
+
+  google — recognize_google из SpeechRecognition (по умолчанию, нужен интернет)
+  vosk   — офлайн на CPU; pip install vosk + модель в VOSK_MODEL_PATH
+  stub   — детерминированная заглушка для тестов, без сети и моделей
+
+Выбор: VOICE_ASR=google|vosk|stub
+"""
+import json
+import os
+
+from pydub.silence import detect_nonsilent
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+VOICE_ASR = os.getenv("VOICE_ASR", "google").lower()
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "models/vosk-model-small-ru")
+# Длинные голосовые режем по паузам на куски не длиннее этого (сек)
+VOICE_CHUNK_SEC = float(os.getenv("VOICE_CHUNK_SEC", 20))
+
+
+class GoogleASR:
+    def __init__(self):
+        import speech_recognition as sr
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+
+    def recognize(self, pcm: bytes, language: str) -> str:
+        audio = self._sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return self._recognizer.recognize_google(audio, language=language)
+        except self._sr.UnknownValueError:
+            return ""
+
+
+class VoskASR:
+    def __init__(self):
+        try:
+            from vosk import KaldiRecognizer, Model, SetLogLevel
+        except ImportError:
+            raise RuntimeError("VOICE_ASR=vosk, но пакет vosk не установлен (pip install vosk)")
+        if not os.path.isdir(VOSK_MODEL_PATH):
+            raise RuntimeError(f"Модель Vosk не найдена: {VOSK_MODEL_PATH}")
+        SetLogLevel(-1)
+        self._recognizer_cls = KaldiRecognizer
+        # Модель грузится один раз на процесс-воркер
+        self._model = Model(VOSK_MODEL_PATH)
+
+    def recognize(self, pcm: bytes, language: str) -> str:
+        recognizer = self._recognizer_cls(self._model, SAMPLE_RATE)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+class StubASR:
+    """Текст зависит только от длины аудио — удобно проверять нарезку и склейку"""
+
+    def recognize(self, pcm: bytes, language: str) -> str:
+        seconds = len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
+        return f"фрагмент {seconds:.1f} с"
+
+
+BACKENDS = {
+    'google': GoogleASR,
+    'vosk': VoskASR,
+    'stub': StubASR,
+}
+
+_instances = {}
+
+
+def get_backend(name: str = VOICE_ASR):
+    """Экземпляр движка, один на процесс"""
+    if name not in _instances:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown ASR backend: {name}")
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
+
+
+def split_on_silence(segment, max_ms: int = int(VOICE_CHUNK_SEC * 1000)) -> list:
+    """
+    Нарезка AudioSegment по паузам на куски ≤ max_ms.
+    Соседние фразы склеиваются, пока влезают; режем по середине паузы,
+    чтобы не обрезать слова. Фраза без пауз длиннее max_ms режется как есть
+    """
+    if len(segment) <= max_ms:
+        return [segment]
+
+    ranges = detect_nonsilent(segment, min_silence_len=400,
+                              silence_thresh=segment.dBFS - 16, seek_step=10)
+    if not ranges:
+        return []
+
+    bounds = []  # [начало, конец] кусков в мс
+    for start, end in ranges:
+        if bounds and end - bounds[-1][0] <= max_ms:
+            bounds[-1][1] = end
+            continue
+        if bounds:
+            # Граница — середина паузы между кусками
+            cut = (bounds[-1][1] + start) // 2
+            bounds[-1][1] = cut
+            start = cut
+        while end - start > max_ms:
+            bounds.append([start, start + max_ms])
+            start += max_ms
+        bounds.append([start, end])
+
+    return [segment[start:end] for start, end in bounds]
@@ -0,0 +1,82 @@
+"""
+Микро-батчинг сообщений Незабудки
+
+Сообщения одного пользователя, пришедшие в течение окна (NEZABUDKA_BATCH_MS),
+собираются в одну пачку: один запрос к Gateway, один insert_many, одно
+подтверждение. Хендлер не ждёт окно — пачку обрабатывает фоновая задача,
+иначе при очереди апдейтов по чату (utils/update_queue.py) следующие
+сообщения того же чата не дошли бы до буфера.
+При остановке flush_all() отправляет всё, что ещё ждёт конца окна.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TaskBatcher:
+    def __init__(self, window_ms: int, flush, max_items: int = 20):
+        """flush(items) — корутина, items: [(message, text), ...] в порядке прихода"""
+        self.window = window_ms / 1000
+        self.flush = flush
+        self.max_items = max_items
+        self._pending = {}  # user_id → [(message, text)]
+        self._timers = {}   # user_id → asyncio.Task
+        self._tasks = set()  # все фоновые задачи: сильные ссылки, чтобы их не собрал GC
+        self.batches = 0
+        self.items = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def add(self, user_id: int, message, text: str):
+        items = self._pending.setdefault(user_id, [])
+        items.append((message, text))
+        if len(items) >= self.max_items:
+            # Пачка набралась — не ждём конца окна
+            timer = self._timers.pop(user_id, None)
+            if timer:
+                timer.cancel()
+            self._spawn(user_id, delay=0)
+        elif user_id not in self._timers:
+            self._spawn(user_id, delay=self.window)
+
+    def _spawn(self, user_id: int, delay: float):
+        task = asyncio.create_task(self._run(user_id, delay))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if delay:
+            self._timers[user_id] = task
+
+    async def _run(self, user_id: int, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+            self._timers.pop(user_id, None)
+        items = self._pending.pop(user_id, [])
+        if not items:
+            return
+        self.batches += 1
+        self.items += len(items)
+        try:
+            await self.flush(items)
+        except Exception as e:
+            logger.error(f"❌ Task batch flush failed ({len(items)} items): {e}")
+
+    async def flush_all(self):
+        """Остановка бота: не ждём окон, отправляем накопленное и дожидаемся текущих пачек"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for user_id in list(self._pending):
+            self._spawn(user_id, delay=0)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            'window_ms': int(self.window * 1000),
+            'pending_users': len(self._pending),
+            'batches': self.batches,
+            'avg_batch': round(self.items / self.batches, 2) if self.batches else 0,
+        }
@@ -1,7 +1,23 @@
 import os
+import time
 import asyncio
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+from utils.activity import rebuild_summary, seed_sketches
+from utils.metrics import MONGO_LATENCY
+from utils.mongo_indexes import ensure_indexes
+
+# /stats отдаётся из памяти, пока свежее этого (сек)
+STATS_CACHE_TTL = int(os.getenv("NEZABUDKA_STATS_TTL", 30))
+# Сводка активности старше этого (сек) пересчитывается при чтении
+STATS_SUMMARY_MAX_AGE = int(os.getenv("NEZABUDKA_STATS_SUMMARY_AGE", 600))
+# Снимок последнего /list: номер → _id для /done, и кэш самого списка
+LIST_CACHE_TTL = int(os.getenv("NEZABUDKA_LIST_TTL", 600))
+LIST_CACHE_USERS = int(os.getenv("NEZABUDKA_LIST_USERS", 5000))
+LIST_LIMIT = 30
 
 class Database:
     def __init__(self):
@@ -10,6 +26,10 @@ class Database:
         self.mongo_db_name = "nezabudka_ai" 
         self.mongo_client = None
         self.mongo_db = None
+        self._stats_cache = None  # (время, результат)
+        # user_id → {'at', 'limit', 'tasks', 'stale'}; stale — список изменился,
+        # /list перечитает базу, но /done N ещё нумерует по показанному снимку
+        self._lists = OrderedDict()
 
     async def connect(self):
         if self.mongo_db is not None: return
@@ -24,40 +44,64 @@ class Database:
             )
             self.mongo_db = self.mongo_client[self.mongo_db_name]
             print(f"DB: Connected to {self.mongo_db_name}", flush=True)
+            # Индексы строим в фоне, чтобы не задерживать первый запрос
+            self._indexes_task = asyncio.ensure_future(ensure_indexes(self.mongo_db))
         except Exception as e:
             print(f"⛔ Mongo init error: {e}", flush=True)
 
-    # --- USER TRACKING (Analytics) ---
-    async def track_activity(self, user):
-        """Записываем активность юзера (как в боте на Dallas)"""
-        if self.mongo_db is None: await self.connect()
-        if self.mongo_db is None or user is None: return
-
-        try:
-            doc = {
-                'username': user.username,
-                'first_name': user.first_name,
-                'last_active_at': datetime.utcnow()
-            }
-            # Upsert: обновляем или создаем
-            await self.mongo_db.users.update_one(
-                {'_id': user.id},
-                {'$set': doc, '$setOnInsert': {'joined_at': datetime.utcnow()}, '$inc': {'interaction_count': 1}},
-                upsert=True
-            )
-        except Exception as e:
-            print(f"Analytics Error: {e}", flush=True)
-
     # --- TASKS ---
     async def add_task(self, task_doc: dict):
         if self.mongo_db is None: await self.connect()
         try:
             if "status" not in task_doc: task_doc["status"] = "pending"
-            res = await self.mongo_db.tasks.insert_one(task_doc)
+            with MONGO_LATENCY.time(db=self.mongo_db_name, op="tasks.insert_one"):
+                res = await self.mongo_db.tasks.insert_one(task_doc)
+            self._invalidate_list(task_doc.get("user_id"))
+            await self._bump_stats(tasks_total=1, tasks_pending=1)
             return res.inserted_id
         except Exception: return None
 
-    async def get_active_tasks(self, user_id: int, limit=50):
+    async def add_tasks(self, task_docs: list):
+        """Пачка задач одним insert_many; возвращает _id в том же порядке"""
+        if not task_docs: return []
+        if self.mongo_db is None: await self.connect()
+        try:
+            for doc in task_docs:
+                doc.setdefault("status", "pending")
+            with MONGO_LATENCY.time(db=self.mongo_db_name, op="tasks.insert_many"):
+                res = await self.mongo_db.tasks.insert_many(task_docs)
+            for user_id in {doc.get("user_id") for doc in task_docs}:
+                self._invalidate_list(user_id)
+            await self._bump_stats(tasks_total=len(res.inserted_ids), tasks_pending=len(res.inserted_ids))
+            return res.inserted_ids
+        except Exception: return []
+
+    # --- СНИМОК СПИСКА ---
+    def _snapshot(self, user_id: int):
+        snap = self._lists.get(user_id)
+        if snap is None:
+            return None
+        if time.monotonic() - snap['at'] > LIST_CACHE_TTL:
+            del self._lists[user_id]
+            return None
+        return snap
+
+    def _remember_list(self, user_id: int, tasks: list, limit: int):
+        self._lists[user_id] = {'at': time.monotonic(), 'limit': limit, 'tasks': tasks, 'stale': False}
+        self._lists.move_to_end(user_id)
+        while len(self._lists) > LIST_CACHE_USERS:
+            self._lists.popitem(last=False)
+
+    def _invalidate_list(self, user_id: int):
+        snap = self._lists.get(user_id)
+        if snap is not None:
+            snap['stale'] = True
+
+    async def get_active_tasks(self, user_id: int, limit=LIST_LIMIT):
+        snap = self._snapshot(user_id)
+        if snap and not snap['stale'] and snap['limit'] >= limit:
+            return snap['tasks'][:limit]
+        
         if self.mongo_db is None: await self.connect()
         try:
             # Сортировка: Сначала новые (как в Dallas: DESCENDING)
@@ -67,19 +111,21 @@ class Database:
                 {"user_id": user_id, "status": "pending"}
             ).sort("created_at", -1).limit(limit)
             
-            tasks = await cursor.to_list(length=limit)
+            with MONGO_LATENCY.time(db=self.mongo_db_name, op="tasks.find"):
+                tasks = await cursor.to_list(length=limit)
+            self._remember_list(user_id, tasks, limit)
             return tasks # Возвращаем как есть (самые свежие первыми)
         except Exception: return []
 
     async def mark_done_by_index(self, user_id: int, index: int):
         """
-        Находит N-ю задачу в списке активных и помечает DONE.
-        Index 1-based (1, 2, 3...)
+        Помечает DONE задачу под номером N из последнего показанного /list.
+        Index 1-based (1, 2, 3...); 1 = самая верхняя в выводе /list.
+        Номера берутся из снимка, поэтому задача, добавленная после /list,
+        не сдвигает нумерацию
         """
-        tasks = await self.get_active_tasks(user_id, limit=50)
-        # В Dallas список переворачивался (tasks.reverse()), значит 1 - это самая старая?
-        # Или самая новая? Обычно 1 - это то, что сверху.
-        # Давайте считать 1 = самая верхняя в выводе /list.
+        snap = self._snapshot(user_id)
+        tasks = snap['tasks'] if snap else await self.get_active_tasks(user_id, limit=LIST_LIMIT)
         
         if index < 1 or index > len(tasks):
             return None
@@ -88,34 +134,83 @@ class Database:
         target_task = tasks[index - 1] 
         task_id = target_task['_id']
         
-        await self.mongo_db.tasks.update_one(
-            {'_id': task_id},
-            {'$set': {'status': 'done'}}
-        )
+        if self.mongo_db is None: await self.connect()
+        with MONGO_LATENCY.time(db=self.mongo_db_name, op="tasks.update_one"):
+            res = await self.mongo_db.tasks.update_one(
+                {'_id': task_id, 'status': 'pending'},
+                {'$set': {'status': 'done'}}
+            )
+        if not res.modified_count:
+            # Уже выполнена (повторный /done с тем же номером)
+            return None
+        self._invalidate_list(user_id)
+        await self._bump_stats(tasks_pending=-1)
         return target_task.get('action', 'Задача')
 
     # --- STATS ---
+    # Документ stats {_id: "global"}: счётчики задач ведутся здесь через $inc,
+    # users_total и сводка активности stats.activity — в utils/activity.py
+    async def _bump_stats(self, **inc):
+        try:
+            with MONGO_LATENCY.time(db=self.mongo_db_name, op="stats.update_one"):
+                await self.mongo_db.stats.update_one({'_id': 'global'}, {'$inc': inc}, upsert=True)
+        except Exception as e:
+            print(f"Stats update error: {e}", flush=True)
+
+    async def _seed_stats(self, doc):
+        """
+        Первый запуск на старой базе: один раз считаем счётчики честно.
+        Пишем разницу через $inc, а не $set, чтобы не затереть $inc,
+        пришедшие от ботов, пока идёт подсчёт
+        """
+        doc = doc or {}
+        with MONGO_LATENCY.time(db=self.mongo_db_name, op="stats.seed"):
+            counts = {
+                'users_total': await self.mongo_db.users.count_documents({}),
+                'tasks_total': await self.mongo_db.tasks.count_documents({}),
+                'tasks_pending': await self.mongo_db.tasks.count_documents({"status": "pending"}),
+            }
+            try:
+                await self.mongo_db.stats.update_one(
+                    {'_id': 'global', 'seeded_at': {'$exists': False}},
+                    {'$inc': {k: v - doc.get(k, 0) for k, v in counts.items()},
+                     '$set': {'seeded_at': datetime.utcnow()}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                pass  # Параллельно посчитал другой воркер
+        print(f"DB: stats seeded {counts}", flush=True)
+
     async def get_global_stats(self):
+        if self._stats_cache and time.monotonic() - self._stats_cache[0] < STATS_CACHE_TTL:
+            return self._stats_cache[1]
         if self.mongo_db is None: await self.connect()
         if self.mongo_db is None: return {}
         try:
-            now = datetime.utcnow()
-            day_ago = now - timedelta(days=1)
-            week_ago = now - timedelta(days=7)
-
-            # Users
-            u_total = await self.mongo_db.users.count_documents({})
-            u_24h = await self.mongo_db.users.count_documents({"last_active_at": {"$gte": day_ago}})
-            u_7d = await self.mongo_db.users.count_documents({"last_active_at": {"$gte": week_ago}})
-
-            # Tasks
-            t_total = await self.mongo_db.tasks.count_documents({})
-            t_pending = await self.mongo_db.tasks.count_documents({"status": "pending"})
-
-            return {
-                "u_total": u_total, "u_24h": u_24h, "u_7d": u_7d,
-                "t_total": t_total, "t_pending": t_pending
+            with MONGO_LATENCY.time(db=self.mongo_db_name, op="stats.find_one"):
+                doc = await self.mongo_db.stats.find_one({'_id': 'global'})
+
+            # Разовые шаги на старой базе; дальше /stats — только этот find_one
+            if not doc or 'seeded_at' not in doc or 'sketches_seeded_at' not in doc:
+                if not doc or 'seeded_at' not in doc:
+                    await self._seed_stats(doc)
+                if not doc or 'sketches_seeded_at' not in doc:
+                    await seed_sketches(self.mongo_db)
+                await rebuild_summary(self.mongo_db)
+                doc = await self.mongo_db.stats.find_one({'_id': 'global'})
+
+            # Сводку пересчитывает flush активности; если активности давно не было — сами
+            summary = doc.get('activity')
+            if not summary or datetime.utcnow() - summary['at'] > timedelta(seconds=STATS_SUMMARY_MAX_AGE):
+                summary = await rebuild_summary(self.mongo_db)
+
+            result = {
+                "u_total": doc.get('users_total', 0), "u_24h": summary['u_24h'], "u_7d": summary['u_7d'],
+                "t_total": doc.get('tasks_total', 0), "t_pending": doc.get('tasks_pending', 0),
+                "history": summary['history']
             }
+            self._stats_cache = (time.monotonic(), result)
+            return result
         except Exception: return {}
 
 db = Database()
@@ -0,0 +1,218 @@
+"""
+Локальное извлечение задачи из короткого текста без LLM
+
+"купить молоко завтра в 9 #дом" → {type, action, tag, deadline, due_at}
+Понимает хэштеги, маркеры "идея:/задача:", относительные даты
+(сегодня, завтра, через 3 дня, в пятницу, 15 ноября, 15.11), время
+(в 15:00, в 7 вечера, через 2 часа). Возвращает уверенность 0..1 —
+ниже порога текст уходит в Gateway как раньше.
+"""
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+    TZ = ZoneInfo(os.getenv('NEZABUDKA_TZ', 'Europe/Moscow'))
+except Exception:
+    # Нет tzdata в образе — московское время фиксированным смещением
+    TZ = timezone(timedelta(hours=3))
+
+DEFAULT_TAG = '#inbox'
+
+MARKERS = {
+    'идея': 'Идея', 'мысль': 'Идея',
+    'задача': 'Задача', 'сделать': 'Задача', 'todo': 'Задача',
+    'заметка': 'Заметка',
+}
+# Маркеры-глаголы — часть действия: "сделать уроки" → "Сделать уроки"
+VERB_MARKERS = {'сделать'}
+WEEKDAYS = {
+    'понедельник': 0, 'вторник': 1, 'среду': 2, 'среда': 2, 'четверг': 3,
+    'пятницу': 4, 'пятница': 4, 'субботу': 5, 'суббота': 5,
+    'воскресенье': 6,
+}
+MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12,
+}
+DAY_PARTS = {'утром': 9, 'днём': 13, 'днем': 13, 'вечером': 19, 'ночью': 23}
+
+_HASHTAG = re.compile(r'#[\w-]+')
+_MARKER = re.compile(r'^\s*(' + '|'.join(MARKERS) + r')\b\s*[:\-—]?\s*', re.IGNORECASE)
+_RELATIVE_DAY = re.compile(r'\b(сегодня|послезавтра|завтра)\b', re.IGNORECASE)
+_IN_DAYS = re.compile(
+    r'\bчерез\s+(\d+|пару|неделю|месяц)?\s*(дн\w*|день|недел\w*|месяц\w*)?', re.IGNORECASE)
+_IN_HOURS = re.compile(r'\bчерез\s+(\d+|пару|полчаса)?\s*(час\w*|минут\w*)?', re.IGNORECASE)
+_WEEKDAY = re.compile(
+    r'\b(?:во?\s+)?(?:(следующ\w+)\s+)?(' + '|'.join(WEEKDAYS) + r')\b', re.IGNORECASE)
+_WEEKEND = re.compile(r'\bна\s+выходных\b', re.IGNORECASE)
+_MONTH_DATE = re.compile(r'\b(?:к\s+|до\s+)?(\d{1,2})\s+(' + '|'.join(MONTHS) + r')(?:\s+(\d{4}))?\b', re.IGNORECASE)
+_NUMERIC_DATE = re.compile(r'\b(?:к\s+|до\s+)?(\d{1,2})[./](\d{1,2})(?:[./](\d{2,4}))?\b')
+_CLOCK = re.compile(r'\b(?:в|к|до)?\s*([01]?\d|2[0-3]):([0-5]\d)\b', re.IGNORECASE)
+_HOUR_WORD = re.compile(r'\b(?:в|к|до)\s+(\d{1,2})\s*(утра|дня|вечера|ночи|ч\b|час\w*)', re.IGNORECASE)
+_DAY_PART = re.compile(r'\b(' + '|'.join(DAY_PARTS) + r')\b', re.IGNORECASE)
+
+# Что-то похожее на дату/время, но не разобранное — отдаём LLM
+_LEFTOVER = re.compile(
+    r'\b(через|числа|недел\w*|месяц\w*|год\w*|выходн\w*|утра|вечера|'
+    r'понедельник\w*|вторник\w*|сред\w*|четверг\w*|пятниц\w*|суббот\w*|воскресень\w*|'
+    + '|'.join(m[:4] + r'\w*' for m in MONTHS) + r')\b|\d', re.IGNORECASE)
+
+
+def _cut(text: str, match) -> str:
+    return text[:match.start()] + ' ' + text[match.end():]
+
+
+def _parse_date(text: str, now: datetime):
+    """(дата или None, точное время задано?, остаток текста)"""
+    due, has_time = None, False
+
+    match = _RELATIVE_DAY.search(text)
+    if match:
+        shift = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}[match.group(1).lower()]
+        due = now + timedelta(days=shift)
+        text = _cut(text, match)
+
+    match = _IN_HOURS.search(text)
+    if due is None and match and (match.group(2) or match.group(1) == 'полчаса'):
+        amount = (match.group(1) or '1').lower()
+        minutes = 30 if amount == 'полчаса' else (2 if amount == 'пару' else int(amount))
+        if (match.group(2) or '').lower().startswith('час'):
+            minutes *= 60
+        due, has_time = now + timedelta(minutes=minutes), True
+        text = _cut(text, match)
+
+    match = _IN_DAYS.search(text)
+    if due is None and match and (match.group(1) or match.group(2)):
+        amount, unit = (match.group(1) or '1').lower(), (match.group(2) or '').lower()
+        if amount in ('неделю', 'месяц'):
+            unit, amount = amount, '1'
+        count = 2 if amount == 'пару' else int(amount)
+        days = count * (7 if unit.startswith('недел') else 30 if unit.startswith('месяц') else 1)
+        due = now + timedelta(days=days)
+        text = _cut(text, match)
+
+    match = _WEEKDAY.search(text)
+    if due is None and match:
+        ahead = (WEEKDAYS[match.group(2).lower()] - now.weekday()) % 7 or 7
+        if match.group(1) and ahead < 7 - now.weekday():
+            # "в следующий вторник" — на следующей неделе, а не на этой
+            ahead += 7
+        due = now + timedelta(days=ahead)
+        text = _cut(text, match)
+
+    match = _WEEKEND.search(text)
+    if due is None and match:
+        due = now + timedelta(days=(5 - now.weekday()) % 7 or 7)
+        text = _cut(text, match)
+
+    match = _MONTH_DATE.search(text)
+    if due is None and match:
+        due = _calendar_date(now, int(match.group(1)), MONTHS[match.group(2).lower()], match.group(3))
+        if due is not None:
+            text = _cut(text, match)
+
+    match = _NUMERIC_DATE.search(text)
+    if due is None and match:
+        due = _calendar_date(now, int(match.group(1)), int(match.group(2)), match.group(3))
+        if due is not None:
+            text = _cut(text, match)
+
+    return due, has_time, text
+
+
+def _calendar_date(now: datetime, day: int, month: int, year: str = None):
+    try:
+        if year:
+            year = int(year) + (2000 if len(year) == 2 else 0)
+            return now.replace(year=year, month=month, day=day)
+        due = now.replace(month=month, day=day)
+        # Прошедшая дата без года — следующий год
+        return due if due.date() >= now.date() else due.replace(year=now.year + 1)
+    except ValueError:
+        return None
+
+
+def _parse_time(text: str):
+    """((час, минута) или None, остаток текста)"""
+    match = _CLOCK.search(text)
+    if match:
+        return (int(match.group(1)), int(match.group(2))), _cut(text, match)
+
+    match = _HOUR_WORD.search(text)
+    if match:
+        hour, part = int(match.group(1)), match.group(2).lower()
+        if part in ('дня', 'вечера') and hour < 12:
+            hour += 12
+        elif part == 'ночи' and hour == 12:
+            hour = 0
+        if hour < 24:
+            return (hour, 0), _cut(text, match)
+
+    match = _DAY_PART.search(text)
+    if match:
+        return (DAY_PARTS[match.group(1).lower()], 0), _cut(text, match)
+    return None, text
+
+
+def extract(text: str, now: datetime = None):
+    """
+    (data, confidence): data в формате ответа LLM (type, action, tag, deadline)
+    плюс due_at (UTC) если срок распознан
+    """
+    now = now or datetime.now(TZ)
+    original = text.strip()
+    confidence = 0.6 if len(original) <= 80 else 0.4 if len(original) <= 160 else 0.1
+    if '\n' in original or '?' in original:
+        confidence -= 0.3
+
+    tags = _HASHTAG.findall(original)
+    rest = _HASHTAG.sub(' ', original)
+
+    task_type = 'Задача'
+    match = _MARKER.match(rest)
+    if match:
+        marker = match.group(1)
+        task_type = MARKERS[marker.lower()]
+        rest = rest[match.end():]
+        if marker.lower() in VERB_MARKERS:
+            rest = f"{marker} {rest}"
+        confidence += 0.15
+
+    due, has_time, rest = _parse_date(rest, now)
+    clock, rest = (None, rest) if has_time else _parse_time(rest)
+    if clock is not None:
+        dated = due is not None
+        due = (due or now).replace(hour=clock[0], minute=clock[1], second=0, microsecond=0)
+        if due < now and not dated:
+            # "в 9 утра" без даты, когда 9 уже прошло — завтра
+            due += timedelta(days=1)
+        has_time = True
+
+    action = re.sub(r'\s+', ' ', rest).strip(' ,.;:-—')
+    if _LEFTOVER.search(action):
+        confidence -= 0.4
+    if not action:
+        return {}, 0.0
+    if due is not None:
+        confidence += 0.2
+    if tags:
+        confidence += 0.15
+
+    deadline = 'нет'
+    if due is not None:
+        if not has_time:
+            # Срок без времени — до конца дня
+            due = due.replace(hour=23, minute=59, second=0, microsecond=0)
+        deadline = due.strftime('%d.%m.%Y %H:%M' if has_time else '%d.%m.%Y')
+
+    data = {
+        'type': task_type,
+        'action': action[0].upper() + action[1:],
+        'tag': ' '.join(tags) if tags else DEFAULT_TAG,
+        'deadline': deadline,
+    }
+    if due is not None:
+        data['due_at'] = due.astimezone(timezone.utc).replace(tzinfo=None)
+    return data, round(max(0.0, min(confidence, 1.0)), 2)
@@ -1,35 +1,37 @@
 import logging
 import json
 import html
+import io
 import os
 import re
 from datetime import datetime
 
-import speech_recognition as sr
-from pydub import AudioSegment
-
 from aiogram import Router, F
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, BotCommand
 from aiogram.filters import Command, CommandObject
 
-from utils.ai_engine import ask_brain, safe_reply
-from .database import db
+from utils.ai_engine import ask_brain, edit_throttled, safe_reply
+from utils.metrics import TASK_EXTRACT
+from .database import LIST_LIMIT, db
+from .extractor import extract
+from .batcher import TaskBatcher
+from .voice import VoiceBusy, voice
+
+# Уверенность локального разбора, начиная с которой Gateway не вызываем
+RULES_THRESHOLD = float(os.getenv("NEZABUDKA_RULES_THRESHOLD", 0.7))
 
+logger = logging.getLogger(__name__)
 router = Router()
 
 # Версия, соответствующая функционалу
 VERSION = "2.2 (Gateway + Restore)"
 
-# --- СЛУЖЕБНЫЕ ФУНКЦИИ ---
-async def track_and_auth(message: Message):
-    """Трекинг активности пользователя"""
-    await db.track_activity(message.from_user)
+# Трекинг активности — общий write-behind middleware (utils/activity.py)
 
 # --- ХЕНДЛЕРЫ ---
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
-    await track_and_auth(message)
     await message.answer(
         f"👋 <b>Незабудка AI</b> {VERSION}\n\n"
         "Я восстановлена и работаю с вашей старой базой!\n"
@@ -43,7 +45,6 @@ async def cmd_start(message: Message):
 
 @router.message(Command("help"))
 async def cmd_help(message: Message):
-    await track_and_auth(message)
     text = (
         "🤖 <b>Помощь:</b>\n"
         "1. Просто напиши текст или запиши голосовое — я создам задачу.\n"
@@ -55,7 +56,6 @@ async def cmd_help(message: Message):
 
 @router.message(Command("stats"))
 async def cmd_stats(message: Message):
-    await track_and_auth(message)
     s = await db.get_global_stats()
     if not s:
         await message.answer("Статистика недоступна (ошибка БД).")
@@ -71,12 +71,17 @@ async def cmd_stats(message: Message):
         f"• Всего: {s.get('t_total', 0)}\n"
         f"• В работе: {s.get('t_pending', 0)}"
     )
+    history = s.get('history') or []
+    if len(history) > 1:
+        # Активные пользователи по дням (из дневных скетчей)
+        peak = max(users for _, _, users in history) or 1
+        bars = "".join("▁▂▃▄▅▆▇█"[round(users / peak * 7)] for _, _, users in history)
+        text += f"\n\n📈 <b>Активность за {len(history)} дн.:</b> <code>{bars}</code> (пик {peak})"
     await message.answer(text, parse_mode="HTML")
 
 @router.message(Command("list"))
 async def cmd_list(message: Message):
-    await track_and_auth(message)
-    tasks = await db.get_active_tasks(message.from_user.id, limit=30)
+    tasks = await db.get_active_tasks(message.from_user.id, limit=LIST_LIMIT)
     
     if not tasks:
         await message.answer("📭 Список задач пуст.")
@@ -97,7 +102,6 @@ async def cmd_list(message: Message):
 
 @router.message(Command("done"))
 async def cmd_done(message: Message, command: CommandObject):
-    await track_and_auth(message)
     if not command.args:
         await message.answer("⚠️ Используйте: <code>/done 1</code> (номер задачи из списка)")
         return
@@ -109,7 +113,7 @@ async def cmd_done(message: Message, command: CommandObject):
         if task_title:
             await message.answer(f"✅ Выполнено: <b>{html.escape(task_title)}</b>", parse_mode="HTML")
         else:
-            await message.answer("❌ Задача с таким номером не найдена (проверьте /list).")
+            await message.answer("❌ Задача с таким номером не найдена или уже выполнена (проверьте /list).")
     except ValueError:
         await message.answer("⚠️ Номер должен быть числом.")
 
@@ -120,73 +124,101 @@ async def cmd_version(message: Message):
 # === ГОЛОСОВОЙ ВВОД (Voice Fix) ===
 @router.message(F.voice)
 async def handle_voice(message: Message):
-    await track_and_auth(message)
-    # Log
-    print(f"DEBUG: Voice from {message.from_user.id}", flush=True)
+    logger.info(f"🎤 Voice from {message.from_user.id}")
     msg = await message.reply("🎧 Слушаю...")
 
-    user_id = message.from_user.id
-    ogg_filename = f"voice_{user_id}.ogg"
-    wav_filename = f"voice_{user_id}.wav"
+    async def show_partial(partial: str):
+        # Длинное голосовое: показываем распознанные куски по мере готовности
+        # (не чаще общего лимита edit на чат — иначе TelegramRetryAfter)
+        await edit_throttled(msg, f"🎧 <i>{html.escape(partial)}</i>", parse_mode="HTML")
 
     try:
+        # Скачиваем в память, распознаём в пуле процессов (bots/nezabudka/voice.py)
         file_info = await message.bot.get_file(message.voice.file_id)
-        await message.bot.download_file(file_info.file_path, ogg_filename)
-        
-        # Convert
-        AudioSegment.from_file(ogg_filename, format="ogg").export(wav_filename, format="wav")
-        
-        # Recognize
-        r = sr.Recognizer()
-        with sr.AudioFile(wav_filename) as source:
-            audio_data = r.record(source)
-            text = r.recognize_google(audio_data, language="ru-RU")
-        
-        await msg.edit_text(f"🗣 <i>{html.escape(text)}</i>", parse_mode="HTML")
-        # Send to processing
-        await process_input(message, text)
-
+        ogg = await message.bot.download_file(file_info.file_path, io.BytesIO())
+        text = await voice.transcribe(ogg.getvalue(), on_partial=show_partial)
+    except VoiceBusy:
+        await edit_throttled(msg, "⏳ Слишком много голосовых сразу. Пришлите через минуту или текстом.", force=True)
+        return
     except Exception as e:
-        print(f"Voice Error: {e}", flush=True)
-        await msg.edit_text("🤷‍♂️ Не расслышал.")
-    finally:
-        if os.path.exists(ogg_filename): os.remove(ogg_filename)
-        if os.path.exists(wav_filename): os.remove(wav_filename)
+        logger.error(f"❌ Voice error: {e}")
+        await edit_throttled(msg, "🤷‍♂️ Не расслышал.", force=True)
+        return
+
+    await edit_throttled(msg, f"🗣 <i>{html.escape(text)}</i>", force=True, parse_mode="HTML")
+    # Send to processing
+    await process_input(message, text)
 
 # === ТЕКСТОВАЯ ОБРАБОТКА И AI ===
-async def process_input(message: Message, text: str):
-    # Промпт в стиле старого бота, но через Gateway
-    sys_prompt = (
-        "Ты — AI-секретарь. Проанализируй текст. Верни JSON.\n"
-        "Поля: type (задача/идея), action (суть), tag (#тег), deadline (строка)."
-    )
-    content, model_info, _ = await ask_brain(sys_prompt, text)
+# Промпт в стиле старого бота, но через Gateway
+EXTRACT_PROMPT = (
+    "Ты — AI-секретарь. Проанализируй текст. Верни JSON.\n"
+    "Поля: type (задача/идея), action (суть), tag (#тег), deadline (строка)."
+)
+BATCH_EXTRACT_PROMPT = (
+    "Ты — AI-секретарь. Тебе дан нумерованный список сообщений пользователя.\n"
+    "Для каждого сообщения верни объект с полями: type (задача/идея), action (суть), tag (#тег), deadline (строка).\n"
+    "Ответ — только JSON-массив объектов в том же порядке и той же длины."
+)
+
+
+def _fallback(text: str) -> dict:
+    # Fallback как в старом боте
+    return {"type": "Заметка", "action": text, "tag": "#inbox", "deadline": "нет"}
+
+
+def _parse_json(content: str, opener: str = '{', closer: str = '}'):
+    start = content.find(opener)
+    end = content.rfind(closer)
+    if start == -1 or end == -1:
+        raise ValueError("No JSON")
+    return json.loads(content[start:end+1])
+
+
+async def extract_task(text: str):
+    """(data, model_info): локальный разбор, если он уверен, иначе Gateway"""
+    # Короткие понятные тексты ("купить молоко завтра #дом") разбираем локально
+    data, confidence = extract(text)
+    if confidence >= RULES_THRESHOLD:
+        TASK_EXTRACT.inc(bot="nezabudka", path="rules")
+        return data, "⚡ rules"
     
-    # Парсинг JSON
+    TASK_EXTRACT.inc(bot="nezabudka", path="llm")
+    content, model_info, _ = await ask_brain(EXTRACT_PROMPT, text, route="nezabudka.extract")
     try:
-        start = content.find('{')
-        end = content.rfind('}')
-        if start != -1 and end != -1:
-            json_str = content[start:end+1]
-            data = json.loads(json_str)
-        else:
-            raise ValueError("No JSON")
-    except:
-        # Fallback как в старом боте
-        data = {"type": "Заметка", "action": text, "tag": "#inbox", "deadline": "нет"}
+        data = _parse_json(content)
+    except Exception:
+        data = _fallback(text)
+    return data, model_info
 
-    # Сохранение
-    task_doc = {
-        "user_id": message.from_user.id,
+
+def _task_doc(user_id: int, data: dict) -> dict:
+    return {
+        "user_id": user_id,
         "type": data.get('type'),
         "action": data.get('action'),
         "tag": data.get('tag'),
         "deadline": data.get('deadline'),
+        "due_at": data.get('due_at'),
         "status": "pending",
         "created_at": datetime.utcnow(),
         "is_parent": False
     }
-    task_id = await db.add_task(task_doc)
+
+
+async def process_input(message: Message, text: str):
+    # Пачки сообщений подряд — одним запросом (если включено окно)
+    if batcher.enabled:
+        batcher.add(message.from_user.id, message, text)
+        return
+    await _save_single(message, text)
+
+
+async def _save_single(message: Message, text: str):
+    data, model_info = await extract_task(text)
+
+    # Сохранение
+    task_id = await db.add_task(_task_doc(message.from_user.id, data))
 
     # Ответ пользователю
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -198,9 +230,77 @@ async def process_input(message: Message, text: str):
     
     await safe_reply(message, header, body, f"{model_info}", reply_markup=kb)
 
+
+async def process_batch(items: list):
+    """
+    Пачка [(message, text)] одного пользователя: локальный разбор где можно,
+    остальное — одним запросом с JSON-массивом, затем один insert_many
+    """
+    if len(items) == 1:
+        await _save_single(*items[0])
+        return
+    
+    message = items[-1][0]
+    results = [None] * len(items)
+    sources = []
+    llm_indexes = []
+    for i, (_, text) in enumerate(items):
+        data, confidence = extract(text)
+        if confidence >= RULES_THRESHOLD:
+            results[i] = data
+        else:
+            llm_indexes.append(i)
+    if len(llm_indexes) < len(items):
+        TASK_EXTRACT.inc(len(items) - len(llm_indexes), bot="nezabudka", path="rules")
+        sources.append("⚡ rules")
+    
+    if len(llm_indexes) == 1:
+        i = llm_indexes[0]
+        results[i], model_info = await extract_task(items[i][1])
+        sources.append(model_info)
+    elif llm_indexes:
+        TASK_EXTRACT.inc(len(llm_indexes), bot="nezabudka", path="llm_batch")
+        numbered = "\n".join(f"{n}. {items[i][1]}" for n, i in enumerate(llm_indexes, 1))
+        content, model_info, _ = await ask_brain(BATCH_EXTRACT_PROMPT, numbered, route="nezabudka.extract_batch")
+        try:
+            parsed = _parse_json(content, '[', ']')
+        except Exception:
+            parsed = []
+        for n, i in enumerate(llm_indexes):
+            item = parsed[n] if n < len(parsed) else None
+            results[i] = item if isinstance(item, dict) else _fallback(items[i][1])
+        sources.append(model_info)
+    
+    task_ids = await db.add_tasks([_task_doc(message.from_user.id, data) for data in results])
+    if not task_ids:
+        await message.answer("❌ Не удалось сохранить задачи, база недоступна. Пришлите их ещё раз чуть позже.")
+        return
+    
+    # Одно подтверждение на всю пачку, кнопка декомпозиции на каждую задачу
+    lines = []
+    buttons = []
+    for n, data in enumerate(results, 1):
+        action = str(data.get('action') or '')
+        lines.append(
+            f"{n}. ▫️ {html.escape(action)}\n"
+            f"🏷 {html.escape(str(data.get('tag') or ''))} | 📅 {data.get('deadline')}"
+        )
+        if n <= len(task_ids):
+            label = action if len(action) <= 28 else action[:27] + "…"
+            buttons.append([InlineKeyboardButton(text=f"⚡ {n}. {label}", callback_data=f"decomp_{task_ids[n - 1]}")])
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+    saved = len(task_ids) if len(task_ids) == len(results) else f"{len(task_ids)} из {len(results)}"
+    header = f"✅ <b>СОХРАНЕНО: {saved}</b>"
+    await safe_reply(message, header, "\n\n".join(lines), " + ".join(sources), reply_markup=kb)
+
+
+batcher = TaskBatcher(int(os.getenv("NEZABUDKA_BATCH_MS", 0)), process_batch)
+# Пачки, ещё ждущие конца окна, дописываем при остановке
+router.shutdown.register(batcher.flush_all)
+
 @router.message(F.text)
 async def handle_text(message: Message):
-    await track_and_auth(message)
     await process_input(message, message.text)
 
 @router.callback_query(F.data.startswith("decomp_"))
@@ -212,6 +312,8 @@ async def handle_decompose(callback: CallbackQuery):
     
     # Можно запросить текст задачи из базы по ID, но пока упростим
     sys_prompt = "Ты PM. Разбей задачу на шаги. JSON: {subtasks: [{title}]}"
-    content, _, _ = await ask_brain(sys_prompt, "Декомпозируй задачу")
+    content, model, src = await ask_brain(
+        sys_prompt, "Декомпозируй задачу", cache_ttl=7 * 24 * 3600, route="nezabudka.decompose"
+    )
     
-    await safe_reply(callback.message, "🔨 <b>План:</b>", content, "AI")
+    await safe_reply(callback.message, "🔨 <b>План:</b>", content, f"AI | {src}")
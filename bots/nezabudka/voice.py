@@ -0,0 +1,158 @@
+"""
+Распознавание голосовых Незабудки вне event loop
+
+Декодирование (ffmpeg через pydub) и распознавание — блокирующие и
+занимают секунды. Они выполняются в пуле процессов (VOICE_WORKERS),
+поэтому пачка голосовых не тормозит текстовые сообщения других
+пользователей. Аудио не пишется на диск: ogg приходит байтами,
+ffmpeg читает его из stdin и отдаёт PCM 16 кГц моно прямо в память.
+
+Длинное голосовое режется по паузам (asr.split_on_silence), куски
+распознаются параллельно на воркерах пула и склеиваются по порядку;
+on_partial получает текст по мере готовности кусков. Движок — VOICE_ASR
+(bots/nezabudka/asr.py).
+
+Одновременно в работе не больше VOICE_WORKERS голосовых, ещё до
+VOICE_MAX_QUEUE ждут своей очереди; остальным сразу отвечаем «занято».
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.metrics import VOICE_CHUNKS, VOICE_ERRORS, VOICE_QUEUED, VOICE_SECONDS, VOICE_WAIT
+from . import asr
+
+logger = logging.getLogger(__name__)
+
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", 2))
+VOICE_MAX_QUEUE = int(os.getenv("VOICE_MAX_QUEUE", 20))
+VOICE_LANGUAGE = os.getenv("VOICE_LANGUAGE", "ru-RU")
+
+
+class VoiceBusy(Exception):
+    """Очередь голосовых заполнена"""
+
+
+class NothingRecognized(Exception):
+    """Ни в одном куске не нашлось речи"""
+
+
+def _decode(ogg_bytes: bytes) -> list:
+    """Выполняется в дочернем процессе: ogg → куски PCM по паузам"""
+    from pydub import AudioSegment
+
+    segment = AudioSegment.from_file(io.BytesIO(ogg_bytes), format="ogg")
+    segment = segment.set_channels(1).set_frame_rate(asr.SAMPLE_RATE).set_sample_width(asr.SAMPLE_WIDTH)
+    return [chunk.raw_data for chunk in asr.split_on_silence(segment)]
+
+
+def _recognize(backend: str, pcm: bytes, language: str) -> str:
+    """Выполняется в дочернем процессе: один кусок → текст"""
+    return asr.get_backend(backend).recognize(pcm, language)
+
+
+class VoicePipeline:
+    def __init__(self, workers: int = VOICE_WORKERS, max_queue: int = VOICE_MAX_QUEUE,
+                 backend: str = asr.VOICE_ASR):
+        self.workers = workers
+        self.backend = backend
+        self.max_queue = max_queue
+        self._pool = None
+        self._slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # spawn, а не fork: дочерний процесс не наследует потоки motor и сокеты event loop
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def transcribe(self, ogg_bytes: bytes, language: str = VOICE_LANGUAGE, on_partial=None) -> str:
+        """
+        Текст голосового. on_partial(text) — корутина, вызывается по мере
+        готовности кусков длинного голосового («…» на месте ещё не готовых)
+        """
+        if self.waiting >= self.max_queue:
+            VOICE_ERRORS.inc(error="busy")
+            raise VoiceBusy()
+
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        VOICE_QUEUED.set(self.waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+            VOICE_QUEUED.set(self.waiting)
+
+        started = time.perf_counter()
+        VOICE_WAIT.observe(started - queued_at)
+        try:
+            return await self._run(ogg_bytes, language, on_partial, started)
+        except BrokenProcessPool:
+            # Воркер упал (например, OOM) — следующий запрос поднимет новый пул
+            logger.error("❌ Voice worker pool is broken, restarting")
+            self._pool = None
+            VOICE_ERRORS.inc(error="BrokenProcessPool")
+            raise
+        except Exception as e:
+            VOICE_ERRORS.inc(error=type(e).__name__)
+            raise
+        finally:
+            self._slots.release()
+
+    async def _run(self, ogg_bytes: bytes, language: str, on_partial, started: float) -> str:
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+
+        chunks = await loop.run_in_executor(pool, _decode, ogg_bytes)
+        VOICE_SECONDS.observe(time.perf_counter() - started, stage="decode")
+        VOICE_CHUNKS.observe(len(chunks))
+
+        async def recognize(index: int, pcm: bytes):
+            chunk_started = time.perf_counter()
+            try:
+                text = await loop.run_in_executor(pool, _recognize, self.backend, pcm, language)
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                # Один неудачный кусок не губит всё голосовое
+                logger.warning(f"⚠️ Voice chunk {index + 1}/{len(chunks)} failed: {e}")
+                VOICE_ERRORS.inc(error=f"chunk_{type(e).__name__}")
+                text = ""
+            VOICE_SECONDS.observe(time.perf_counter() - chunk_started, stage="recognize")
+            return index, text
+
+        # Все куски сразу уходят в пул: свободные воркеры разбирают их параллельно
+        texts = [None] * len(chunks)
+        pending = [asyncio.ensure_future(recognize(i, pcm)) for i, pcm in enumerate(chunks)]
+        try:
+            for next_done in asyncio.as_completed(pending):
+                index, text = await next_done
+                texts[index] = text.strip()
+                if on_partial is not None and len(chunks) > 1 and None in texts:
+                    partial = " ".join("…" if t is None else t for t in texts if t != "")
+                    try:
+                        await on_partial(partial)
+                    except Exception as e:
+                        logger.warning(f"⚠️ Voice partial update failed: {e}")
+        finally:
+            for task in pending:
+                task.cancel()
+
+        VOICE_SECONDS.observe(time.perf_counter() - started, stage="total")
+        text = " ".join(t for t in texts if t)
+        if not text:
+            raise NothingRecognized()
+        return text
+
+
+voice = VoicePipeline()
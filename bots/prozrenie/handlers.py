@@ -3,9 +3,8 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKey
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import db
 # Импортируем наш единый мозг
-from utils.ai_engine import ask_brain, safe_reply
+from utils.ai_engine import BrainStream, queue_notifier, stream_reply
 
 router = Router()
 
@@ -18,10 +17,8 @@ class BrandAnalysis(StatesGroup):
     waiting_for_explanation = State()
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext, bot):
-    user = message.from_user
-    bot_info = await bot.get_me()
-    await db.add_user(user.id, user.username, user.full_name, bot_info.id)
+async def cmd_start(message: Message, state: FSMContext):
+    # Пользователь учитывается в utils/activity.py (middleware для всех ботов)
     await state.clear()
     
     kb = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="🚀 Начать")]], resize_keyboard=True)
@@ -82,13 +79,11 @@ async def finish_survey(message: Message, state: FSMContext):
     3. **3 Гипотезы роста**
     """
     
-    # 1. Запрос в Центр
-    text, model, src = await ask_brain(prompt, str(data))
-    
-    # 2. Удаляем статус
+    # Запрос в Центр: стратегия стримится в новое сообщение
+    # (статус несёт ReplyKeyboardRemove, такое сообщение не редактируем)
+    await stream_reply(message, "📊 **Стратегия:**", BrainStream(
+        prompt, str(data), on_queue=queue_notifier(status), route="prozrenie.strategy"
+    ))
     await status.delete()
     
-    # 3. Безопасная отправка
-    await safe_reply(message, "📊 **Стратегия:**", text, f"{model} | {src}")
-    
     await state.clear()
@@ -1,15 +1,17 @@
+import asyncio
+import html
 import os
-import json
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from aiogram import Router, F, Bot
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from datetime import datetime
+from datetime import datetime, timedelta
 # Импортируем наш мозг для вопросов "не по теме"
-from utils.ai_engine import ask_brain, safe_reply
+from utils.ai_engine import BrainStream, queue_notifier, stream_reply
+from .sheets import SheetsWriter
+from .mirror import ShiftMirror
+from .knowledge import kb
 
 router = Router()
 
@@ -30,31 +32,15 @@ PRICE_ADULT = 160
 PRICE_DISCOUNT = 100
 
 # --- 2. РАБОТА С GOOGLE SHEETS ---
-def add_to_sheet(row_data):
-    try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        
-        if not os.path.exists(JSON_KEYFILE):
-            print(f"DEBUG ERROR: Файл {JSON_KEYFILE} не найден!", flush=True)
-            return False
-
-        with open(JSON_KEYFILE, 'r') as f:
-            creds_dict = json.load(f)
-        
-        if 'private_key' in creds_dict:
-            creds_dict['private_key'] = creds_dict['private_key'].replace('\\n', '\n')
-
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        
-        spreadsheet = client.open_by_key(SPREADSHEET_ID)
-        sheet = spreadsheet.get_worksheet(0) 
-        
-        sheet.append_row(row_data)
-        return True
-    except Exception as e:
-        print(f"🚨 GOOGLE SHEET ERROR: {e}", flush=True)
-        return False
+# Строки копятся в локальном spool и уходят в таблицу пачками фоном (sheets.py)
+sheets = SheetsWriter(SPREADSHEET_ID, JSON_KEYFILE)
+router.startup.register(sheets.start)
+router.shutdown.register(sheets.close)
+
+# Локальное зеркало листа для /summary (mirror.py)
+mirror = ShiftMirror(sheets)
+router.startup.register(mirror.start)
+router.shutdown.register(mirror.close)
 
 # --- 3. СЦЕНАРИЙ ОТЧЕТА (FSM) ---
 class Report(StatesGroup):
@@ -83,6 +69,37 @@ async def cmd_start(message: Message, state: FSMContext):
     await message.answer("👋 Привет! Выберите объект для отчета:", reply_markup=kb)
     await state.set_state(Report.choosing_object)
 
+@router.message(Command("summary"))
+async def cmd_summary(message: Message, command: CommandObject):
+    """/summary day|week — выручка по объектам и сотрудникам из локального зеркала"""
+    period = (command.args or "day").strip().lower()
+    today = datetime.now().date()
+    if period in ("day", "день", "сегодня"):
+        since, title = today, f"за {today.strftime('%d.%m.%Y')}"
+    elif period in ("week", "неделя"):
+        since = today - timedelta(days=today.weekday())
+        title = f"за неделю {since.strftime('%d.%m')}–{today.strftime('%d.%m')}"
+    else:
+        await message.answer("Использование: /summary day или /summary week")
+        return
+
+    by_object, by_staff, pulled_at = await mirror.summary(since.isoformat(), today.isoformat())
+    if not by_object:
+        await message.answer(f"📊 Отчетов {title} нет.")
+        return
+
+    lines = [f"📊 <b>Сводка {title}</b>", "", "<b>По объектам:</b>"]
+    for obj, reports, adults, discount, revenue in by_object:
+        tickets = f", билеты {adults}+{discount}" if adults or discount else ""
+        lines.append(f"{obj} — {revenue} р. ({reports} отч.{tickets})")
+    lines += ["", "<b>По сотрудникам:</b>"]
+    for staff, reports, revenue in by_staff:
+        lines.append(f"{staff} — {revenue} р. ({reports} отч.)")
+    lines += ["", f"💰 Итого: {sum(row[4] for row in by_object)} р."]
+    if pulled_at:
+        lines.append(f"<i>Сверено с таблицей в {datetime.fromtimestamp(pulled_at).strftime('%H:%M')}</i>")
+    await message.answer("\n".join(lines))
+
 @router.message(Report.choosing_object)
 async def step_object(message: Message, state: FSMContext):
     if message.text not in OBJECTS:
@@ -161,31 +178,58 @@ async def step_finish(message: Message, state: FSMContext):
         comment_text
     ]
     
-    msg = await message.answer("⏳ Пишу в таблицу...")
-    if add_to_sheet(row):
-        await msg.edit_text(f"✅ Записано!\n{data['selected_object']} | {data['revenue']} р.")
+    # Сначала зеркало: строка должна быть там раньше, чем её подтянет сверка с листом
+    await mirror.record(row)
+    if await sheets.add(row):
+        await message.answer(f"✅ Записано!\n{data['selected_object']} | {data['revenue']} р.")
     else:
-        await msg.edit_text("❌ Ошибка Google Таблицы.")
+        await message.answer("❌ Ошибка записи отчета.")
     
     await state.clear()
 
-# --- 5. ЛОВУШКА ДЛЯ ВСЕГО ОСТАЛЬНОГО (AI) ---
+# --- 5. ЛОВУШКА ДЛЯ ВСЕГО ОСТАЛЬНОГО (БАЗА ЗНАНИЙ + AI) ---
 # Если пользователь НЕ нажимает кнопки и НЕ в процессе отчета,
-# он попадает сюда. Здесь мы спрашиваем AI.
+# он попадает сюда. Сначала ищем ответ в инструкциях (knowledge.py),
+# AI спрашиваем только если уверенного совпадения нет.
+SYS_PROMPT = (
+    "Ты полезный офисный помощник (HR и Администратор). "
+    "Твоя задача - помогать сотрудникам с вопросами по работе, расписанию или инструкциям."
+)
+
+async def load_knowledge():
+    await asyncio.to_thread(kb.refresh, True)
+
+router.startup.register(load_knowledge)
+
 @router.message()
 async def handle_general_questions(message: Message):
+    if not message.text:
+        await message.answer("Напишите вопрос текстом или отправьте /report для отчета.")
+        return
+
     # Показываем, что думаем
     msg = await message.answer("📁 Ищу информацию...")
-    
-    # Системный промпт для HR-бота
-    sys_prompt = (
-        "Ты полезный офисный помощник (HR и Администратор). "
-        "Твоя задача - помогать сотрудникам с вопросами по работе, расписанию или инструкциям."
-    )
-    
-    # Спрашиваем единый мозг
-    text, model, src = await ask_brain(sys_prompt, message.text)
-    
-    await msg.delete()
-    # Безопасная отправка
-    await safe_reply(message, "📄 **Справка:**", text, f"{model} | {src}")
+
+    hits = kb.search(message.text)
+    if kb.is_confident(hits):
+        passage = hits[0].passage
+        await msg.edit_text(
+            f"📄 <b>Справка:</b>\n\n{html.escape(passage.text)}\n\n"
+            f"⚙️ <i>База знаний · {html.escape(passage.source)}</i>"
+        )
+        return
+
+    # В промпт — только найденные фрагменты инструкций
+    sys_prompt = SYS_PROMPT
+    if hits:
+        excerpts = "\n\n".join(f"[{h.passage.title or h.passage.source}]\n{h.passage.text}" for h in hits)
+        sys_prompt += (
+            "\nОтвечай по внутренним инструкциям ниже; если ответа в них нет, так и скажи.\n\n"
+            f"{excerpts}"
+        )
+
+    # Спрашиваем единый мозг: ответ стримится в статус-сообщение
+    await stream_reply(message, "📄 **Справка:**", BrainStream(
+        sys_prompt, message.text, cache_ttl=24 * 3600, on_queue=queue_notifier(msg),
+        route="staff_bot.answer"
+    ), status_msg=msg)
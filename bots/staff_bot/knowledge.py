@@ -0,0 +1,205 @@
+"""
+База знаний staff_bot: BM25 по внутренним инструкциям
+
+Файлы .md/.txt из STAFF_DOCS_DIR режутся на фрагменты: раздел под
+заголовком или абзац; заголовок индексируется вместе с текстом. Индекс —
+инвертированный (термин → {фрагмент: tf}) в памяти. Строится при первом
+вопросе; дальше не чаще раза в STAFF_DOCS_CHECK сек сверяются mtime/размер
+файлов и переиндексируются только изменённые.
+
+search() возвращает лучшие фрагменты и уверенность: если вопрос почти
+целиком покрыт одним фрагментом и тот заметно лучше следующего —
+отвечаем прямо из базы, иначе в промпт идут только найденные фрагменты.
+"""
+import logging
+import math
+import os
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+STAFF_DOCS_DIR = Path(os.getenv('STAFF_DOCS_DIR', Path(__file__).parent / 'docs'))
+STAFF_DOCS_CHECK = float(os.getenv('STAFF_DOCS_CHECK', 30))
+# Прямой ответ: доля терминов вопроса, найденных во фрагменте, и отрыв от второго места
+STAFF_KB_DIRECT_COVERAGE = float(os.getenv('STAFF_KB_DIRECT_COVERAGE', 0.75))
+STAFF_KB_DIRECT_MARGIN = float(os.getenv('STAFF_KB_DIRECT_MARGIN', 1.3))
+
+DOC_EXTENSIONS = {'.md', '.txt'}
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    'и', 'в', 'во', 'на', 'с', 'со', 'по', 'к', 'ко', 'о', 'об', 'от', 'до', 'за', 'из', 'у', 'же',
+    'а', 'но', 'или', 'ли', 'не', 'ни', 'то', 'это', 'как', 'что', 'чтобы', 'если', 'для', 'при',
+    'я', 'мы', 'вы', 'он', 'она', 'они', 'мне', 'нам', 'вам', 'мой', 'наш', 'ваш', 'где', 'когда',
+    'какой', 'какая', 'какие', 'сколько', 'нужно', 'надо', 'можно', 'ещё', 'еще', 'уже', 'бы',
+    'стоит', 'делать', 'сделать', 'подскажите', 'скажите',
+}
+# Грубый стемминг: срезаем частые окончания, чтобы «отчет/отчета/отчеты» совпадали
+_ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ой', 'ей', 'ий', 'ый', 'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ть', 'ешь', 'ет',
+    'ют', 'ут', 'ит', 'ат', 'ят', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь',
+), key=len, reverse=True)
+_WORD = re.compile(r'[\wё]+', re.IGNORECASE)
+
+
+def _stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> list:
+    words = (w.lower().replace('ё', 'е') for w in _WORD.findall(text))
+    return [_stem(w) for w in words if w not in STOPWORDS and len(w) > 1]
+
+
+class Passage(NamedTuple):
+    source: str   # имя файла
+    title: str    # ближайший заголовок
+    text: str
+
+
+class Hit(NamedTuple):
+    passage: Passage
+    score: float
+    coverage: float  # доля терминов вопроса, найденных во фрагменте
+
+
+def split_passages(source: str, content: str) -> list:
+    """Раздел под заголовком «#» — один фрагмент; без заголовков — абзацы"""
+    passages, title, buffer = [], '', []
+
+    def flush():
+        text = '\n'.join(buffer).strip()
+        if text:
+            passages.append(Passage(source, title, text))
+        buffer.clear()
+
+    for line in content.splitlines():
+        if line.startswith('#'):
+            flush()
+            title = line.lstrip('#').strip()
+        elif not line.strip() and not title:
+            flush()
+        else:
+            buffer.append(line)
+    flush()
+    return passages
+
+
+class KnowledgeBase:
+    def __init__(self, docs_dir: Path = STAFF_DOCS_DIR):
+        self.docs_dir = Path(docs_dir)
+        self._files = {}      # имя файла → (mtime, size, [id фрагментов])
+        self._passages = {}   # id → Passage
+        self._terms = {}      # id → Counter терминов
+        self._lengths = {}    # id → длина фрагмента в терминах
+        self._postings = {}   # термин → {id: tf}
+        self._total_len = 0
+        self._next_id = 0
+        self._checked_at = 0.0
+
+    # --- ИНДЕКС ---
+    def _remove(self, name: str):
+        _, _, ids = self._files.pop(name)
+        for pid in ids:
+            self._passages.pop(pid)
+            terms = self._terms.pop(pid)
+            self._total_len -= self._lengths.pop(pid)
+            for term in terms:
+                postings = self._postings[term]
+                postings.pop(pid, None)
+                if not postings:
+                    del self._postings[term]
+
+    def _add(self, name: str, stat):
+        content = (self.docs_dir / name).read_text(encoding='utf-8', errors='replace')
+        ids = []
+        for passage in split_passages(name, content):
+            pid = self._next_id
+            self._next_id += 1
+            terms = Counter(tokenize(f"{passage.title}\n{passage.text}"))
+            self._passages[pid] = passage
+            self._terms[pid] = terms
+            self._lengths[pid] = sum(terms.values())
+            self._total_len += self._lengths[pid]
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[pid] = tf
+            ids.append(pid)
+        self._files[name] = (stat.st_mtime, stat.st_size, ids)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Переиндексирует изменённые файлы; True, если что-то поменялось"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < STAFF_DOCS_CHECK:
+            return False
+        self._checked_at = now
+
+        current = {}
+        if self.docs_dir.is_dir():
+            for path in self.docs_dir.iterdir():
+                if path.suffix.lower() in DOC_EXTENSIONS and path.is_file():
+                    current[path.name] = path.stat()
+
+        changed = [n for n in self._files if n not in current]
+        changed += [n for n, st in current.items()
+                    if n not in self._files or self._files[n][:2] != (st.st_mtime, st.st_size)]
+        if not changed:
+            return False
+
+        started = time.perf_counter()
+        for name in changed:
+            if name in self._files:
+                self._remove(name)
+            if name in current:
+                try:
+                    self._add(name, current[name])
+                except OSError as e:
+                    logger.error(f"⚠️ Knowledge base: {name} - {e}")
+        logger.info(f"📚 Knowledge base: {len(changed)} file(s) reindexed, "
+                    f"{len(self._passages)} passages in {time.perf_counter() - started:.3f}s")
+        return True
+
+    # --- ПОИСК ---
+    def search(self, query: str, limit: int = 3) -> list:
+        """Лучшие фрагменты по BM25: [Hit], по убыванию score"""
+        self.refresh()
+        terms = set(tokenize(query))
+        if not terms or not self._passages:
+            return []
+
+        n = len(self._passages)
+        avg_len = self._total_len / n
+        scores, matched = {}, {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for pid, tf in postings.items():
+                norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[pid] / avg_len))
+                scores[pid] = scores.get(pid, 0.0) + idf * norm
+                matched[pid] = matched.get(pid, 0) + 1
+
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [Hit(self._passages[pid], scores[pid], matched[pid] / len(terms)) for pid in best]
+
+    @staticmethod
+    def is_confident(hits: list) -> bool:
+        """Можно ли ответить первым фрагментом без LLM"""
+        if not hits or hits[0].coverage < STAFF_KB_DIRECT_COVERAGE:
+            return False
+        return len(hits) == 1 or hits[0].score >= hits[1].score * STAFF_KB_DIRECT_MARGIN
+
+    def stats(self) -> dict:
+        return {'files': len(self._files), 'passages': len(self._passages), 'terms': len(self._postings)}
+
+
+kb = KnowledgeBase()
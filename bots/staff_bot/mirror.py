@@ -0,0 +1,225 @@
+"""
+Локальное зеркало листа отчётов staff_bot для быстрых сводок
+
+Каждая строка, которую пишет бот, сразу попадает в SQLite
+(STAFF_MIRROR_PATH) — ещё до отправки в таблицу, с row_num = NULL.
+Итоги по (день, объект, сотрудник) в таблице totals обновляются в той же
+транзакции, поэтому /summary — это GROUP BY по паре десятков строк.
+
+Правки листа руками подтягиваются фоном (только основной воркер):
+  - раз в STAFF_MIRROR_PULL сек читаются только новые строки листа
+    (после последней известной); строки самого бота узнаются по
+    содержимому и просто получают номер строки листа;
+  - раз в STAFF_MIRROR_FULL сек лист перечитывается целиком — так
+    доходят правки и удаления старых строк, итоги пересчитываются.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from utils import supervisor
+from utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+STAFF_MIRROR_PATH = os.getenv('STAFF_MIRROR_PATH', 'staff_mirror.sqlite3')
+STAFF_MIRROR_PULL = float(os.getenv('STAFF_MIRROR_PULL', 300))
+STAFF_MIRROR_FULL = float(os.getenv('STAFF_MIRROR_FULL', 6 * 3600))
+
+# Колонки листа: дата, объект, сотрудник, взрослые, льготные, выручка, комментарий
+SHEET_COLUMNS = "A{start}:G"
+SHEET_DATE_FORMAT = "%d.%m.%Y"
+
+
+def _int(value) -> int:
+    try:
+        return int(str(value).replace(' ', '').replace('\xa0', '') or 0)
+    except ValueError:
+        return 0
+
+
+def _parse(values: list):
+    """Строка листа → (день ISO, объект, сотрудник, взрослые, льготные, выручка, комментарий)"""
+    values = list(values) + [''] * (7 - len(values))
+    try:
+        day = datetime.strptime(str(values[0]).strip(), SHEET_DATE_FORMAT).date().isoformat()
+    except ValueError:
+        return None  # заголовок или мусор
+    return (day, values[1], values[2], _int(values[3]), _int(values[4]), _int(values[5]), values[6] or '')
+
+
+class ShiftMirror(SQLiteStore):
+    def __init__(self, sheets, path: str = STAFF_MIRROR_PATH):
+        """sheets — SheetsWriter: через него читаем лист и смотрим, пуст ли spool"""
+        super().__init__(
+            path,
+            'CREATE TABLE IF NOT EXISTS shifts ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT, row_num INTEGER UNIQUE,'
+            ' day TEXT, object TEXT, staff TEXT, adults INTEGER, discount INTEGER,'
+            ' revenue INTEGER, comment TEXT, recorded_at REAL);'
+            'CREATE INDEX IF NOT EXISTS shifts_day ON shifts (day);'
+            'CREATE TABLE IF NOT EXISTS totals ('
+            ' day TEXT, object TEXT, staff TEXT, reports INTEGER, adults INTEGER,'
+            ' discount INTEGER, revenue INTEGER, PRIMARY KEY (day, object, staff));'
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);'
+        )
+        self.sheets = sheets
+        self._pull_task = None
+
+    # --- SQLITE (в потоке) ---
+    def _bump(self, shift):
+        day, obj, staff, adults, discount, revenue, _ = shift
+        self._conn.execute(
+            'INSERT INTO totals VALUES (?, ?, ?, 1, ?, ?, ?) '
+            'ON CONFLICT (day, object, staff) DO UPDATE SET '
+            'reports = reports + 1, adults = adults + excluded.adults, '
+            'discount = discount + excluded.discount, revenue = revenue + excluded.revenue',
+            (day, obj, staff, adults, discount, revenue)
+        )
+
+    def _insert(self, shift, row_num=None, bump=True):
+        self._conn.execute(
+            'INSERT INTO shifts (row_num, day, object, staff, adults, discount, revenue, comment, recorded_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (row_num, *shift, time.time())
+        )
+        if bump:
+            self._bump(shift)
+
+    def _claim(self, shift, row_num) -> bool:
+        """Строка листа, которую записал сам бот: проставляем номер, итоги уже учтены"""
+        match = self._conn.execute(
+            'SELECT id FROM shifts WHERE row_num IS NULL AND day = ? AND object = ? AND staff = ? '
+            'AND adults = ? AND discount = ? AND revenue = ? AND comment = ? ORDER BY id LIMIT 1',
+            shift
+        ).fetchone()
+        if match is None:
+            return False
+        self._conn.execute('UPDATE shifts SET row_num = ? WHERE id = ?', (row_num, match[0]))
+        return True
+
+    def _set_meta(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value)))
+
+    def _get_meta(self, key, default=None):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _record(self, row):
+        with self._lock:
+            self._insert(_parse(row))
+            self._conn.commit()
+
+    def _apply_new(self, start: int, values: list) -> int:
+        """Новые строки листа начиная с номера start"""
+        added = 0
+        with self._lock:
+            for offset, raw in enumerate(values):
+                row_num = start + offset
+                shift = _parse(raw)
+                if shift is None or self._conn.execute(
+                        'SELECT 1 FROM shifts WHERE row_num = ?', (row_num,)).fetchone():
+                    continue
+                if not self._claim(shift, row_num):
+                    self._insert(shift, row_num)
+                    added += 1
+            self._set_meta('last_row', start + len(values) - 1)
+            self._set_meta('pulled_at', time.time())
+            self._conn.commit()
+        return added
+
+    def _rebuild(self, values: list, delivered_before: float):
+        """
+        Полная сверка с листом (values — с первой строки).
+        Строки бота, записанные до delivered_before, точно уже в листе:
+        если они там не нашлись — их правили или удалили
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM shifts WHERE row_num IS NOT NULL')
+            for row_num, raw in enumerate(values, start=1):
+                shift = _parse(raw)
+                if shift is not None and not self._claim(shift, row_num):
+                    # Итоги пересчитываются ниже целиком
+                    self._insert(shift, row_num, bump=False)
+            if delivered_before:
+                self._conn.execute(
+                    'DELETE FROM shifts WHERE row_num IS NULL AND recorded_at < ?', (delivered_before,)
+                )
+            self._conn.execute('DELETE FROM totals')
+            self._conn.execute(
+                'INSERT INTO totals SELECT day, object, staff, COUNT(*), SUM(adults), SUM(discount), SUM(revenue) '
+                'FROM shifts GROUP BY day, object, staff'
+            )
+            self._set_meta('last_row', len(values))
+            self._set_meta('pulled_at', time.time())
+            self._set_meta('full_at', time.time())
+            self._conn.commit()
+
+    def _summary(self, since: str, until: str):
+        with self._lock:
+            by_object = self._conn.execute(
+                'SELECT object, SUM(reports), SUM(adults), SUM(discount), SUM(revenue) FROM totals '
+                'WHERE day BETWEEN ? AND ? GROUP BY object ORDER BY SUM(revenue) DESC', (since, until)
+            ).fetchall()
+            by_staff = self._conn.execute(
+                'SELECT staff, SUM(reports), SUM(revenue) FROM totals '
+                'WHERE day BETWEEN ? AND ? GROUP BY staff ORDER BY SUM(revenue) DESC', (since, until)
+            ).fetchall()
+            pulled_at = self._get_meta('pulled_at')
+        return by_object, by_staff, float(pulled_at) if pulled_at else None
+
+    def _state(self):
+        with self._lock:
+            return int(self._get_meta('last_row', 0)), float(self._get_meta('full_at', 0))
+
+    # --- API ---
+    async def record(self, row: list):
+        """Строка, которую бот отправляет в таблицу (формат как для append_row)"""
+        try:
+            await self.run_in_thread(self._record, row)
+        except Exception as e:
+            logger.error(f"⚠️ Staff mirror write failed: {e}")
+
+    async def summary(self, since: str, until: str):
+        """([(объект, отчёты, взрослые, льготные, выручка)], [(сотрудник, отчёты, выручка)], время синхронизации)"""
+        return await self.run_in_thread(self._summary, since, until)
+
+    async def pull(self, full: bool = False) -> int:
+        last_row, full_at = await self.run_in_thread(self._state)
+        if full or not last_row or time.time() - full_at > STAFF_MIRROR_FULL:
+            # Spool пуст до чтения листа — всё, что бот записал раньше минуты назад, уже в листе
+            delivered_before = time.time() - 60 if await self.sheets.spool.count() == 0 else 0
+            values = await self.sheets.read(SHEET_COLUMNS.format(start=1))
+            await self.run_in_thread(self._rebuild, values, delivered_before)
+            logger.info(f"🪞 Staff mirror: full sync, {len(values)} sheet rows")
+            return len(values)
+
+        start = last_row + 1
+        values = await self.sheets.read(SHEET_COLUMNS.format(start=start))
+        if not values:
+            return 0
+        added = await self.run_in_thread(self._apply_new, start, values)
+        if added:
+            logger.info(f"🪞 Staff mirror: {added} new row(s) from sheet")
+        return added
+
+    async def _pull_loop(self):
+        while True:
+            try:
+                await self.pull()
+            except Exception as e:
+                logger.warning(f"⚠️ Staff mirror pull failed: {e}")
+            await asyncio.sleep(STAFF_MIRROR_PULL)
+
+    async def start(self):
+        if supervisor.is_primary() and (self._pull_task is None or self._pull_task.done()):
+            self._pull_task = asyncio.create_task(self._pull_loop())
+
+    async def close(self):
+        if self._pull_task is not None:
+            self._pull_task.cancel()
+            try:
+                await self._pull_task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,209 @@
+"""
+Запись отчётов staff_bot в Google Sheets через локальный spool
+
+Строка отчёта сначала пишется в SQLite (STAFF_SPOOL_PATH) — это
+миллисекунды, после чего сотрудник сразу видит «Записано». Фоновая
+задача раз в SHEETS_FLUSH_INTERVAL сек забирает накопившиеся строки и
+отправляет их одним append_rows в потоке. Если Sheets тормозит или
+недоступен, строки остаются в spool и уходят позже (с backoff), в том
+числе после рестарта.
+
+Клиент gspread и лист кэшируются; авторизация обновляется заранее, до
+истечения токена (SHEETS_AUTH_TTL), и сразу после любой ошибки.
+В многопроцессном режиме строки в spool пишут все воркеры,
+а отправляет только основной.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from utils import supervisor
+from utils.metrics import SHEETS_LATENCY, SHEETS_SPOOL
+from utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+STAFF_SPOOL_PATH = os.getenv('STAFF_SPOOL_PATH', 'staff_spool.sqlite3')
+SHEETS_FLUSH_INTERVAL = float(os.getenv('SHEETS_FLUSH_INTERVAL', 2.0))
+SHEETS_BATCH = int(os.getenv('SHEETS_BATCH', 100))
+# Токен сервисного аккаунта живёт час — переавторизуемся раньше
+SHEETS_AUTH_TTL = int(os.getenv('SHEETS_AUTH_TTL', 45 * 60))
+SHEETS_RETRY_MAX = float(os.getenv('SHEETS_RETRY_MAX', 300))
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+
+class _Spool(SQLiteStore):
+    """Очередь строк в SQLite; запросы выполняются в потоке"""
+
+    def __init__(self, path: str):
+        super().__init__(
+            path,
+            'CREATE TABLE IF NOT EXISTS sheets_spool ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT, created_at REAL)'
+        )
+
+    def _put(self, row):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO sheets_spool (row, created_at) VALUES (?, ?)',
+                (json.dumps(row, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def _peek(self, limit):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT id, row FROM sheets_spool ORDER BY id LIMIT ?', (limit,)
+            ).fetchall()
+
+    def _delete(self, ids):
+        with self._lock:
+            self._conn.executemany('DELETE FROM sheets_spool WHERE id = ?', [(i,) for i in ids])
+            self._conn.commit()
+
+    def _count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM sheets_spool').fetchone()[0]
+
+    async def put(self, row: list):
+        await self.run_in_thread(self._put, row)
+
+    async def peek(self, limit: int) -> list:
+        rows = await self.run_in_thread(self._peek, limit)
+        return [(row_id, json.loads(row)) for row_id, row in rows]
+
+    async def delete(self, ids: list):
+        await self.run_in_thread(self._delete, ids)
+
+    async def count(self) -> int:
+        return await self.run_in_thread(self._count)
+
+
+class SheetsWriter:
+    def __init__(self, spreadsheet_id: str, keyfile: str, spool_path: str = STAFF_SPOOL_PATH):
+        self.spreadsheet_id = spreadsheet_id
+        self.keyfile = keyfile
+        self.spool = _Spool(spool_path)
+        self._worksheet = None
+        self._authorized_at = 0.0
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self.sent = 0
+        self.failures = 0  # подряд, для backoff
+
+    # --- GOOGLE SHEETS (в потоке) ---
+    def _authorize(self):
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        with open(self.keyfile, 'r') as f:
+            creds_dict = json.load(f)
+        if 'private_key' in creds_dict:
+            creds_dict['private_key'] = creds_dict['private_key'].replace('\\n', '\n')
+
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+        client = gspread.authorize(creds)
+        self._worksheet = client.open_by_key(self.spreadsheet_id).get_worksheet(0)
+        self._authorized_at = time.monotonic()
+        logger.info("🔑 Google Sheets client authorized")
+
+    def _ensure_auth(self):
+        if self._worksheet is None or time.monotonic() - self._authorized_at > SHEETS_AUTH_TTL:
+            self._authorize()
+
+    def _append(self, rows: list):
+        self._ensure_auth()
+        self._worksheet.append_rows(rows)
+
+    def _get(self, cell_range: str) -> list:
+        self._ensure_auth()
+        try:
+            return self._worksheet.get(cell_range)
+        except Exception:
+            self._worksheet = None
+            raise
+
+    async def read(self, cell_range: str) -> list:
+        """Значения диапазона листа (например, "A120:G") — для зеркала mirror.py"""
+        return await asyncio.to_thread(self._get, cell_range)
+
+    # --- ОЧЕРЕДЬ ---
+    async def add(self, row: list) -> bool:
+        """Кладёт строку в spool; в таблицу она уйдёт фоном"""
+        try:
+            await self.spool.put(row)
+        except Exception as e:
+            logger.error(f"🚨 Sheets spool write failed: {e}")
+            return False
+        self._ensure_flusher()
+        return True
+
+    def _ensure_flusher(self):
+        if not supervisor.is_primary():
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                sent = await self.flush()
+            except Exception:
+                # Backoff: 2, 4, 8... сек, не больше SHEETS_RETRY_MAX
+                await asyncio.sleep(min(SHEETS_FLUSH_INTERVAL * 2 ** self.failures, SHEETS_RETRY_MAX))
+                continue
+            if sent < SHEETS_BATCH:
+                await asyncio.sleep(SHEETS_FLUSH_INTERVAL)
+
+    async def flush(self) -> int:
+        """Отправляет одну пачку из spool; возвращает число отправленных строк"""
+        async with self._flush_lock:
+            batch = await self.spool.peek(SHEETS_BATCH)
+            if not batch:
+                SHEETS_SPOOL.set(0)
+                return 0
+
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._append, [row for _, row in batch])
+            except Exception as e:
+                SHEETS_LATENCY.observe(time.perf_counter() - started, status="error")
+                self.failures += 1
+                # Следующая попытка — с новой авторизацией
+                self._worksheet = None
+                logger.error(f"🚨 GOOGLE SHEET ERROR ({len(batch)} rows kept in spool): {e}")
+                SHEETS_SPOOL.set(await self.spool.count())
+                raise
+            SHEETS_LATENCY.observe(time.perf_counter() - started, status="ok")
+
+            await self.spool.delete([row_id for row_id, _ in batch])
+            self.failures = 0
+            self.sent += len(batch)
+            SHEETS_SPOOL.set(await self.spool.count())
+            return len(batch)
+
+    async def start(self):
+        """Старт бота: досылаем то, что осталось в spool с прошлого запуска"""
+        pending = await self.spool.count()
+        SHEETS_SPOOL.set(pending)
+        if pending:
+            logger.info(f"📤 Sheets spool: {pending} row(s) to replay")
+        self._ensure_flusher()
+
+    async def close(self, timeout: float = 10.0):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        if not supervisor.is_primary():
+            return
+        # Последняя попытка; что не ушло — останется в spool до следующего запуска
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except Exception as e:
+            logger.warning(f"⚠️ Sheets final flush: {e}")
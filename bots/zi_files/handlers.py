@@ -11,7 +11,8 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BufferedInputFile
 
-from utils.ai_engine import ask_brain, safe_reply
+from utils.ai_engine import ask_brain, queue_notifier, safe_reply
+from utils.ai_scheduler import PRIORITY_BATCH
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -138,7 +139,13 @@ async def process_callback(callback: CallbackQuery, state: FSMContext):
         short_text = original_text[:15000]
 
         # AI
-        modified_text, model, source = await ask_brain(prompt, short_text)
+        # Документы — пакетная работа: короткие ответы других ботов идут вперёд
+        modified_text, model, source = await ask_brain(
+            prompt, short_text, priority=PRIORITY_BATCH, on_queue=queue_notifier(callback.message),
+            route="zi_files.dlp",
+            # Конфиденциальный документ: не держим его ни в памяти, ни на диске кэша
+            cache=False
+        )
 
         # Отправляем текст в чат
         await safe_reply(callback.message, "✅ <b>Результат:</b>", modified_text, model)
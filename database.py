@@ -2,6 +2,9 @@ import os
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from utils.metrics import MONGO_LATENCY
+from utils.mongo_indexes import ensure_indexes
+
 class Database:
     def __init__(self):
         self.mongo_uri = os.getenv("MONGO_URI")
@@ -32,6 +35,8 @@ class Database:
             self.mongo_db = self.mongo_client[self.mongo_db_name]
 
             print("DB: MongoDB client created", flush=True)
+            # Индексы строим в фоне, чтобы не задерживать первый запрос
+            self._indexes_task = asyncio.ensure_future(ensure_indexes(self.mongo_db))
 
         except Exception as e:
             print("⛔ Mongo init error:", e, flush=True)
@@ -45,10 +50,11 @@ class Database:
             return None
 
         try:
-            result = await asyncio.wait_for(
-                self.mongo_db.tasks.insert_one(task_doc),
-                timeout=3
-            )
+            with MONGO_LATENCY.time(db=self.mongo_db_name, op="tasks.insert_one"):
+                result = await asyncio.wait_for(
+                    self.mongo_db.tasks.insert_one(task_doc),
+                    timeout=3
+                )
             return result.inserted_id
 
         except Exception as e:
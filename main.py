@@ -16,6 +16,16 @@ from aiogram.enums import ParseMode
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 from dotenv import load_dotenv
 
+from utils.update_queue import UpdateQueue
+from utils.bot_loader import HandlersLoader, rss_mb, warmup
+from utils import supervisor
+from utils.fsm_storage import build_fsm_storage
+from utils import metrics
+from utils import gateway
+from utils import model_routing
+from utils.ai_scheduler import RequestContextMiddleware, scheduler
+from utils.activity import ACTIVITY_ENABLED, ActivityMiddleware, activity
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -33,6 +43,27 @@ BOTS_DIR = Path(__file__).parent / 'bots'
 PING_INTERVAL = 600  # 10 минут (Render засыпает через 15)
 PING_ENABLED = os.getenv('SELF_PING_ENABLED', 'true').lower() == 'true'
 
+# Режим webhook: sync — ответ Telegram после обработки (как раньше),
+# queue — мгновенный 200 + пул воркеров на каждого бота
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'sync').lower()
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_OVERFLOW = os.getenv('WEBHOOK_OVERFLOW', 'drop').lower()  # drop | reject
+
+# Регистрация webhook
+ALLOWED_UPDATES = ['message', 'callback_query', 'inline_query']
+WEBHOOK_SETUP_CONCURRENCY = int(os.getenv('WEBHOOK_SETUP_CONCURRENCY', 8))
+# По умолчанию НЕ выбрасываем накопившиеся апдейты при деплое
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', 'false').lower() == 'true'
+
+# Ленивая загрузка handlers: импорт при первом апдейте или фоновым прогревом
+LAZY_HANDLERS = os.getenv('LAZY_HANDLERS', 'false').lower() == 'true'
+HANDLERS_WARMUP = os.getenv('HANDLERS_WARMUP', 'true').lower() == 'true'
+WARMUP_DELAY = float(os.getenv('WARMUP_DELAY', 1.0))
+
+# Кол-во процессов-воркеров на одном порту (1 = обычный однопроцессный режим)
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))
+
 
 def discover_bots():
     """
@@ -106,23 +137,41 @@ async def setup_bot(app: web.Application, bot_config: dict):
     
     try:
         bot = Bot(token=token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-        dp = Dispatcher()
+        dp = Dispatcher(storage=app['fsm_storage'])
         
-        # Загружаем handlers
-        try:
-            handlers_module = import_module(bot_config['handlers_module'])
-            router = getattr(handlers_module, 'router')
-            dp.include_router(router)
-            logger.info(f"✅ {name}: handlers loaded")
-        except Exception as e:
-            logger.error(f"❌ {name}: handlers error - {e}")
+        # Метрики: апдейты, хендлеры, Telegram API
+        metrics.instrument(name, bot, dp)
+        # (бот, пользователь) для честной очереди к AI
+        dp.update.outer_middleware(RequestContextMiddleware(name))
+        # Активность пользователей — в буфер, в Mongo пачками
+        if ACTIVITY_ENABLED:
+            dp.update.outer_middleware(ActivityMiddleware(name))
+        
+        # Загружаем handlers (сразу или при первом апдейте)
+        loader = HandlersLoader(name, bot_config['handlers_module'], dp, lazy=LAZY_HANDLERS)
+        if LAZY_HANDLERS:
+            dp.update.outer_middleware(loader)
+        elif not loader.load():
             return False
         
         webhook_path = bot_config['webhook_path']
         webhook_url = f"{BASE_URL}{webhook_path}"
         
         # Регистрируем handler
-        SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=webhook_path)
+        update_queue = None
+        if WEBHOOK_MODE == 'queue':
+            update_queue = UpdateQueue(
+                name, dp, bot,
+                workers=WEBHOOK_WORKERS,
+                maxsize=WEBHOOK_QUEUE_SIZE,
+                overflow=WEBHOOK_OVERFLOW
+            )
+            local_handler = update_queue.handle
+        else:
+            local_handler = SimpleRequestHandler(dispatcher=dp, bot=bot).handle
+        
+        # В многопроцессном режиме апдейт обрабатывает воркер-владелец чата
+        app.router.add_post(webhook_path, supervisor.chat_affine(local_handler))
         
         if 'bots_data' not in app:
             app['bots_data'] = []
@@ -132,6 +181,8 @@ async def setup_bot(app: web.Application, bot_config: dict):
             'bot': bot,
             'dispatcher': dp,
             'webhook_url': webhook_url,
+            'queue': update_queue,
+            'loader': loader,
             'config': bot_config
         })
         
@@ -174,33 +225,75 @@ async def self_ping_task(app: web.Application):
                 logger.error(f"❌ Self-ping error: {e}")
 
 
+async def register_webhook(bot_data: dict):
+    """
+    Идемпотентная регистрация webhook одного бота:
+    если URL и allowed_updates уже совпадают — ничего не трогаем
+    """
+    name = bot_data['name']
+    bot = bot_data['bot']
+    webhook_url = bot_data['webhook_url']
+    
+    try:
+        info = await bot.get_webhook_info()
+        if info.url == webhook_url and sorted(info.allowed_updates or []) == sorted(ALLOWED_UPDATES):
+            logger.info(f"✅ {name}: webhook already active - {webhook_url}")
+            return True
+        
+        # set_webhook сам заменяет старый URL, delete_webhook не нужен
+        await bot.set_webhook(
+            url=webhook_url,
+            drop_pending_updates=DROP_PENDING_UPDATES,
+            allowed_updates=ALLOWED_UPDATES
+        )
+        logger.info(f"✅ {name}: webhook set - {webhook_url}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ {name}: webhook setup failed - {e}")
+        return False
+
+
 async def on_startup(app: web.Application):
-    """Устанавливает webhook для всех ботов"""
+    """Устанавливает webhook для всех ботов (параллельно, с ограничением)"""
     logger.info("🚀 Setting up webhooks for all bots...")
+    started = asyncio.get_running_loop().time()
     
+    # Воркеры очередей стартуем до webhook, чтобы не терять первые апдейты
     for bot_data in app.get('bots_data', []):
-        name = bot_data['name']
-        bot = bot_data['bot']
-        webhook_url = bot_data['webhook_url']
-        
-        try:
-            await bot.delete_webhook(drop_pending_updates=True)
-            logger.info(f"🧹 {name}: old webhook deleted")
-            
-            await bot.set_webhook(
-                url=webhook_url,
-                drop_pending_updates=True,
-                allowed_updates=['message', 'callback_query', 'inline_query']
-            )
-            
-            info = await bot.get_webhook_info()
-            if info.url == webhook_url:
-                logger.info(f"✅ {name}: webhook active - {webhook_url}")
-            else:
-                logger.error(f"❌ {name}: webhook mismatch!")
-            
-        except Exception as e:
-            logger.error(f"❌ {name}: webhook setup failed - {e}")
+        if bot_data.get('queue'):
+            bot_data['queue'].start()
+    
+    # startup-хуки роутеров (lazy-боты вызывают их сами при загрузке)
+    for bot_data in app.get('bots_data', []):
+        if bot_data['loader'].loaded:
+            await bot_data['loader'].emit_startup()
+    
+    app['loop_lag_task'] = asyncio.create_task(metrics.track_loop_lag())
+    
+    # Общий пул соединений к AI Gateway
+    await gateway.start()
+    
+    # Фоновый прогрев lazy-ботов
+    lazy_loaders = [bd['loader'] for bd in app.get('bots_data', []) if bd['loader'].lazy]
+    if lazy_loaders and HANDLERS_WARMUP:
+        app['warmup_task'] = asyncio.create_task(warmup(lazy_loaders, delay=WARMUP_DELAY))
+    
+    # Webhook и self-ping — только на одном воркере
+    if not supervisor.is_primary():
+        logger.info(f"👷 Worker {supervisor.WORKER_INDEX} ready")
+        return
+    
+    semaphore = asyncio.Semaphore(WEBHOOK_SETUP_CONCURRENCY)
+    
+    async def limited(bot_data):
+        async with semaphore:
+            return await register_webhook(bot_data)
+    
+    results = await asyncio.gather(*(limited(bd) for bd in app.get('bots_data', [])))
+    
+    elapsed = asyncio.get_running_loop().time() - started
+    logger.info(f"⏱ Webhooks: {sum(results)}/{len(results)} ok in {elapsed:.2f}s")
     
     logger.info(f"🎉 All {len(app['bots_data'])} bot(s) ready")
     
@@ -213,13 +306,39 @@ async def on_shutdown(app: web.Application):
     """Cleanup при остановке"""
     logger.info("🛑 Shutting down bots...")
     
-    # Останавливаем ping task
-    if 'ping_task' in app:
-        app['ping_task'].cancel()
-        try:
-            await app['ping_task']
-        except asyncio.CancelledError:
-            pass
+    # Останавливаем фоновые задачи
+    for task_key in ('ping_task', 'warmup_task', 'loop_lag_task'):
+        if task_key in app:
+            app[task_key].cancel()
+            try:
+                await app[task_key]
+            except asyncio.CancelledError:
+                pass
+    
+    # Дорабатываем очереди апдейтов
+    await asyncio.gather(*(
+        bot_data['queue'].stop() for bot_data in app.get('bots_data', []) if bot_data.get('queue')
+    ))
+    
+    # shutdown-хуки роутеров (например, досылка spool staff_bot)
+    await asyncio.gather(*(
+        bot_data['loader'].emit_shutdown() for bot_data in app.get('bots_data', []) if bot_data['loader'].loaded
+    ))
+    
+    # Закрываем пул соединений к шлюзу
+    await gateway.close()
+    
+    # Дописываем накопленную активность пользователей
+    try:
+        await activity.close()
+    except Exception as e:
+        logger.error(f"⚠️ Activity flush: {e}")
+    
+    # Сбрасываем FSM-состояния на диск
+    try:
+        await app['fsm_storage'].close()
+    except Exception as e:
+        logger.error(f"⚠️ FSM storage close: {e}")
     
     # Закрываем ботов
     for bot_data in app.get('bots_data', []):
@@ -245,6 +364,8 @@ async def create_app() -> web.Application:
     
     app = web.Application()
     app['bots_data'] = []
+    # Общее FSM-хранилище: ключ содержит bot_id, кэш и TTL общие на всех
+    app['fsm_storage'] = build_fsm_storage()
     
     # Настраиваем каждого бота
     success_count = 0
@@ -254,22 +375,92 @@ async def create_app() -> web.Application:
     
     logger.info(f"✅ Successfully configured {success_count}/{len(discovered_bots)} bot(s)")
     
+    # Отчёт о старте: время импорта и память по каждому боту
+    app['startup_report'] = {
+        'lazy_handlers': LAZY_HANDLERS,
+        'boot_rss_mb': round(rss_mb(), 1),
+    }
+    for bd in app['bots_data']:
+        report = bd['loader'].report()
+        logger.info(f"📦 {bd['name']}: {report}")
+    logger.info(f"📦 Boot RSS: {app['startup_report']['boot_rss_mb']} MB")
+    
     # Lifecycle hooks
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
     
     # Health check endpoint
-    async def health_check(request):
+    def local_health():
         active_bots = [bd['name'] for bd in app.get('bots_data', [])]
-        return web.json_response({
-            'status': 'ok',
+        circuit = gateway.breaker.stats()
+        return {
+            # degraded — боты живы, но AI Gateway отключён breaker'ом
+            'status': 'degraded' if circuit['state'] == 'open' else 'ok',
             'bots_active': len(active_bots),
             'bots': active_bots,
-            'ping_enabled': PING_ENABLED
-        })
+            'ping_enabled': PING_ENABLED,
+            'webhook_mode': WEBHOOK_MODE,
+            'startup': {
+                **app['startup_report'],
+                'rss_mb': round(rss_mb(), 1),
+                'bots': {bd['name']: bd['loader'].report() for bd in app.get('bots_data', [])}
+            },
+            'queues': {
+                bd['name']: bd['queue'].stats()
+                for bd in app.get('bots_data', []) if bd.get('queue')
+            },
+            'fsm': app['fsm_storage'].stats(),
+            'activity': activity.stats(),
+            'ai_scheduler': scheduler.stats(),
+            'gateways': gateway.endpoints_stats(),
+            'circuit': circuit,
+            'model_routes': model_routing.routes_table(),
+            'worker': {
+                'index': supervisor.WORKER_INDEX,
+                'pid': os.getpid(),
+                'forwarded': supervisor.peers.forwarded,
+                'forward_errors': supervisor.peers.forward_errors,
+            }
+        }
+    
+    async def health_check(request):
+        health = local_health()
+        if supervisor.WORKER_COUNT > 1:
+            # Сводка по всем воркерам
+            workers = await supervisor.peers.gather_json('/internal/health')
+            workers[supervisor.WORKER_INDEX] = health
+            return web.json_response({
+                'status': 'ok' if all(w.get('status') == 'ok' for w in workers.values()) else 'degraded',
+                'workers_total': supervisor.WORKER_COUNT,
+                'workers': {str(i): workers[i] for i in sorted(workers)}
+            })
+        return web.json_response(health)
+    
+    async def internal_health(request):
+        return web.json_response(local_health())
     
     app.router.add_get('/health', health_check)
     app.router.add_get('/', health_check)  # Для корневого пути тоже
+    app.router.add_get('/internal/health', supervisor.internal_only(internal_health))
+    
+    # Prometheus-метрики
+    async def metrics_handler(request):
+        if supervisor.WORKER_COUNT <= 1:
+            return web.Response(text=metrics.render(), content_type='text/plain')
+        # Склеиваем сэмплы всех воркеров с лейблом worker
+        peer_indexes = [i for i in range(supervisor.WORKER_COUNT) if i != supervisor.WORKER_INDEX]
+        peer_texts = await asyncio.gather(*(
+            supervisor.peers.fetch_text(i, '/internal/metrics') for i in peer_indexes
+        ))
+        text = metrics.render({'worker': supervisor.WORKER_INDEX}) + ''.join(peer_texts)
+        return web.Response(text=text, content_type='text/plain')
+    
+    async def internal_metrics(request):
+        text = metrics.render({'worker': supervisor.WORKER_INDEX}, headers=False)
+        return web.Response(text=text, content_type='text/plain')
+    
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/internal/metrics', supervisor.internal_only(internal_metrics))
     
     return app
 
@@ -284,8 +475,14 @@ def main():
     logger.info(f"🔌 Port: {PORT}")
     logger.info(f"📁 Bots dir: {BOTS_DIR}")
     logger.info(f"🔔 Self-ping: {'enabled' if PING_ENABLED else 'disabled'} ({PING_INTERVAL}s)")
+    logger.info(f"📬 Webhook mode: {WEBHOOK_MODE} ({WEBHOOK_WORKERS} workers/bot)")
     logger.info("=" * 60)
     
+    if WEB_WORKERS > 1:
+        logger.info(f"👷 Supervisor mode: {WEB_WORKERS} workers (SO_REUSEPORT)")
+        supervisor.run_supervisor(WEB_WORKERS, run_worker)
+        return
+    
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     app = loop.run_until_complete(create_app())
@@ -293,5 +490,13 @@ def main():
     web.run_app(app, host='0.0.0.0', port=PORT, handle_signals=True)
 
 
+def run_worker(index: int):
+    """Воркер в дочернем процессе: свой event loop и свой набор ботов"""
+    async def run():
+        app = await create_app()
+        await supervisor.serve(app, '0.0.0.0', PORT)
+    
+    asyncio.run(run())
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Локальные SQLite-файлы ботов — во временную папку, а не в корень репозитория
+_tmp = tempfile.mkdtemp(prefix='bots-tests-')
+os.environ.setdefault('STAFF_SPOOL_PATH', os.path.join(_tmp, 'staff_spool.sqlite3'))
+os.environ.setdefault('STAFF_MIRROR_PATH', os.path.join(_tmp, 'staff_mirror.sqlite3'))
+os.environ.setdefault('AI_TOKEN', 'test')
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from utils import activity
+from utils.activity import HLL_M, rebuild_summary, sketch_count, sketch_registers
+
+
+def test_sketch_estimates_unique_users():
+    assert sketch_count() == 0
+    assert sketch_count(sketch_registers([42, 42, 42])) == 1
+    for n in (100, 5000, 50000):
+        estimate = sketch_count(sketch_registers(range(n)))
+        assert abs(estimate - n) <= n * 0.05
+
+
+def test_sketch_size_is_bounded():
+    assert len(sketch_registers(range(200000))) <= HLL_M
+
+
+def test_merged_sketches_count_overlap_once():
+    monday = sketch_registers(range(0, 3000))
+    tuesday = sketch_registers(range(2000, 5000))
+    assert abs(sketch_count(monday, tuesday) - 5000) <= 250
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class _Collection:
+    def __init__(self, docs=()):
+        self.docs = {d['_id']: d for d in docs}
+        self.updates = []
+
+    def find(self, query, projection=None):
+        start = query['_id']['$gte']
+        return _Cursor(sorted((d for k, d in self.docs.items() if k >= start), key=lambda d: d['_id']))
+
+    async def update_one(self, query, update, upsert=False):
+        self.updates.append((query, update))
+
+
+class _Database:
+    name = 'test'
+
+    def __init__(self, hours, days):
+        self.activity_hours = _Collection(hours)
+        self.activity_days = _Collection(days)
+        self.stats = _Collection()
+
+
+def test_rebuild_summary_from_rollups():
+    now = datetime(2026, 10, 18, 12, 30)
+    hours = [
+        {'_id': (now - timedelta(hours=h)).strftime('%Y%m%d%H'), 'r': sketch_registers(range(h * 10, h * 10 + 20))}
+        for h in range(30)
+    ]
+    days = [
+        {'_id': (now - timedelta(days=d)).strftime('%Y%m%d'), 'hits': 100 + d,
+         'r': sketch_registers(range(d * 100, d * 100 + 150))}
+        for d in range(10)
+    ]
+    database = _Database(hours, days)
+    summary = asyncio.run(rebuild_summary(database, now=now))
+
+    # Часы 0..23: пользователи 0..249
+    assert abs(summary['u_24h'] - 250) <= 10
+    # Дни 0..6: пользователи 0..749
+    assert abs(summary['u_7d'] - 750) <= 35
+    assert len(summary['history']) == activity.ACTIVITY_HISTORY_DAYS + 1
+    assert summary['history'][-1][:2] == ['2026-10-18', 100]
+    assert abs(summary['history'][-1][2] - 150) <= 5
+    query, update = database.stats.updates[0]
+    assert query == {'_id': 'global'} and update['$set']['activity'] is summary
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+from utils import ai_engine
+
+
+def test_ask_brain_without_text(monkeypatch):
+    """Стикер/фото без подписи (text=None) не роняет ask_brain"""
+    sent = {}
+
+    async def fake_fetch(payload, spec, *args):
+        sent.update(payload)
+        return "ok", "test-model", "Gateway"
+
+    monkeypatch.setattr(ai_engine, "AI_TOKEN", "test")
+    monkeypatch.setattr(ai_engine, "_fetch", fake_fetch)
+    result = asyncio.run(ai_engine.ask_brain("system", None, cache=False))
+
+    assert result == ("ok", "test-model", "Gateway")
+    assert sent["messages"][1]["content"] == ""
+
+
+def test_stream_without_text(monkeypatch):
+    monkeypatch.setattr(ai_engine, "AI_TOKEN", "test")
+    stream = ai_engine.BrainStream("system", None, cache=False)
+    assert stream.user_text == ""
+
+
+class _FakeMessage:
+    def __init__(self, chat_id=1, text="status"):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.text = text
+        self.edits = []
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append((text, kwargs))
+
+
+def test_intermediate_edit_is_plain_text():
+    """Промежуточный кусок стрима с «<» не должен парситься как HTML"""
+    msg = _FakeMessage()
+    asyncio.run(ai_engine._edit(msg, "a < b && c > d"))
+    assert msg.edits == [("a < b && c > d", {"parse_mode": None})]
+
+
+def test_edit_state_is_bounded(monkeypatch):
+    monkeypatch.setattr(ai_engine, "STREAM_EDIT_CHATS", 3)
+    monkeypatch.setattr(ai_engine, "_chats", ai_engine.OrderedDict())
+    for chat_id in range(10):
+        asyncio.run(ai_engine._throttle(chat_id))
+    assert list(ai_engine._chats) == [7, 8, 9]
+
+
+def test_queue_restore_does_not_overwrite_stream(monkeypatch):
+    """Возврат статуса после очереди не затирает уже начатый стрим"""
+    monkeypatch.setattr(ai_engine, "STREAM_EDIT_INTERVAL", 0)
+
+    async def scenario(stream_first):
+        msg = _FakeMessage(chat_id=100 + stream_first)
+        notify = ai_engine.queue_notifier(msg)
+        await notify(2)
+        if stream_first:
+            await ai_engine._edit(msg, "ответ ▌")
+        await notify(0)
+        return [text for text, _ in msg.edits]
+
+    assert asyncio.run(scenario(False)) == ["⏳ Вы #2 в очереди к AI...", "status"]
+    assert asyncio.run(scenario(True)) == ["⏳ Вы #2 в очереди к AI...", "ответ ▌"]
+
+
+def test_dlp_route_has_no_token_cap():
+    from utils import model_routing
+
+    assert model_routing.resolve('zi_files.dlp').max_tokens is None
+
+
+def test_cache_key_depends_on_max_tokens():
+    from utils.response_cache import cache_key
+
+    assert cache_key('s', 'u', 'm', 0.7, 512) != cache_key('s', 'u', 'm', 0.7, 8192)
+    assert cache_key('s', 'u', 'm', 0.7) == cache_key('s', 'u', 'm', 0.7, None)
+
+
+def test_edit_throttled_skips_partials_within_interval(monkeypatch):
+    """Частичные распознавания голоса не чаще общего лимита; финальный edit ждёт слота"""
+    monkeypatch.setattr(ai_engine, "STREAM_EDIT_INTERVAL", 0.05)
+    msg = _FakeMessage(chat_id=200)
+
+    async def scenario():
+        assert await ai_engine.edit_throttled(msg, "часть 1")
+        assert not await ai_engine.edit_throttled(msg, "часть 2")
+        assert await ai_engine.edit_throttled(msg, "итог", force=True, parse_mode="HTML")
+
+    asyncio.run(scenario())
+    assert msg.edits == [("часть 1", {}), ("итог", {"parse_mode": "HTML"})]
@@ -0,0 +1,37 @@
+import asyncio
+
+from utils.ai_scheduler import PRIORITY_BATCH, AdmissionScheduler
+
+
+async def _serve_order(scheduler, flows, priority=PRIORITY_BATCH):
+    """Занимает единственный слот, ставит flows в очередь и отпускает по одному"""
+    await scheduler.acquire(flow=('hold', 0))
+    served, positions = [], {}
+
+    async def request(flow):
+        await scheduler.acquire(priority, on_position=lambda p, f=flow: positions.setdefault(f, p), flow=flow)
+        served.append(flow)
+
+    tasks = []
+    for flow in flows:
+        tasks.append(asyncio.create_task(request(flow)))
+        await asyncio.sleep(0)
+    for _ in flows:
+        scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return served, positions
+
+
+def test_bots_share_slots_fairly():
+    """У бота A пять активных пользователей, у бота B один: B не ждёт всех пятерых"""
+    flows = [('a', user) for user in range(1, 6)] + [('b', 1)]
+    served, positions = asyncio.run(_serve_order(AdmissionScheduler(max_concurrency=1), flows))
+    assert served[:2] == [('a', 1), ('b', 1)]
+    assert positions[('b', 1)] == 2
+
+
+def test_users_round_robin_within_bot():
+    flows = [('a', 1), ('a', 1), ('a', 1), ('a', 2), ('b', 1)]
+    served, _ = asyncio.run(_serve_order(AdmissionScheduler(max_concurrency=1), flows))
+    assert served == [('a', 1), ('b', 1), ('a', 2), ('a', 1), ('a', 1)]
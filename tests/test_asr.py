@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+from bots.nezabudka import asr, voice as voice_module
+
+
+def _speech(ms: int) -> AudioSegment:
+    return Sine(300, sample_rate=asr.SAMPLE_RATE, bit_depth=8 * asr.SAMPLE_WIDTH).to_audio_segment(ms, volume=-10)
+
+
+def _silence(ms: int) -> AudioSegment:
+    return AudioSegment.silent(ms, frame_rate=asr.SAMPLE_RATE).set_sample_width(asr.SAMPLE_WIDTH)
+
+
+def _long_voice() -> AudioSegment:
+    """12 фраз по 9 с с паузами 0.8 с и монолог на 50 с без пауз"""
+    segment = _silence(0)
+    for _ in range(12):
+        segment += _speech(9000) + _silence(800)
+    return segment + _speech(50000)
+
+
+def test_short_voice_is_one_chunk():
+    segment = _speech(5000)
+    assert asr.split_on_silence(segment) == [segment]
+
+
+def test_split_on_silence_limits_chunks():
+    segment = _long_voice()
+    chunks = asr.split_on_silence(segment, max_ms=20000)
+    assert all(len(chunk) <= 20000 for chunk in chunks)
+    # Две фразы с паузой влезают в кусок, монолог режется на 20+20+10
+    assert len(chunks) == 6 + 3
+    # Куски идут подряд: речь не теряется
+    assert sum(len(chunk) for chunk in chunks) >= len(segment) - 1000
+
+
+def test_split_on_silence_only_silence():
+    assert asr.split_on_silence(_silence(30000)) == []
+
+
+def test_stub_backend():
+    stub = asr.get_backend('stub')
+    assert asr.get_backend('stub') is stub
+    pcm = _speech(2500).raw_data
+    assert stub.recognize(pcm, 'ru-RU') == 'фрагмент 2.5 с'
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        asr.get_backend('whisper')
+
+
+def test_pipeline_stitches_chunks_in_order(monkeypatch):
+    chunks = [_speech(ms).raw_data for ms in (3000, 1000, 2000)]
+    monkeypatch.setattr(voice_module, '_decode', lambda ogg_bytes: chunks)
+    pipeline = voice_module.VoicePipeline(workers=2, backend='stub')
+    pipeline._pool = ThreadPoolExecutor(2)
+    partials = []
+
+    async def on_partial(text):
+        partials.append(text)
+
+    try:
+        text = asyncio.run(pipeline.transcribe(b'ogg', on_partial=on_partial))
+    finally:
+        pipeline._pool.shutdown()
+    assert text == 'фрагмент 3.0 с фрагмент 1.0 с фрагмент 2.0 с'
+    # Пока готовы не все куски, на их месте «…»
+    assert len(partials) == 2 and all('…' in partial for partial in partials)
+
+
+def test_pipeline_nothing_recognized(monkeypatch):
+    monkeypatch.setattr(voice_module, '_decode', lambda ogg_bytes: [])
+    pipeline = voice_module.VoicePipeline(workers=1, backend='stub')
+    pipeline._pool = ThreadPoolExecutor(1)
+    try:
+        with pytest.raises(voice_module.NothingRecognized):
+            asyncio.run(pipeline.transcribe(b'ogg'))
+    finally:
+        pipeline._pool.shutdown()
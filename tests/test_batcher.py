@@ -0,0 +1,107 @@
+import asyncio
+import gc
+
+from bots.nezabudka.batcher import TaskBatcher
+
+
+def _collector():
+    batches = []
+
+    async def flush(items):
+        await asyncio.sleep(0)
+        batches.append([text for _, text in items])
+
+    return batches, flush
+
+
+def test_messages_within_window_form_one_batch():
+    async def scenario():
+        batches, flush = _collector()
+        batcher = TaskBatcher(50, flush)
+        for text in ('a', 'b', 'c'):
+            batcher.add(1, None, text)
+        batcher.add(2, None, 'x')
+        await asyncio.sleep(0.1)
+        assert sorted(batches) == [['a', 'b', 'c'], ['x']]
+        assert batcher.stats()['batches'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_full_batch_flushes_without_waiting():
+    async def scenario():
+        batches, flush = _collector()
+        batcher = TaskBatcher(10_000, flush, max_items=2)
+        batcher.add(1, None, 'a')
+        batcher.add(1, None, 'b')
+        # Фоновая задача живёт только в батчере
+        gc.collect()
+        await asyncio.sleep(0.01)
+        assert batches == [['a', 'b']]
+        assert not batcher._timers
+
+    asyncio.run(scenario())
+
+
+def test_flush_all_sends_pending_batches():
+    async def scenario():
+        batches, flush = _collector()
+        batcher = TaskBatcher(10_000, flush)
+        batcher.add(1, None, 'a')
+        batcher.add(2, None, 'b')
+        await batcher.flush_all()
+        assert sorted(batches) == [['a'], ['b']]
+        assert not batcher._tasks and not batcher._pending
+
+    asyncio.run(scenario())
+
+
+def test_flush_error_does_not_break_batcher():
+    async def scenario():
+        async def flush(items):
+            raise RuntimeError('db down')
+
+        batcher = TaskBatcher(10_000, flush)
+        batcher.add(1, None, 'a')
+        await batcher.flush_all()
+        assert batcher.stats()['batches'] == 1
+
+    asyncio.run(scenario())
+
+
+class _Message:
+    class from_user:
+        id = 7
+
+    def __init__(self):
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+def test_batch_reply_counts_stored_tasks(monkeypatch):
+    from bots.nezabudka import handlers
+
+    replies = []
+
+    async def safe_reply(message, header, content, model_info, reply_markup=None):
+        replies.append(header)
+
+    monkeypatch.setattr(handlers, 'safe_reply', safe_reply)
+    message = _Message()
+    items = [(message, 'задача: купить молоко завтра #дом'), (message, 'задача: позвонить маме завтра #дом')]
+
+    async def add_tasks(docs):
+        return ['id1']
+
+    monkeypatch.setattr(handlers.db, 'add_tasks', add_tasks)
+    asyncio.run(handlers.process_batch(items))
+    assert replies == ['✅ <b>СОХРАНЕНО: 1 из 2</b>']
+
+    async def add_nothing(docs):
+        return []
+
+    monkeypatch.setattr(handlers.db, 'add_tasks', add_nothing)
+    asyncio.run(handlers.process_batch(items))
+    assert len(replies) == 1 and message.answers and message.answers[0].startswith('❌')
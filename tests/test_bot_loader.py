@@ -0,0 +1,39 @@
+import asyncio
+import sys
+
+from aiogram import Dispatcher
+
+from utils import bot_loader
+from utils.bot_loader import HandlersLoader
+
+
+def test_failed_lazy_import_is_retried(tmp_path, monkeypatch):
+    module = tmp_path / 'flaky_handlers.py'
+    module.write_text("raise ImportError('transient')\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    monkeypatch.setattr(bot_loader, 'HANDLERS_RETRY', 60)
+
+    async def scenario():
+        loader = HandlersLoader('flaky', 'flaky_handlers', Dispatcher(), lazy=True)
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event)
+
+        assert await loader(handler, 'update-1', {}) is None
+        assert loader.dropped == 1 and loader.failures == 1 and 'transient' in loader.error
+
+        module.write_text("from aiogram import Router\nrouter = Router()\n")
+        # Ещё рано для повтора — без нового импорта
+        assert not await loader.ensure_loaded()
+        assert loader.failures == 1
+
+        monkeypatch.setattr(bot_loader, 'HANDLERS_RETRY', 0)
+        await loader(handler, 'update-2', {})
+        assert loader.loaded and loader.error is None
+        assert handled == ['update-2']
+        # Импорт в потоке: прирост памяти не измеряем
+        assert loader.report()['rss_delta_mb'] is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+import pytest
+
+from utils import circuit_breaker
+from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(circuit_breaker, 'time', clock)
+    monkeypatch.setattr(circuit_breaker, 'BREAKER_CONSECUTIVE', 3)
+    monkeypatch.setattr(circuit_breaker, 'BREAKER_MIN_CALLS', 10)
+    monkeypatch.setattr(circuit_breaker, 'BREAKER_OPEN_SECONDS', 30)
+    monkeypatch.setattr(circuit_breaker, 'BREAKER_PROBES', 1)
+    return clock
+
+
+def _fail(breaker, times):
+    for _ in range(times):
+        breaker.allow()
+        breaker.record_failure('HTTP 502')
+
+
+def test_consecutive_failures_open_and_fast_fail(clock):
+    breaker = CircuitBreaker('test-open')
+    _fail(breaker, 2)
+    assert breaker.state == CLOSED
+    _fail(breaker, 1)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_failure_rate_opens_with_enough_calls(clock):
+    breaker = CircuitBreaker('test-rate')
+    for i in range(10):
+        breaker.allow()
+        # Чередуем, чтобы не сработал порог ошибок подряд
+        if i % 2:
+            breaker.record_failure('timeout')
+        else:
+            breaker.record_success()
+    assert breaker.state == OPEN
+
+
+def test_half_open_probe_closes_on_success(clock):
+    breaker = CircuitBreaker('test-probe-ok')
+    _fail(breaker, 3)
+    clock.now += 30
+    assert breaker.is_open is False
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Единственный пробный слот занят
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker('test-probe-fail')
+    _fail(breaker, 3)
+    clock.now += 30
+    breaker.allow()
+    breaker.record_failure('HTTP 503')
+    assert breaker.state == OPEN
+    assert breaker.stats()['retry_in_sec'] == 30
+
+
+def test_cancelled_probe_frees_slot(clock):
+    breaker = CircuitBreaker('test-probe-cancel')
+    _fail(breaker, 3)
+    clock.now += 30
+    breaker.allow()
+    breaker.cancelled()
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+import pytest
+
+from bots.nezabudka.extractor import DEFAULT_TAG, TZ, extract
+
+# Среда, 14 октября 2026, 10:00
+NOW = datetime(2026, 10, 14, 10, 0, tzinfo=TZ)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('сделать уроки', {'type': 'Задача', 'action': 'Сделать уроки', 'deadline': 'нет'}),
+    ('Сделать: уроки завтра', {'type': 'Задача', 'action': 'Сделать уроки', 'deadline': '15.10.2026'}),
+    ('задача: купить молоко завтра в 9 утра #дом',
+     {'type': 'Задача', 'action': 'Купить молоко', 'tag': '#дом', 'deadline': '15.10.2026 09:00'}),
+    ('идея: бот для заметок', {'type': 'Идея', 'action': 'Бот для заметок', 'tag': DEFAULT_TAG}),
+    ('позвонить маме в пятницу', {'action': 'Позвонить маме', 'deadline': '16.10.2026'}),
+    ('отчёт 15.11 в 18:30', {'action': 'Отчёт', 'deadline': '15.11.2026 18:30'}),
+])
+def test_extract(text, expected):
+    data, confidence = extract(text, now=NOW)
+    assert {k: data[k] for k in expected} == expected
+    assert confidence > 0
+
+
+def test_empty_action_is_not_a_task():
+    assert extract('#дом', now=NOW) == ({}, 0.0)
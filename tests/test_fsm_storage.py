@@ -0,0 +1,93 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from utils.fsm_storage import CachedStorage, Record
+
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+class _Backend:
+    def __init__(self, load_delay: float = 0):
+        self.records = {}
+        self.load_delay = load_delay
+        self.fail_saves = 0
+
+    async def load(self, key_id):
+        await asyncio.sleep(self.load_delay)
+        rec = self.records.get(key_id)
+        return Record(rec.state, dict(rec.data), rec.expires_at) if rec else None
+
+    async def save(self, records):
+        if self.fail_saves:
+            self.fail_saves -= 1
+            raise ConnectionError('backend down')
+        for key_id, rec in records.items():
+            if rec.empty:
+                self.records.pop(key_id, None)
+            else:
+                self.records[key_id] = Record(rec.state, dict(rec.data), rec.expires_at)
+
+    async def purge_expired(self, now):
+        pass
+
+
+def test_concurrent_misses_share_one_record():
+    async def scenario():
+        storage = CachedStorage(_Backend(load_delay=0.01), flush_interval=60)
+        # Оба апдейта промахиваются по кэшу и ждут backend одновременно
+        await asyncio.gather(storage.set_state(_key(1), 'Report:object'), storage.get_data(_key(1)))
+        assert await storage.get_state(_key(1)) == 'Report:object'
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_evicted_dirty_record_is_kept_and_flushed():
+    async def scenario():
+        backend = _Backend()
+        storage = CachedStorage(backend, max_entries=2, flush_interval=60)
+        for user_id in (1, 2, 3):
+            await storage.set_state(_key(user_id), f'Report:step{user_id}')
+        assert storage.stats()['cached'] == 2 and storage.stats()['pending'] == 1
+        # Вытесненная запись ещё не в backend, но читается
+        assert await storage.get_state(_key(1)) == 'Report:step1'
+        await storage.flush()
+        assert {rec.state for rec in backend.records.values()} == {'Report:step1', 'Report:step2', 'Report:step3'}
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_state_expires_by_group_ttl():
+    async def scenario():
+        storage = CachedStorage(None, state_ttls={'Report': -1, 'Brand:waiting': 60}, flush_interval=60)
+        assert storage.ttl_for('Report:comment') == -1
+        assert storage.ttl_for('Brand:waiting') == 60
+        assert storage.ttl_for('Other:x') == storage.default_ttl
+        await storage.set_data(_key(1), {'object': 'Кафе 2'})
+        await storage.set_state(_key(1), 'Report:comment')
+        assert await storage.get_state(_key(1)) is None
+        assert await storage.get_data(_key(1)) == {}
+        assert storage.expired == 1
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_is_retried():
+    async def scenario():
+        backend = _Backend()
+        backend.fail_saves = 1
+        storage = CachedStorage(backend, max_entries=1, flush_interval=60)
+        await storage.set_state(_key(1), 'Report:a')
+        await storage.set_state(_key(2), 'Report:b')
+        await storage.flush()
+        assert backend.records == {}
+        await storage.flush()
+        assert {rec.state for rec in backend.records.values()} == {'Report:a', 'Report:b'}
+        await storage.close()
+
+    asyncio.run(scenario())
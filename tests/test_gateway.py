@@ -0,0 +1,132 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+
+from utils import gateway
+from utils.circuit_breaker import CircuitBreaker
+
+
+class _Response:
+    def __init__(self, status_code=200, fail_midstream=False):
+        self.status_code = status_code
+        self.fail_midstream = fail_midstream
+
+    async def aiter_lines(self):
+        yield 'data: {}'
+        if self.fail_midstream:
+            raise httpx.ReadError('connection reset')
+
+
+@pytest.fixture
+def gw(monkeypatch):
+    endpoint = gateway.Endpoint('http://gw.test/v1')
+    breaker = CircuitBreaker('test-stream')
+    monkeypatch.setattr(gateway, 'ENDPOINTS', [endpoint])
+    monkeypatch.setattr(gateway, 'breaker', breaker)
+    return endpoint, breaker
+
+
+def _serve(monkeypatch, response):
+    @asynccontextmanager
+    async def fake_stream_json(url, payload, headers, read_timeout=None):
+        yield response
+
+    monkeypatch.setattr(gateway, 'stream_json', fake_stream_json)
+
+
+async def _consume():
+    async with gateway.stream_chat({}, {}) as response:
+        async for _ in response.aiter_lines():
+            pass
+
+
+def test_stream_records_success_once(gw, monkeypatch):
+    endpoint, breaker = gw
+    _serve(monkeypatch, _Response())
+    asyncio.run(_consume())
+    assert list(ok for _, ok in breaker._calls) == [True]
+    assert endpoint.failures == 0
+
+
+def test_midstream_error_is_a_single_failure(gw, monkeypatch):
+    endpoint, breaker = gw
+    _serve(monkeypatch, _Response(fail_midstream=True))
+    with pytest.raises(httpx.ReadError):
+        asyncio.run(_consume())
+    # Заголовки пришли (латентность учтена), но исход потока — одна ошибка
+    assert list(ok for _, ok in breaker._calls) == [False]
+    assert breaker.consecutive_failures == 1
+    assert endpoint.ewma is not None and endpoint.failures == 0
+
+
+def _endpoints(monkeypatch, *urls):
+    endpoints = [gateway.Endpoint(url) for url in urls]
+    monkeypatch.setattr(gateway, 'ENDPOINTS', endpoints)
+    return endpoints
+
+
+def test_ewma_prefers_faster_endpoint_and_skips_down(monkeypatch):
+    fast, slow = _endpoints(monkeypatch, 'http://fast/v1', 'http://slow/v1')
+    for _ in range(5):
+        fast.record(0.2, ok=True)
+        slow.record(1.0, ok=True)
+    assert gateway.pick_endpoint() is fast
+    assert 0.2 <= fast.ewma < slow.ewma
+
+    for _ in range(gateway.ENDPOINT_MAX_FAILURES):
+        fast.record(0.0, ok=False)
+    assert not fast.healthy
+    assert gateway.pick_endpoint() is slow
+
+
+def test_hedge_cancels_slow_primary(monkeypatch):
+    primary, secondary = _endpoints(monkeypatch, 'http://primary/v1', 'http://secondary/v1')
+    primary.ewma, secondary.ewma = 0.01, 0.5
+    monkeypatch.setattr(gateway, 'GATEWAY_HEDGE', True)
+    monkeypatch.setattr(gateway, 'GATEWAY_HEDGE_MIN_DELAY', 0.05)
+    monkeypatch.setattr(gateway, 'GATEWAY_HEDGE_DEFAULT_DELAY', 0.05)
+    monkeypatch.setattr(gateway, 'breaker', CircuitBreaker('test-hedge'))
+    cancelled = []
+
+    async def fake_post_json(url, payload, headers, read_timeout=None):
+        if url == primary.chat_url:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+        return httpx.Response(200, text=url)
+
+    monkeypatch.setattr(gateway, 'post_json', fake_post_json)
+
+    async def scenario():
+        response = await gateway.post_chat({}, {}, hedge=True)
+        await asyncio.sleep(0)
+        return response
+
+    response = asyncio.run(scenario())
+    assert response.text == secondary.chat_url
+    assert cancelled == [primary.chat_url]
+    # Проигравший учтён как оценка снизу, без ошибки и без «зависшего» inflight
+    assert primary.failures == 0 and primary.inflight == 0
+    assert primary.ewma > 0.01
+
+
+def test_no_hedge_when_primary_answers_in_time(monkeypatch):
+    primary, secondary = _endpoints(monkeypatch, 'http://primary/v1', 'http://secondary/v1')
+    primary.ewma, secondary.ewma = 0.1, 0.5
+    monkeypatch.setattr(gateway, 'GATEWAY_HEDGE', True)
+    monkeypatch.setattr(gateway, 'GATEWAY_HEDGE_MIN_DELAY', 0.5)
+    monkeypatch.setattr(gateway, 'breaker', CircuitBreaker('test-no-hedge'))
+    urls = []
+
+    async def fake_post_json(url, payload, headers, read_timeout=None):
+        urls.append(url)
+        return httpx.Response(200, text=url)
+
+    monkeypatch.setattr(gateway, 'post_json', fake_post_json)
+    response = asyncio.run(gateway.post_chat({}, {}, hedge=True))
+    assert response.text == primary.chat_url
+    assert urls == [primary.chat_url]
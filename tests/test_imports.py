@@ -0,0 +1,20 @@
+"""Smoke: handlers каждого бота импортируются (как их грузит main.py)"""
+from importlib import import_module
+from pathlib import Path
+
+import pytest
+
+BOTS_DIR = Path(__file__).resolve().parent.parent / 'bots'
+BOTS = sorted(p.name for p in BOTS_DIR.iterdir() if (p / 'handlers.py').exists())
+
+
+@pytest.mark.parametrize('bot', BOTS)
+def test_handlers_import(bot):
+    try:
+        module = import_module(f'bots.{bot}.handlers')
+    except ModuleNotFoundError as e:
+        # Нет сторонней зависимости в этом окружении — не ошибка кода бота
+        if e.name.split('.')[0] in ('bots', 'utils'):
+            raise
+        pytest.skip(f'missing dependency: {e.name}')
+    assert module.router is not None
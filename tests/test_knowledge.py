@@ -0,0 +1,52 @@
+import os
+
+from bots.staff_bot.knowledge import KnowledgeBase, split_passages
+
+DOC = """# Закрытие смены
+Отчёт о закрытии смены отправляется администратору до 23:00 через бота.
+
+# Инкассация
+Инкассация кассы проводится по пятницам, деньги сдаёт старший смены.
+
+# Пропуск
+Пропуск на склад выдаёт охрана при входе.
+"""
+
+
+def _kb(tmp_path, content=DOC):
+    (tmp_path / 'rules.md').write_text(content, encoding='utf-8')
+    kb = KnowledgeBase(tmp_path)
+    kb.refresh(force=True)
+    return kb
+
+
+def test_sections_become_passages():
+    passages = split_passages('rules.md', DOC)
+    assert [p.title for p in passages] == ['Закрытие смены', 'Инкассация', 'Пропуск']
+
+
+def test_search_ranks_matching_section_first(tmp_path):
+    kb = _kb(tmp_path)
+    hits = kb.search('когда проводится инкассация кассы?')
+    assert hits[0].passage.title == 'Инкассация'
+    assert kb.is_confident(hits)
+
+
+def test_vague_question_is_not_confident(tmp_path):
+    kb = _kb(tmp_path)
+    # Слово есть в нескольких разделах, остальные — нигде
+    hits = kb.search('смены зарплата отпуск')
+    assert hits and not kb.is_confident(hits)
+    assert kb.search('погода завтра') == []
+
+
+def test_changed_file_is_reindexed(tmp_path):
+    kb = _kb(tmp_path)
+    assert kb.search('парковка') == []
+    path = tmp_path / 'rules.md'
+    path.write_text(DOC + "\n# Парковка\nПарковка для сотрудников — за складом.\n", encoding='utf-8')
+    stat = path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+    assert kb.refresh(force=True)
+    assert kb.search('где парковка')[0].passage.title == 'Парковка'
+    assert kb.stats()['files'] == 1
@@ -0,0 +1,53 @@
+import asyncio
+
+from bots.staff_bot.mirror import ShiftMirror
+
+
+class _Spool:
+    async def count(self):
+        return 0
+
+
+class _Sheets:
+    """Лист в памяти: read('A{start}:G') отдаёт строки начиная с start"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.reads = []
+        self.spool = _Spool()
+
+    async def read(self, cells):
+        start = int(cells[1:cells.index(':')])
+        self.reads.append(start)
+        return [list(r) for r in self.rows[start - 1:]]
+
+
+HEADER = ['Дата', 'Объект', 'Сотрудник', 'Взрослые', 'Льготные', 'Выручка', 'Комментарий']
+
+
+def test_incremental_pull_reads_only_new_rows(tmp_path):
+    sheets = _Sheets([HEADER, ['01.03.2026', 'Кафе', 'Оля', '2', '0', '1 500', '']])
+    mirror = ShiftMirror(sheets, str(tmp_path / 'mirror.sqlite3'))
+
+    async def scenario():
+        await mirror.pull()  # первый раз — полная сверка
+        # Бот записал отчёт: в зеркале сразу, в листе — после отправки spool
+        row = ['01.03.2026', 'Билеты', 'Петя', 3, 1, 580, '']
+        await mirror.record(row)
+        sheets.rows.append([str(v) for v in row])
+        # Ручная правка: строка добавлена прямо в лист
+        sheets.rows.append(['02.03.2026', 'Кафе', 'Оля', '1', '1', '700', 'вручную'])
+
+        assert await mirror.pull() == 1
+        assert sheets.reads[-1] == 3
+        # Строки бота не задваиваются; повторный pull ничего не добавляет
+        assert await mirror.pull() == 0
+        assert sheets.reads[-1] == 5
+
+        by_object, by_staff, pulled_at = await mirror.summary('2026-03-01', '2026-03-02')
+        assert by_object == [('Кафе', 2, 3, 1, 2200), ('Билеты', 1, 3, 1, 580)]
+        assert dict((s, r) for s, _, r in by_staff) == {'Оля': 2200, 'Петя': 580}
+        assert pulled_at is not None
+        await mirror.close()
+
+    asyncio.run(scenario())
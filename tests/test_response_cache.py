@@ -0,0 +1,54 @@
+import asyncio
+
+from utils import response_cache as cache_module
+from utils.response_cache import ResponseCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    async def scenario():
+        cache = ResponseCache(max_entries=2, disk_path='')
+        await cache.set('a', 'A', 'm')
+        await cache.set('b', 'B', 'm')
+        assert await cache.get('a') == ('A', 'm')
+        await cache.set('c', 'C', 'm')
+        assert await cache.get('b') is None
+        assert await cache.get('a') == ('A', 'm')
+
+    asyncio.run(scenario())
+
+
+def test_expired_entry_only_served_as_stale(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache_module, 'time', clock)
+
+    async def scenario():
+        cache = ResponseCache(disk_path='')
+        await cache.set('k', 'ответ', 'm', ttl=60)
+        clock.now += 61
+        assert await cache.get('k') is None
+        # Шлюз лежит — лучше устаревший ответ, чем никакого
+        assert await cache.get('k', allow_stale=True) == ('ответ', 'm')
+
+    asyncio.run(scenario())
+
+
+def test_disk_tier_survives_restart_and_warms_memory(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+
+    async def scenario():
+        first = ResponseCache(disk_path=path)
+        await first.set('k', 'ответ', 'model-x', ttl=600)
+
+        restarted = ResponseCache(disk_path=path)
+        assert await restarted.get('k') == ('ответ', 'model-x')
+        assert 'k' in restarted._memory
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight('test')
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'ответ'
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do('k', fetch) for _ in range(5)))
+        assert results == ['ответ'] * 5
+        assert len(calls) == 1 and len(flight) == 0
+        # После завершения ключ свободен — новый вызов идёт в upstream
+        await flight.do('k', fetch)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_error_is_shared_and_key_released():
+    flight = SingleFlight('test-error')
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError('gateway down')
+
+    async def scenario():
+        results = await asyncio.gather(flight.do('k', fail), flight.do('k', fail), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert flight.running('k') is None
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_cancel_others():
+    flight = SingleFlight('test-cancel')
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return 'ok'
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do('k', fetch))
+        follower = asyncio.ensure_future(flight.do('k', fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == 'ok'
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(scenario())
+
+
+def test_stream_leader_finishes_for_joiners():
+    flight = SingleFlight('test-stream')
+
+    async def scenario():
+        future = flight.begin('k')
+        joiner = asyncio.ensure_future(flight.join(flight.running('k')))
+        await asyncio.sleep(0)
+        flight.finish(future, ('текст', 'model', 'Gateway'))
+        # Повторный finish (из finally прерванного стрима) — без эффекта
+        flight.finish(future, error=RuntimeError('stream aborted'))
+        assert await joiner == ('текст', 'model', 'Gateway')
+        assert flight.running('k') is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import asyncio
+
+from bots.staff_bot.sheets import _Spool
+from utils.fsm_storage import Record, SQLiteBackend
+from utils.response_cache import _DiskTier
+
+
+def test_spool_roundtrip(tmp_path):
+    async def scenario():
+        spool = _Spool(str(tmp_path / 'spool.sqlite3'))
+        await spool.put(['01.01.2026', 'Кафе 2', 'Оля', 0, 0, 1500, 'нет'])
+        await spool.put(['01.01.2026', 'Билеты', 'Петя', 3, 1, 580, ''])
+        rows = await spool.peek(10)
+        assert [row[1] for _, row in rows] == ['Кафе 2', 'Билеты']
+        await spool.delete([rows[0][0]])
+        assert await spool.count() == 1
+
+    asyncio.run(scenario())
+
+
+def test_fsm_sqlite_roundtrip(tmp_path):
+    async def scenario():
+        backend = SQLiteBackend(str(tmp_path / 'fsm.sqlite3'))
+        await backend.save({'k': Record('Report:object', {'a': 1}, 10**10)})
+        record = await backend.load('k')
+        assert (record.state, record.data) == ('Report:object', {'a': 1})
+        await backend.save({'k': Record()})
+        assert await backend.load('k') is None
+        backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_cache_disk_tier_roundtrip(tmp_path):
+    async def scenario():
+        disk = _DiskTier(str(tmp_path / 'cache.sqlite3'))
+        await disk.set('key', 'ответ', 'model', 10**10)
+        assert (await disk.get('key'))[:2] == ('ответ', 'model')
+        assert await disk.get('other') is None
+
+    asyncio.run(scenario())
+
+
+def test_mirror_rebuild_keeps_recorded_at(tmp_path):
+    from bots.staff_bot.mirror import ShiftMirror
+
+    mirror = ShiftMirror(sheets=None, path=str(tmp_path / 'mirror.sqlite3'))
+    mirror._record(['01.01.2026', 'Кафе 2', 'Оля', 0, 0, 1500, 'нет'])
+    mirror._rebuild([['Дата'], ['02.01.2026', 'Билеты', 'Петя', '3', '1', '580', '']], delivered_before=0)
+    rows = mirror._conn.execute('SELECT row_num, staff, recorded_at FROM shifts ORDER BY id').fetchall()
+    assert [(row_num, staff) for row_num, staff, _ in rows] == [(None, 'Оля'), (2, 'Петя')]
+    assert all(recorded_at for *_, recorded_at in rows)
+    totals = mirror._conn.execute('SELECT staff, reports, revenue FROM totals ORDER BY staff').fetchall()
+    assert totals == [('Оля', 1, 1500), ('Петя', 1, 580)]
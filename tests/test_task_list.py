@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+from bots.nezabudka.database import Database
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs = sorted(self.docs, key=lambda d: d[field], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class _Tasks:
+    def __init__(self):
+        self.docs = []
+        self.finds = 0
+
+    def find(self, query):
+        self.finds += 1
+        return _Cursor([d for d in self.docs if all(d.get(k) == v for k, v in query.items())])
+
+    async def insert_one(self, doc):
+        doc['_id'] = len(self.docs) + 1
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=doc['_id'])
+
+    async def update_one(self, query, update):
+        for doc in self.docs:
+            if all(doc.get(k) == v for k, v in query.items()):
+                doc.update(update['$set'])
+                return SimpleNamespace(modified_count=1)
+        return SimpleNamespace(modified_count=0)
+
+
+class _Stats:
+    async def update_one(self, query, update, upsert=False):
+        pass
+
+
+def _database():
+    db = Database()
+    db.mongo_db = SimpleNamespace(tasks=_Tasks(), stats=_Stats())
+    return db
+
+
+async def _add(db, user_id, action, at):
+    await db.add_task({'user_id': user_id, 'action': action, 'created_at': at})
+
+
+def test_repeated_list_is_served_from_cache():
+    async def scenario():
+        db = _database()
+        await _add(db, 1, 'первая', 1)
+        assert [t['action'] for t in await db.get_active_tasks(1)] == ['первая']
+        await db.get_active_tasks(1)
+        assert db.mongo_db.tasks.finds == 1
+        # Новая задача помечает список устаревшим — /list перечитывает базу
+        await _add(db, 1, 'вторая', 2)
+        assert [t['action'] for t in await db.get_active_tasks(1)] == ['вторая', 'первая']
+        assert db.mongo_db.tasks.finds == 2
+
+    asyncio.run(scenario())
+
+
+def test_done_uses_numbers_from_shown_list():
+    async def scenario():
+        db = _database()
+        await _add(db, 1, 'купить хлеб', 1)
+        await _add(db, 1, 'позвонить маме', 2)
+        await db.get_active_tasks(1)  # /list: 1 — позвонить маме, 2 — купить хлеб
+        await _add(db, 1, 'новая после /list', 3)
+
+        assert await db.mark_done_by_index(1, 2) == 'купить хлеб'
+        # Повторный /done с тем же номером — задача уже выполнена
+        assert await db.mark_done_by_index(1, 2) is None
+        assert await db.mark_done_by_index(1, 5) is None
+        assert [t['action'] for t in await db.get_active_tasks(1)] == ['новая после /list', 'позвонить маме']
+
+    asyncio.run(scenario())
+
+
+def test_done_without_list_reads_current_tasks():
+    async def scenario():
+        db = _database()
+        await _add(db, 7, 'единственная', 1)
+        assert await db.mark_done_by_index(7, 1) == 'единственная'
+        assert await db.get_active_tasks(7) == []
+
+    asyncio.run(scenario())
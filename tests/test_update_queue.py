@@ -0,0 +1,111 @@
+import asyncio
+import random
+
+from utils.update_queue import OVERFLOW_DROP, OVERFLOW_REJECT, UpdateQueue
+
+
+def _update(update_id: int, chat_id: int) -> dict:
+    return {'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'text': str(update_id)}}
+
+
+class _Dispatcher:
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def feed_raw_update(self, bot, data):
+        await self.handler(data)
+
+
+class _Request:
+    def __init__(self, data):
+        self.data = data
+
+    async def json(self):
+        return self.data
+
+
+def test_updates_of_one_chat_keep_order():
+    async def scenario():
+        seen = {}
+
+        async def handler(data):
+            await asyncio.sleep(random.random() / 100)
+            seen.setdefault(data['message']['chat']['id'], []).append(data['update_id'])
+
+        queue = UpdateQueue('test', _Dispatcher(handler), bot=None, workers=4)
+        queue.start()
+        for update_id in range(60):
+            assert queue.submit(_update(update_id, chat_id=update_id % 3))
+        await queue.stop()
+        assert seen == {chat: list(range(chat, 60, 3)) for chat in range(3)}
+        assert queue.processed == 60 and queue.depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_slow_chat_does_not_block_others():
+    """Чаты 1 и 3 раньше попадали в один шард (chat_id % 2) и шли друг за другом"""
+    async def scenario():
+        release = asyncio.Event()
+        done = []
+
+        async def handler(data):
+            chat_id = data['message']['chat']['id']
+            if chat_id == 1:
+                await release.wait()
+            done.append(chat_id)
+
+        queue = UpdateQueue('test', _Dispatcher(handler), bot=None, workers=2)
+        queue.start()
+        queue.submit(_update(1, chat_id=1))
+        queue.submit(_update(2, chat_id=1))
+        queue.submit(_update(3, chat_id=3))
+        queue.submit(_update(4, chat_id=3))
+        await asyncio.sleep(0.05)
+        # Второй апдейт чата 1 ждёт первый, чат 3 уже обработан
+        assert done == [3, 3]
+        release.set()
+        await queue.stop()
+        assert done == [3, 3, 1, 1]
+
+    asyncio.run(scenario())
+
+
+def test_overflow_drop_acks_and_counts():
+    async def scenario():
+        queue = UpdateQueue('test', _Dispatcher(None), bot=None, workers=1, maxsize=2, overflow=OVERFLOW_DROP)
+        assert queue.submit(_update(1, 1)) and queue.submit(_update(2, 2))
+        response = await queue.handle(_Request(_update(3, 3)))
+        assert response.status == 200
+        assert (queue.accepted, queue.dropped, queue.rejected, queue.depth) == (2, 1, 0, 2)
+
+    asyncio.run(scenario())
+
+
+def test_overflow_reject_returns_503():
+    async def scenario():
+        queue = UpdateQueue('test', _Dispatcher(None), bot=None, workers=1, maxsize=1, overflow=OVERFLOW_REJECT)
+        assert (await queue.handle(_Request(_update(1, 1)))).status == 200
+        assert (await queue.handle(_Request(_update(2, 1)))).status == 503
+        assert (queue.accepted, queue.dropped, queue.rejected) == (1, 0, 1)
+
+    asyncio.run(scenario())
+
+
+def test_failed_update_does_not_stop_chat():
+    async def scenario():
+        seen = []
+
+        async def handler(data):
+            if data['update_id'] == 1:
+                raise RuntimeError('boom')
+            seen.append(data['update_id'])
+
+        queue = UpdateQueue('test', _Dispatcher(handler), bot=None, workers=1)
+        queue.start()
+        queue.submit(_update(1, 5))
+        queue.submit(_update(2, 5))
+        await queue.stop()
+        assert seen == [2] and queue.failed == 1
+
+    asyncio.run(scenario())
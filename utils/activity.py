@@ -0,0 +1,323 @@
+"""
+Write-behind трекинг активности пользователей для всех ботов
+
+ActivityMiddleware (outer на dp.update) только кладёт хит в память —
+апдейт не ждёт MongoDB. Повторные хиты одного пользователя склеиваются,
+буфер сбрасывается раз в ACTIVITY_FLUSH_INTERVAL сек или при
+ACTIVITY_FLUSH_SIZE пользователях одним неупорядоченным bulk_write
+(upsert + $inc) на базу.
+
+Схема users совместима со старой Незабудкой:
+username, first_name, last_active_at, joined_at, interaction_count
++ счётчики по ботам в bot_interactions.<бот>.
+
+Заодно пишутся роллапы activity_hours / activity_days: хиты и
+HyperLogLog-скетч пользователей (HLL_M регистров, обновляются через $max,
+размер документа не зависит от числа пользователей), и счётчик
+users_total в документе stats. Не чаще раза в ACTIVITY_SUMMARY_INTERVAL
+сек из скетчей пересчитывается сводка stats.activity (активные за
+24ч/7д, по дням) — /stats читает её одним find_one.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from utils.metrics import ACTIVITY_BUFFERED, MONGO_LATENCY
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_ENABLED = os.getenv('ACTIVITY_ENABLED', 'true').lower() == 'true'
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 5))
+ACTIVITY_FLUSH_SIZE = int(os.getenv('ACTIVITY_FLUSH_SIZE', 500))
+# Если Mongo долго недоступна — буфер не растёт бесконечно
+ACTIVITY_MAX_BUFFER = int(os.getenv('ACTIVITY_MAX_BUFFER', 20000))
+
+ACTIVITY_DEFAULT_DB = os.getenv('ACTIVITY_DB', 'nezabudka_prod')
+# Незабудка исторически пишет пользователей в свою базу (её /stats читает оттуда)
+BOT_DATABASES = {'nezabudka': 'nezabudka_ai'}
+ACTIVITY_SUMMARY_INTERVAL = float(os.getenv('ACTIVITY_SUMMARY_INTERVAL', 60))
+ACTIVITY_HISTORY_DAYS = 7
+
+# HyperLogLog: 2^11 регистров, погрешность ~2%
+HLL_P = 11
+HLL_M = 1 << HLL_P
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_M)
+
+
+def sketch_registers(user_ids) -> dict:
+    """HLL-скетч пачки пользователей: {номер регистра (str): ранг}"""
+    registers = {}
+    for user_id in user_ids:
+        h = int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'big')
+        rest = h & ((1 << (64 - HLL_P)) - 1)
+        key = str(h >> (64 - HLL_P))
+        rank = 64 - HLL_P - rest.bit_length() + 1
+        if rank > registers.get(key, 0):
+            registers[key] = rank
+    return registers
+
+
+def sketch_count(*sketches) -> int:
+    """Оценка числа уникальных пользователей в объединении скетчей"""
+    merged = {}
+    for sketch in sketches:
+        for key, rank in sketch.items():
+            if rank > merged.get(key, 0):
+                merged[key] = rank
+    zeros = HLL_M - len(merged)
+    estimate = _HLL_ALPHA * HLL_M ** 2 / (zeros + sum(2.0 ** -rank for rank in merged.values()))
+    if estimate <= 2.5 * HLL_M and zeros:
+        # Мало пользователей — linear counting точнее
+        estimate = HLL_M * math.log(HLL_M / zeros)
+    return round(estimate)
+
+
+def _rollup_ops(buckets: dict, fmt: str, field: str) -> list:
+    """buckets: {час или день: [хиты, [user_id]]} → upsert с $inc хитов и $max регистров"""
+    ops = []
+    for at, (count, user_ids) in buckets.items():
+        update = {'$setOnInsert': {field: at},
+                  '$max': {f'r.{key}': rank for key, rank in sketch_registers(user_ids).items()}}
+        if count:
+            update['$inc'] = {'hits': count}
+        ops.append(UpdateOne({'_id': at.strftime(fmt)}, update, upsert=True))
+    return ops
+
+
+async def write_rollups(database, seen: dict, hits: dict = None):
+    """seen: {user_id: время активности}, hits: {user_id: число хитов}"""
+    hours, days = {}, {}
+    for user_id, at in seen.items():
+        hour = at.replace(minute=0, second=0, microsecond=0)
+        count = (hits or {}).get(user_id, 0)
+        for buckets, key in ((hours, hour), (days, hour.replace(hour=0))):
+            bucket = buckets.setdefault(key, [0, []])
+            bucket[0] += count
+            bucket[1].append(user_id)
+    if not hours:
+        return
+    with MONGO_LATENCY.time(db=database.name, op="activity_hours.bulk_write"):
+        await database.activity_hours.bulk_write(_rollup_ops(hours, '%Y%m%d%H', 'hour'), ordered=False)
+    with MONGO_LATENCY.time(db=database.name, op="activity_days.bulk_write"):
+        await database.activity_days.bulk_write(_rollup_ops(days, '%Y%m%d', 'day'), ordered=False)
+
+
+async def rebuild_summary(database, now: datetime = None) -> dict:
+    """Пересчёт stats.activity из скетчей: 24 часовых + 8 дневных документов"""
+    now = now or datetime.utcnow()
+    hour_from = (now - timedelta(hours=23)).strftime('%Y%m%d%H')
+    day_from = (now - timedelta(days=ACTIVITY_HISTORY_DAYS)).strftime('%Y%m%d')
+    week_from = (now - timedelta(days=ACTIVITY_HISTORY_DAYS - 1)).strftime('%Y%m%d')
+    with MONGO_LATENCY.time(db=database.name, op="activity_summary.find"):
+        hours = await database.activity_hours.find({'_id': {'$gte': hour_from}}).to_list(length=24)
+        days = await database.activity_days.find({'_id': {'$gte': day_from}}).to_list(
+            length=ACTIVITY_HISTORY_DAYS + 1)
+
+    by_day = {d['_id']: d for d in days}
+    history = []
+    for offset in range(ACTIVITY_HISTORY_DAYS, -1, -1):
+        day = now - timedelta(days=offset)
+        doc = by_day.get(day.strftime('%Y%m%d'), {})
+        history.append([day.strftime('%Y-%m-%d'), doc.get('hits', 0), sketch_count(doc.get('r', {}))])
+
+    summary = {
+        'u_24h': sketch_count(*(h.get('r', {}) for h in hours)),
+        'u_7d': sketch_count(*(d.get('r', {}) for d in days if d['_id'] >= week_from)),
+        'history': history,
+        'at': now,
+    }
+    with MONGO_LATENCY.time(db=database.name, op="stats.update_one"):
+        await database.stats.update_one({'_id': 'global'}, {'$set': {'activity': summary}}, upsert=True)
+    return summary
+
+
+async def seed_sketches(database, now: datetime = None):
+    """Первый запуск: скетчи за последнюю неделю из users.last_active_at (по индексу)"""
+    now = now or datetime.utcnow()
+    cursor = database.users.find(
+        {'last_active_at': {'$gte': now - timedelta(days=ACTIVITY_HISTORY_DAYS)}}, {'last_active_at': 1})
+    seen = {}
+    with MONGO_LATENCY.time(db=database.name, op="activity.seed"):
+        async for user in cursor:
+            seen[user['_id']] = user['last_active_at']
+            if len(seen) >= 10000:
+                await write_rollups(database, seen)
+                seen = {}
+        await write_rollups(database, seen)
+        await database.stats.update_one({'_id': 'global'}, {'$set': {'sketches_seeded_at': now}}, upsert=True)
+
+
+class _Hit:
+    __slots__ = ('username', 'first_name', 'first_seen', 'last_seen', 'count', 'bots')
+
+    def __init__(self, user, now: datetime):
+        self.username = user.username
+        self.first_name = user.first_name
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 0
+        self.bots = {}
+
+    def add(self, user, bot_name: str, now: datetime, count: int = 1):
+        self.username = user.username
+        self.first_name = user.first_name
+        self.last_seen = max(self.last_seen, now)
+        self.count += count
+        self.bots[bot_name] = self.bots.get(bot_name, 0) + count
+
+    def merge(self, other: '_Hit'):
+        """Возврат несохранённой пачки в буфер"""
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.last_seen = max(self.last_seen, other.last_seen)
+        self.count += other.count
+        for bot_name, count in other.bots.items():
+            self.bots[bot_name] = self.bots.get(bot_name, 0) + count
+
+
+class ActivityTracker:
+    def __init__(self):
+        self._buffer = {}  # (db_name, user_id) → _Hit
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self._summary_at = {}  # db_name → monotonic время последнего пересчёта сводки
+        self.flushed = 0
+        self.dropped = 0
+
+    def record(self, db_name: str, bot_name: str, user):
+        key = (db_name, user.id)
+        now = datetime.utcnow()
+        hit = self._buffer.get(key)
+        if hit is None:
+            if len(self._buffer) >= ACTIVITY_MAX_BUFFER:
+                self.dropped += 1
+                return
+            hit = self._buffer[key] = _Hit(user, now)
+        hit.add(user, bot_name, now)
+        ACTIVITY_BUFFERED.set(len(self._buffer))
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if len(self._buffer) >= ACTIVITY_FLUSH_SIZE and not self._flush_lock.locked():
+            asyncio.ensure_future(self.flush())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, {}
+            ACTIVITY_BUFFERED.set(0)
+            if not batch:
+                return
+
+            by_db = {}
+            for (db_name, user_id), hit in batch.items():
+                by_db.setdefault(db_name, {})[user_id] = hit
+            for db_name, hits in by_db.items():
+                try:
+                    await self._write(db_name, hits)
+                    self.flushed += len(hits)
+                except Exception as e:
+                    logger.error(f"⚠️ Activity flush {db_name} ({len(hits)} users): {e}")
+                    self._requeue(db_name, hits)
+                    continue
+                if time.monotonic() - self._summary_at.get(db_name, 0) >= ACTIVITY_SUMMARY_INTERVAL:
+                    self._summary_at[db_name] = time.monotonic()
+                    try:
+                        await self._summarize(db_name)
+                    except Exception as e:
+                        logger.error(f"⚠️ Activity summary {db_name}: {e}")
+
+    async def _summarize(self, db_name: str):
+        from database import db
+        await rebuild_summary(db.mongo_client[db_name])
+
+    async def _write(self, db_name: str, hits: dict):
+        from database import db
+        await db.connect()
+        if db.mongo_client is None:
+            raise RuntimeError("Mongo unavailable")
+
+        operations = []
+        for user_id, hit in hits.items():
+            inc = {'interaction_count': hit.count}
+            inc.update({f'bot_interactions.{bot_name}': count for bot_name, count in hit.bots.items()})
+            operations.append(UpdateOne(
+                {'_id': user_id},
+                {
+                    '$set': {'username': hit.username, 'first_name': hit.first_name},
+                    '$max': {'last_active_at': hit.last_seen},
+                    '$setOnInsert': {'joined_at': hit.first_seen},
+                    '$inc': inc,
+                },
+                upsert=True
+            ))
+        database = db.mongo_client[db_name]
+        with MONGO_LATENCY.time(db=db_name, op="users.bulk_write"):
+            result = await database.users.bulk_write(operations, ordered=False)
+
+        # Роллапы: {_id: "2026101814", hour, hits, r: {регистр: ранг}} и то же по дням
+        await write_rollups(
+            database,
+            {user_id: hit.last_seen for user_id, hit in hits.items()},
+            {user_id: hit.count for user_id, hit in hits.items()},
+        )
+
+        if result.upserted_count:
+            with MONGO_LATENCY.time(db=db_name, op="stats.update_one"):
+                await database.stats.update_one(
+                    {'_id': 'global'}, {'$inc': {'users_total': result.upserted_count}}, upsert=True
+                )
+
+    def _requeue(self, db_name: str, hits: dict):
+        for user_id, hit in hits.items():
+            key = (db_name, user_id)
+            if key in self._buffer:
+                self._buffer[key].merge(hit)
+            elif len(self._buffer) < ACTIVITY_MAX_BUFFER:
+                self._buffer[key] = hit
+            else:
+                self.dropped += 1
+        ACTIVITY_BUFFERED.set(len(self._buffer))
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'enabled': ACTIVITY_ENABLED,
+            'buffered': len(self._buffer),
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+        }
+
+
+activity = ActivityTracker()
+
+
+class ActivityMiddleware:
+    """Outer-middleware на dp.update: отмечает активность пользователя без похода в БД"""
+
+    def __init__(self, bot_name: str):
+        self.bot_name = bot_name
+        self.db_name = BOT_DATABASES.get(bot_name, ACTIVITY_DEFAULT_DB)
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is not None and not user.is_bot:
+            activity.record(self.db_name, self.bot_name, user)
+        return await handler(event, data)
@@ -1,60 +1,185 @@
 import os
+import json
+import time
+import asyncio
 import logging
+from collections import OrderedDict
 import httpx
 from aiogram.types import Message
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
+
+from utils import gateway, model_routing
+from utils.response_cache import AI_CACHE_ENABLED, cache_key, response_cache
+from utils.singleflight import SingleFlight
+from utils.ai_scheduler import PRIORITY_INTERACTIVE, QueueFull, scheduler
+from utils.metrics import AI_LATENCY, AI_ERRORS, AI_FIRST_TOKEN
 
 logger = logging.getLogger(__name__)
 
-# Gateway настройки
-GATEWAY_URL = os.getenv("GATEWAY_BASE_URL", "http://172.86.90.213:3000/v1")
+# Gateway настройки (адреса шлюзов — в utils/gateway.py)
 AI_TOKEN = os.getenv("AI_TOKEN")  # Без дефолта!
 
+# Хеджируем только короткие интерактивные запросы
+HEDGE_MAX_CHARS = int(os.getenv("HEDGE_MAX_CHARS", 2000))
+
+OVERLOADED_TEXT = "⏳ Сейчас слишком много запросов к AI. Попробуйте через минуту."
+UNAVAILABLE_TEXT = "🔌 AI временно недоступен. Попробуйте через пару минут."
+
+# Стриминг: не чаще одного edit в STREAM_EDIT_INTERVAL сек на чат
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.5))
+# Сколько чатов помнить для троттлинга edit (самые давние вытесняются)
+STREAM_EDIT_CHATS = int(os.getenv("STREAM_EDIT_CHATS", 10000))
+TELEGRAM_LIMIT = 4096
+
+# Одинаковые одновременные запросы (пересылки, двойные нажатия) идут в шлюз один раз
+_flight = SingleFlight("ask_brain")
+
 # Проверка обязательных переменных
 if not AI_TOKEN:
     logger.error("❌ AI_TOKEN not set! Gateway requests will fail.")
 
 
-async def ask_brain(sys_prompt: str, user_text: str, model: str = "auto"):
+async def ask_brain(sys_prompt: str, user_text: str, model: str = "auto",
+                    temperature: float = 0.7, cache: bool = True, cache_ttl: int = None,
+                    priority: str = PRIORITY_INTERACTIVE, on_queue=None, route: str = None):
     """
-    Запрос к AI Gateway с правильной авторизацией
+    Запрос к AI Gateway с правильной авторизацией.
+    cache=False — не использовать кэш ответов; cache_ttl — TTL для этого места вызова.
+    Ответ из кэша помечается источником "Cache".
+    priority — interactive/batch; on_queue(position) — колбэк позиции в очереди
+    route — место вызова ("nezabudka.extract"): модель, max_tokens и таймаут из utils/model_routing.py
     """
     if not AI_TOKEN:
         logger.error("AI_TOKEN missing")
         return "Ошибка: AI_TOKEN не настроен", "error", "none"
     
+    # Стикер/фото без подписи: text = None
+    user_text = user_text or ""
+    spec = model_routing.resolve(route, model)
+    use_cache = cache and AI_CACHE_ENABLED
+    try:
+        key = cache_key(sys_prompt, user_text, spec.model, temperature, spec.max_tokens)
+        if use_cache:
+            cached = await response_cache.get(key)
+            if cached:
+                return cached[0], cached[1], "Cache"
+    except Exception as e:
+        logger.error(f"AI cache error: {e}")
+        return f"Ошибка Шлюза: {str(e)}", "error", "none"
+    
+    # Шлюз лежит — не встаём в очередь, отвечаем сразу
+    if gateway.breaker.is_open:
+        return await _circuit_fallback(key if use_cache else None)
+    
     payload = {
-        "model": model,
+        "model": spec.model,
         "messages": [
             {"role": "system", "content": sys_prompt},
             {"role": "user", "content": user_text}
         ],
-        "temperature": 0.7
+        "temperature": temperature
     }
+    if spec.max_tokens:
+        payload["max_tokens"] = spec.max_tokens
     
+    # Ключ кэша — он же отпечаток запроса для single-flight
+    try:
+        return await _flight.do(key, lambda: _fetch(
+            payload, spec, key if use_cache else None, cache_ttl, priority, on_queue
+        ))
+    except Exception as e:
+        # Лидер-стрим мог оборваться на середине
+        return f"Ошибка Шлюза: {str(e)}", "error", "none"
+
+
+async def _circuit_fallback(key: str = None):
+    """Цепь разомкнута: устаревший ответ из кэша, если есть, иначе понятное сообщение"""
+    if key:
+        stale = await response_cache.get(key, allow_stale=True)
+        if stale:
+            return stale[0], stale[1], "Cache (stale)"
+    return UNAVAILABLE_TEXT, "error", "circuit"
+
+
+async def _fetch(payload: dict, spec: model_routing.Route, cache_key_: str = None, cache_ttl: int = None,
+                 priority: str = PRIORITY_INTERACTIVE, on_queue=None):
+    """Один upstream-запрос к шлюзу; результат кладётся в кэш, если передан ключ"""
+    model = spec.model
     headers = {
         "Authorization": f"Bearer {AI_TOKEN}",
         "Content-Type": "application/json"
     }
     
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            url = GATEWAY_URL if "/chat/completions" in GATEWAY_URL else f"{GATEWAY_URL.rstrip('/')}/chat/completions"
-            
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            content = data['choices'][0]['message']['content']
-            model_info = data.get('model', model)
-            return content, model_info, "Gateway"
-            
+        await scheduler.acquire(priority, on_queue)
+    except QueueFull:
+        return OVERLOADED_TEXT, "error", "queue"
+    
+    prompt_chars = sum(len(m["content"]) for m in payload["messages"])
+    hedge = priority == PRIORITY_INTERACTIVE and prompt_chars <= HEDGE_MAX_CHARS
+    
+    started = time.perf_counter()
+    try:
+        response = await gateway.post_chat(payload, headers, read_timeout=spec.timeout, hedge=hedge)
+        response.raise_for_status()
+        data = response.json()
+        
+        content = data['choices'][0]['message']['content']
+        model_info = data.get('model', model)
+        elapsed = time.perf_counter() - started
+        AI_LATENCY.observe(elapsed, source="ask_brain", model=model)
+        model_routing.observe(spec, elapsed)
+        if cache_key_:
+            await response_cache.set(cache_key_, content, model_info, cache_ttl)
+        return content, model_info, "Gateway"
+    
+    except gateway.CircuitOpen:
+        return await _circuit_fallback(cache_key_)
     except httpx.HTTPStatusError as e:
         logger.error(f"Gateway HTTP {e.response.status_code}: {e.response.text}")
+        AI_ERRORS.inc(source="ask_brain", model=model, error=f"http_{e.response.status_code}")
         return f"Ошибка Шлюза: {e.response.status_code}", "error", "none"
     except Exception as e:
         logger.error(f"Gateway error: {e}")
+        AI_ERRORS.inc(source="ask_brain", model=model, error=type(e).__name__)
         return f"Ошибка Шлюза: {str(e)}", "error", "none"
+    finally:
+        scheduler.release()
+
+
+def queue_notifier(status_msg: Message):
+    """
+    Колбэк для on_queue: пока запрос ждёт слота, статус-сообщение
+    показывает позицию в очереди; после — возвращается исходный текст
+    (если стрим ещё не успел отредактировать чат)
+    """
+    original_text = status_msg.text
+    chat_id = status_msg.chat.id
+    shown = None
+    
+    async def notify(position: int):
+        nonlocal shown
+        if position and not await _throttle(chat_id):
+            return
+        if not position:
+            if shown is None:
+                return
+            await _throttle(chat_id, force=True)
+        state = _chat_edits(chat_id)
+        async with state.lock:
+            # Колбэк идёт фоновой задачей: после стрима старый текст не возвращаем
+            if not position and state.seq != shown:
+                return
+            state.seq += 1
+            shown = state.seq
+            text = f"⏳ Вы #{position} в очереди к AI..." if position else original_text
+            try:
+                await status_msg.edit_text(text)
+            except Exception:
+                pass
+    
+    return notify
 
 
 async def safe_reply(message: Message, header: str, content: str, model_info: str, reply_markup=None):
@@ -89,4 +214,278 @@ async def safe_reply(message: Message, header: str, content: str, model_info: st
                 html_chunk = chunk.replace("<", "&lt;").replace(">", "&gt;").replace("**", "<b>").replace("__", "<i>")
                 await message.answer(html_chunk, parse_mode=ParseMode.HTML, reply_markup=current_markup)
             except Exception:
-                await message.answer(chunk.replace("*", ""), reply_markup=current_markup)
+                await message.answer(chunk.replace("*", ""), parse_mode=None, reply_markup=current_markup)
+
+
+class BrainStream:
+    """
+    Потоковый вариант ask_brain (SSE, stream=true).
+    async for delta in BrainStream(...) — куски текста по мере генерации;
+    после окончания заполнены model_info и source (как в ask_brain)
+    """
+    
+    def __init__(self, sys_prompt: str, user_text: str, model: str = "auto",
+                 temperature: float = 0.7, cache: bool = True, cache_ttl: int = None,
+                 priority: str = PRIORITY_INTERACTIVE, on_queue=None, route: str = None):
+        self.sys_prompt = sys_prompt
+        self.user_text = user_text or ""
+        self.spec = model_routing.resolve(route, model)
+        self.model = self.spec.model
+        self.temperature = temperature
+        self.use_cache = cache and AI_CACHE_ENABLED
+        self.cache_ttl = cache_ttl
+        self.priority = priority
+        self.on_queue = on_queue
+        self.model_info = self.model
+        self.source = "Gateway"
+        self.first_token_sec = None
+    
+    async def __aiter__(self):
+        if not AI_TOKEN:
+            logger.error("AI_TOKEN missing")
+            self.model_info, self.source = "error", "none"
+            yield "Ошибка: AI_TOKEN не настроен"
+            return
+        
+        try:
+            key = cache_key(self.sys_prompt, self.user_text, self.model, self.temperature,
+                            self.spec.max_tokens)
+            cached = await response_cache.get(key) if self.use_cache else None
+        except Exception as e:
+            logger.error(f"AI cache error: {e}")
+            self.model_info, self.source = "error", "none"
+            yield f"Ошибка Шлюза: {str(e)}"
+            return
+        if cached:
+            self.model_info, self.source = cached[1], "Cache"
+            yield cached[0]
+            return
+        
+        if gateway.breaker.is_open:
+            content, self.model_info, self.source = await _circuit_fallback(key if self.use_cache else None)
+            yield content
+            return
+        
+        # Такой же запрос уже идёт — ждём его целиком, а не стримим второй раз
+        running = _flight.running(key)
+        if running is not None:
+            try:
+                content, self.model_info, self.source = await _flight.join(running)
+            except Exception as e:
+                content, self.model_info, self.source = f"Ошибка Шлюза: {str(e)}", "error", "none"
+            yield content
+            return
+        flight = _flight.begin(key)
+        
+        try:
+            await scheduler.acquire(self.priority, self.on_queue)
+        except QueueFull:
+            self.model_info, self.source = "error", "queue"
+            _flight.finish(flight, (OVERLOADED_TEXT, "error", "queue"))
+            yield OVERLOADED_TEXT
+            return
+        
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.sys_prompt},
+                {"role": "user", "content": self.user_text}
+            ],
+            "temperature": self.temperature,
+            "stream": True
+        }
+        if self.spec.max_tokens:
+            payload["max_tokens"] = self.spec.max_tokens
+        headers = {
+            "Authorization": f"Bearer {AI_TOKEN}",
+            "Content-Type": "application/json"
+        }
+        
+        started = time.perf_counter()
+        parts = []
+        try:
+            async with gateway.stream_chat(payload, headers, read_timeout=self.spec.timeout) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    chunk = line[5:].strip()
+                    if chunk == "[DONE]":
+                        break
+                    data = json.loads(chunk)
+                    self.model_info = data.get("model", self.model_info)
+                    choices = data.get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        if self.first_token_sec is None:
+                            self.first_token_sec = time.perf_counter() - started
+                            AI_FIRST_TOKEN.observe(self.first_token_sec, source="ask_brain_stream", model=self.model)
+                        parts.append(delta)
+                        yield delta
+            elapsed = time.perf_counter() - started
+            AI_LATENCY.observe(elapsed, source="ask_brain_stream", model=self.model)
+            model_routing.observe(self.spec, elapsed)
+            if self.use_cache and parts:
+                await response_cache.set(key, "".join(parts), self.model_info, self.cache_ttl)
+            _flight.finish(flight, ("".join(parts), self.model_info, self.source))
+        
+        except gateway.CircuitOpen:
+            content, self.model_info, self.source = await _circuit_fallback(key if self.use_cache else None)
+            _flight.finish(flight, (content, self.model_info, self.source))
+            yield content
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Gateway HTTP {e.response.status_code} (stream)")
+            AI_ERRORS.inc(source="ask_brain_stream", model=self.model, error=f"http_{e.response.status_code}")
+            self.model_info, self.source = "error", "none"
+            _flight.finish(flight, (f"Ошибка Шлюза: {e.response.status_code}", "error", "none"))
+            yield f"Ошибка Шлюза: {e.response.status_code}"
+        except Exception as e:
+            logger.error(f"Gateway stream error: {e}")
+            AI_ERRORS.inc(source="ask_brain_stream", model=self.model, error=type(e).__name__)
+            self.model_info, self.source = "error", "none"
+            _flight.finish(flight, (f"Ошибка Шлюза: {str(e)}", "error", "none"))
+            yield f"Ошибка Шлюза: {str(e)}"
+        finally:
+            scheduler.release()
+            # Стрим прервали (отмена апдейта) — ожидающие не должны висеть
+            _flight.finish(flight, error=RuntimeError("stream aborted"))
+
+
+class _ChatEdits:
+    """Состояние edit в чате: слот троттлинга, замок и счётчик правок"""
+    __slots__ = ('last', 'lock', 'seq')
+    
+    def __init__(self):
+        self.last = 0.0
+        self.lock = asyncio.Lock()
+        self.seq = 0
+
+
+# chat_id → _ChatEdits (общий лимит на чат для всех стримов), LRU
+_chats = OrderedDict()
+
+
+def _chat_edits(chat_id: int) -> _ChatEdits:
+    state = _chats.get(chat_id)
+    if state is None:
+        state = _chats[chat_id] = _ChatEdits()
+        while len(_chats) > STREAM_EDIT_CHATS:
+            _chats.popitem(last=False)
+    else:
+        _chats.move_to_end(chat_id)
+    return state
+
+
+async def _throttle(chat_id: int, force: bool = False) -> bool:
+    """True — можно редактировать сейчас. force — дождаться слота"""
+    state = _chat_edits(chat_id)
+    wait = state.last + STREAM_EDIT_INTERVAL - time.monotonic()
+    if wait > 0:
+        if not force:
+            return False
+        await asyncio.sleep(wait)
+    state.last = time.monotonic()
+    return True
+
+
+async def _edit(msg: Message, text: str, final: bool = False, reply_markup=None):
+    """Edit с тем же fallback-парсингом, что и в safe_reply; правки одного чата идут по очереди"""
+    state = _chat_edits(msg.chat.id)
+    async with state.lock:
+        state.seq += 1
+        while True:
+            try:
+                await _edit_once(msg, text, final, reply_markup)
+                return
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать — сдвигаем слот чата
+                state.last = time.monotonic() + e.retry_after
+                if not final:
+                    return
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                # "message is not modified" и т.п. — не критично
+                logger.debug(f"Stream edit skipped: {e}")
+                return
+
+
+async def edit_throttled(msg: Message, text: str, force: bool = False, **kwargs) -> bool:
+    """
+    edit_text под общим лимитом чата (STREAM_EDIT_INTERVAL) и в очереди с правками стрима.
+    force=False — пропустить, если слот занят (промежуточные статусы); True — дождаться слота
+    """
+    if not await _throttle(msg.chat.id, force=force):
+        return False
+    state = _chat_edits(msg.chat.id)
+    async with state.lock:
+        state.seq += 1
+        while True:
+            try:
+                await msg.edit_text(text, **kwargs)
+            except TelegramRetryAfter as e:
+                state.last = time.monotonic() + e.retry_after
+                if not force:
+                    return False
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                logger.debug(f"Edit skipped: {e}")
+            return True
+
+
+async def _edit_once(msg: Message, text: str, final: bool, reply_markup):
+    if not final:
+        # Промежуточные версии — без разметки (Markdown может быть незакрыт);
+        # parse_mode=None явно, иначе действует HTML по умолчанию у бота и «<» в ответе ломает edit
+        await msg.edit_text(text, parse_mode=None)
+        return
+    try:
+        await msg.edit_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+    except TelegramRetryAfter:
+        raise
+    except Exception:
+        try:
+            html_text = text.replace("<", "&lt;").replace(">", "&gt;").replace("**", "<b>").replace("__", "<i>")
+            await msg.edit_text(html_text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+        except TelegramRetryAfter:
+            raise
+        except Exception:
+            await msg.edit_text(text.replace("*", ""), parse_mode=None, reply_markup=reply_markup)
+
+
+async def stream_reply(message: Message, header: str, stream: BrainStream, status_msg: Message = None, reply_markup=None):
+    """
+    Компаньон safe_reply для стриминга: редактирует статус-сообщение по мере
+    генерации (с троттлингом), при переполнении 4096 продолжает в новом.
+    Возвращает полный текст ответа.
+    """
+    chat_id = message.chat.id
+    current = status_msg or await message.answer(header)
+    prefix = f"{header}\n\n"
+    # Запас под футер с моделью
+    limit = TELEGRAM_LIMIT - 100
+    
+    full_text = ""
+    page = ""
+    async for delta in stream:
+        full_text += delta
+        page += delta.replace("<br>", "\n").replace("<br/>", "\n")
+        
+        # Переполнение: фиксируем текущее сообщение, продолжаем в новом
+        while len(prefix) + len(page) > limit:
+            cut_index = page.rfind("\n", 0, limit - len(prefix))
+            if cut_index <= 0:
+                cut_index = limit - len(prefix)
+            await _throttle(chat_id, force=True)
+            await _edit(current, prefix + page[:cut_index], final=True)
+            page = page[cut_index:].lstrip("\n")
+            prefix = ""
+            current = await message.answer("…")
+        
+        if await _throttle(chat_id):
+            await _edit(current, prefix + page + " ▌")
+    
+    footer = f"\n\n⚙️ _{stream.model_info} | {stream.source}_"
+    await _throttle(chat_id, force=True)
+    await _edit(current, prefix + page + footer, final=True, reply_markup=reply_markup)
+    return full_text
@@ -0,0 +1,238 @@
+"""
+Планировщик допуска запросов к AI Gateway
+
+- глобальный лимит одновременных запросов (AI_MAX_CONCURRENCY)
+- классы приоритета: interactive (короткие ответы) впереди batch (документы, консилиум)
+- внутри класса — честная очередь в два уровня: по кругу между ботами, а внутри
+  бота — по кругу между пользователями. Бот с сотней активных пользователей
+  не вытесняет остальных ботов, пачка документов одного человека — остальных людей
+- ограниченная очередь (AI_MAX_QUEUE): при переполнении сразу отказ
+- позиция в очереди сообщается через колбэк, чтобы показать "вы #3 в очереди"
+
+Кто делает запрос, берётся из contextvar, который ставит RequestContextMiddleware.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from utils.metrics import SCHED_ACTIVE, SCHED_QUEUED, SCHED_REJECTED, SCHED_WAIT
+
+logger = logging.getLogger(__name__)
+
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', 8))
+AI_MAX_QUEUE = int(os.getenv('AI_MAX_QUEUE', 100))
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+_PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+# (bot, user_id) текущего апдейта
+request_flow = contextvars.ContextVar('request_flow', default=('system', 0))
+
+
+class QueueFull(Exception):
+    """Очередь к шлюзу переполнена — быстрый отказ"""
+
+
+class _Waiter:
+    __slots__ = ('future', 'flow', 'priority', 'on_position', 'position', 'queued_at')
+
+    def __init__(self, flow, priority, on_position):
+        self.future = asyncio.get_running_loop().create_future()
+        self.flow = flow
+        self.priority = priority
+        self.on_position = on_position
+        self.position = None
+        self.queued_at = time.monotonic()
+
+
+class AdmissionScheduler:
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY, max_queue: int = AI_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        # priority → OrderedDict(bot → OrderedDict(flow → deque[_Waiter]));
+        # порядок ключей на обоих уровнях = порядок обхода по кругу
+        self._queues = {p: OrderedDict() for p in _PRIORITIES}
+        self.rejected = 0
+
+    @staticmethod
+    def _bot_of(flow) -> str:
+        return flow[0] if isinstance(flow, tuple) else flow
+
+    def _waiting_in(self, priority: str) -> int:
+        return sum(len(d) for flows in self._queues[priority].values() for d in flows.values())
+
+    @property
+    def waiting(self) -> int:
+        return sum(self._waiting_in(p) for p in _PRIORITIES)
+
+    @asynccontextmanager
+    async def slot(self, priority: str = PRIORITY_INTERACTIVE, on_position=None, flow=None):
+        """async with scheduler.slot(...): <запрос к шлюзу>"""
+        await self.acquire(priority, on_position, flow)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: str = PRIORITY_INTERACTIVE, on_position=None, flow=None):
+        priority = priority if priority in self._queues else PRIORITY_INTERACTIVE
+        flow = flow or request_flow.get()
+
+        if self.active < self.max_concurrency and not self.waiting:
+            self.active += 1
+            SCHED_ACTIVE.set(self.active)
+            SCHED_WAIT.observe(0, priority=priority)
+            return
+
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            SCHED_REJECTED.inc(priority=priority)
+            raise QueueFull(f"AI queue is full ({self.max_queue})")
+
+        waiter = _Waiter(flow, priority, on_position)
+        bots = self._queues[priority]
+        bots.setdefault(self._bot_of(flow), OrderedDict()).setdefault(flow, deque()).append(waiter)
+        self._publish_positions()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот уже выдан, но нас отменили — возвращаем его
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+        SCHED_WAIT.observe(time.monotonic() - waiter.queued_at, priority=priority)
+
+    def release(self):
+        self.active -= 1
+        # Передаём освободившийся слот следующему по приоритету и кругу
+        while self.active < self.max_concurrency:
+            waiter = self._pop_next()
+            if waiter is None:
+                break
+            if waiter.future.done():
+                continue
+            self.active += 1
+            waiter.future.set_result(None)
+            if waiter.position:
+                # 0 — очередь пройдена, можно вернуть статус
+                self._notify(waiter, 0)
+        SCHED_ACTIVE.set(self.active)
+        self._publish_positions()
+
+    def _pop_next(self):
+        for priority in _PRIORITIES:
+            bots = self._queues[priority]
+            if not bots:
+                continue
+            bot, flows = next(iter(bots.items()))
+            flow, waiters = next(iter(flows.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                flows.move_to_end(flow)
+            else:
+                del flows[flow]
+            if flows:
+                bots.move_to_end(bot)
+            else:
+                del bots[bot]
+            return waiter
+        return None
+
+    def _remove(self, waiter: _Waiter):
+        bots = self._queues[waiter.priority]
+        bot = self._bot_of(waiter.flow)
+        flows = bots.get(bot, {})
+        waiters = flows.get(waiter.flow)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del flows[waiter.flow]
+            if not flows:
+                del bots[bot]
+        self._publish_positions()
+
+    @staticmethod
+    def _service_order(bots) -> list:
+        """Ожидающие класса в том порядке, в каком их обслужит _pop_next"""
+        bots = deque(deque(deque(d) for d in flows.values()) for flows in bots.values())
+        order = []
+        while bots:
+            flows = bots.popleft()
+            waiters = flows.popleft()
+            order.append(waiters.popleft())
+            if waiters:
+                flows.append(waiters)
+            if flows:
+                bots.append(flows)
+        return order
+
+    def _publish_positions(self):
+        """
+        Позиция ожидающего: все ожидающие более высокого приоритета
+        + те, кого обслужат раньше в своём классе при обходе по кругу
+        """
+        SCHED_QUEUED.set(self.waiting)
+        ahead_higher = 0
+        for priority in _PRIORITIES:
+            order = self._service_order(self._queues[priority])
+            for index, waiter in enumerate(order):
+                position = ahead_higher + index + 1
+                if position != waiter.position:
+                    waiter.position = position
+                    self._notify(waiter, position)
+            ahead_higher += len(order)
+
+    @staticmethod
+    def _notify(waiter: _Waiter, position: int):
+        if waiter.on_position is None:
+            return
+        try:
+            result = waiter.on_position(position)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+        except Exception as e:
+            logger.debug(f"Queue position callback failed: {e}")
+
+    def position_of(self, flow) -> int:
+        """Лучшая позиция среди запросов данного потока (0 — не в очереди)"""
+        flows = [bots.get(self._bot_of(flow), {}) for bots in self._queues.values()]
+        positions = [w.position for f in flows for w in f.get(flow, ()) if w.position]
+        return min(positions) if positions else 0
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'max_concurrency': self.max_concurrency,
+            'waiting': {p: self._waiting_in(p) for p in _PRIORITIES},
+            'waiting_bots': {p: {bot: sum(len(d) for d in flows.values()) for bot, flows in bots.items()}
+                             for p, bots in self._queues.items()},
+            'max_queue': self.max_queue,
+            'rejected': self.rejected,
+        }
+
+
+scheduler = AdmissionScheduler()
+
+
+class RequestContextMiddleware:
+    """Outer-middleware на dp.update: кладёт (бот, пользователь) в contextvar"""
+
+    def __init__(self, bot_name: str):
+        self.bot_name = bot_name
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        token = request_flow.set((self.bot_name, user.id if user else 0))
+        try:
+            return await handler(event, data)
+        finally:
+            request_flow.reset(token)
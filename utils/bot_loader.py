@@ -0,0 +1,152 @@
+"""
+Загрузка handlers-модулей ботов: сразу (eager) или по первому апдейту (lazy)
+
+В lazy-режиме Dispatcher и webhook создаются на старте, а тяжёлый модуль
+(speech_recognition, pydub, gspread, docx...) импортируется при первом апдейте
+или фоновым прогревом. Для каждого бота пишем время импорта, а в eager-режиме
+и прирост памяти: lazy-импорт идёт в потоке, пока другие боты работают,
+и разница RSS там ничего не говорит о самом модуле.
+
+Неудачный lazy-импорт повторяется не чаще раза в HANDLERS_RETRY сек
+(с удвоением до HANDLERS_RETRY_MAX); апдейты, пришедшие до успешной
+загрузки, отбрасываются с записью в лог и метрику.
+"""
+import asyncio
+import logging
+import os
+import resource
+import time
+from importlib import import_module
+
+from aiogram import Dispatcher
+
+from utils.metrics import HANDLERS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+HANDLERS_RETRY = float(os.getenv('HANDLERS_RETRY', 10))
+HANDLERS_RETRY_MAX = float(os.getenv('HANDLERS_RETRY_MAX', 300))
+
+
+def rss_mb() -> float:
+    """Текущая резидентная память процесса (MB)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except Exception:
+        # Не Linux — берём пиковое значение (в KB на Linux, в байтах на macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class HandlersLoader:
+    """Импортирует router бота и подключает его к Dispatcher"""
+
+    def __init__(self, name: str, module_path: str, dispatcher: Dispatcher, lazy: bool = False):
+        self.name = name
+        self.module_path = module_path
+        self.dispatcher = dispatcher
+        self.lazy = lazy
+
+        self.loaded = False
+        self.error = None
+        self.import_sec = None
+        self.rss_delta_mb = None
+        self.failures = 0
+        self.dropped = 0
+        self._failed_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _import(self, measure_rss: bool = False):
+        rss_before = rss_mb() if measure_rss else None
+        started = time.perf_counter()
+        module = import_module(self.module_path)
+        self.import_sec = time.perf_counter() - started
+        if measure_rss:
+            self.rss_delta_mb = rss_mb() - rss_before
+        return getattr(module, 'router')
+
+    def _retry_due(self) -> bool:
+        if not self.error:
+            return True
+        delay = min(HANDLERS_RETRY * 2 ** (self.failures - 1), HANDLERS_RETRY_MAX)
+        return time.monotonic() - self._failed_at >= delay
+
+    def load(self) -> bool:
+        """Синхронная загрузка (eager-режим, на старте)"""
+        try:
+            self.dispatcher.include_router(self._import(measure_rss=True))
+            self.loaded = True
+            logger.info(f"✅ {self.name}: handlers loaded ({self.import_sec:.2f}s, +{self.rss_delta_mb:.1f} MB)")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"❌ {self.name}: handlers error - {e}")
+        return self.loaded
+
+    async def ensure_loaded(self) -> bool:
+        """Асинхронная загрузка: импорт в потоке, чтобы не блокировать остальных ботов"""
+        if self.loaded or not self._retry_due():
+            return self.loaded
+
+        async with self._lock:
+            if self.loaded or not self._retry_due():
+                return self.loaded
+            try:
+                router = await asyncio.to_thread(self._import)
+                self.dispatcher.include_router(router)
+                self.loaded = True
+                self.error = None
+                logger.info(f"✅ {self.name}: handlers lazy-loaded ({self.import_sec:.2f}s)")
+            except Exception as e:
+                self.error = str(e)
+                self.failures += 1
+                self._failed_at = time.monotonic()
+                logger.error(f"❌ {self.name}: handlers error (attempt {self.failures}) - {e}")
+                return False
+        await self.emit_startup()
+        return self.loaded
+
+    async def emit_startup(self):
+        """router.startup-хуки бота; ошибка хука не мешает остальным ботам"""
+        try:
+            await self.dispatcher.emit_startup(bot_name=self.name)
+        except Exception as e:
+            logger.error(f"❌ {self.name}: startup hook error - {e}")
+
+    async def emit_shutdown(self):
+        try:
+            await self.dispatcher.emit_shutdown(bot_name=self.name)
+        except Exception as e:
+            logger.error(f"❌ {self.name}: shutdown hook error - {e}")
+
+    async def __call__(self, handler, event, data):
+        """Outer-middleware на update: подгружает router перед первым апдейтом"""
+        if not self.loaded and not await self.ensure_loaded():
+            self.dropped += 1
+            HANDLERS_DROPPED.inc(bot=self.name)
+            logger.warning(f"⚠️ {self.name}: update dropped, handlers not loaded ({self.error})")
+            return None
+        return await handler(event, data)
+
+    def report(self) -> dict:
+        return {
+            'mode': 'lazy' if self.lazy else 'eager',
+            'loaded': self.loaded,
+            'import_sec': round(self.import_sec, 3) if self.import_sec is not None else None,
+            'rss_delta_mb': round(self.rss_delta_mb, 1) if self.rss_delta_mb is not None else None,
+            'error': self.error,
+            'failures': self.failures,
+            'dropped': self.dropped,
+        }
+
+
+async def warmup(loaders: list, delay: float = 0.0):
+    """Фоновый прогрев lazy-ботов по одному, чтобы не забивать CPU на старте"""
+    for loader in loaders:
+        if delay:
+            await asyncio.sleep(delay)
+        await loader.ensure_loaded()
+
+    loaded = [l for l in loaders if l.loaded]
+    total = sum(l.import_sec or 0 for l in loaded)
+    logger.info(f"🔥 Warm-up done: {len(loaded)}/{len(loaders)} bot(s), {total:.2f}s import, RSS {rss_mb():.1f} MB")
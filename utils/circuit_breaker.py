@@ -0,0 +1,126 @@
+"""
+Circuit breaker для AI Gateway
+
+closed    — запросы идут как обычно, считаем ошибки в скользящем окне
+open      — шлюз считается лежащим: запросы отбиваются за миллисекунды
+half_open — после паузы пропускаем пробные запросы; успех закрывает цепь,
+            ошибка снова открывает
+"""
+import logging
+import os
+import time
+from collections import deque
+
+from utils.metrics import BREAKER_REJECTED, BREAKER_STATE
+
+logger = logging.getLogger(__name__)
+
+BREAKER_WINDOW = float(os.getenv('BREAKER_WINDOW', 30))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 10))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+# Открываемся и без статистики, если ошибки идут подряд (мало трафика)
+BREAKER_CONSECUTIVE = int(os.getenv('BREAKER_CONSECUTIVE', 5))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', 30))
+BREAKER_PROBES = int(os.getenv('BREAKER_PROBES', 1))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+_STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Цепь разомкнута — шлюз не вызываем"""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.probes_in_flight = 0
+        self.rejected = 0
+        self.last_error = None
+        self._calls = deque()  # (timestamp, ok)
+        BREAKER_STATE.set(0, breaker=name)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"⚡ Breaker {self.name}: {self.state} → {state}")
+            self.state = state
+            BREAKER_STATE.set(_STATE_CODES[state], breaker=self.name)
+
+    def _refresh(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+            self._set_state(HALF_OPEN)
+            self.probes_in_flight = 0
+
+    @property
+    def is_open(self) -> bool:
+        """Быстрая проверка без расходования пробного запроса"""
+        self._refresh()
+        return self.state == OPEN or (self.state == HALF_OPEN and self.probes_in_flight >= BREAKER_PROBES)
+
+    def allow(self):
+        """Перед вызовом шлюза: CircuitOpen, если звать нельзя"""
+        self._refresh()
+        if self.state == CLOSED:
+            return
+        if self.state == HALF_OPEN and self.probes_in_flight < BREAKER_PROBES:
+            self.probes_in_flight += 1
+            return
+        self.rejected += 1
+        BREAKER_REJECTED.inc(breaker=self.name)
+        raise CircuitOpen(f"{self.name} circuit is open")
+
+    def cancelled(self):
+        """Вызов отменён без результата — освобождаем место пробного запроса"""
+        if self.state == HALF_OPEN and self.probes_in_flight:
+            self.probes_in_flight -= 1
+
+    def _window(self, ok: bool):
+        now = time.monotonic()
+        self._calls.append((now, ok))
+        while self._calls and now - self._calls[0][0] > BREAKER_WINDOW:
+            self._calls.popleft()
+
+    def record_success(self):
+        self._window(True)
+        self.consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self._calls.clear()
+            self._set_state(CLOSED)
+
+    def record_failure(self, error: str = None):
+        self._window(False)
+        self.consecutive_failures += 1
+        self.last_error = error
+
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+
+        failures = sum(1 for _, ok in self._calls if not ok)
+        rate_tripped = len(self._calls) >= BREAKER_MIN_CALLS and failures / len(self._calls) >= BREAKER_FAILURE_RATE
+        if self.state == CLOSED and (rate_tripped or self.consecutive_failures >= BREAKER_CONSECUTIVE):
+            self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self.probes_in_flight = 0
+        self._set_state(OPEN)
+
+    def stats(self) -> dict:
+        self._refresh()
+        failures = sum(1 for _, ok in self._calls if not ok)
+        return {
+            'state': self.state,
+            'window_calls': len(self._calls),
+            'window_failures': failures,
+            'consecutive_failures': self.consecutive_failures,
+            'rejected': self.rejected,
+            'retry_in_sec': round(max(0.0, BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at)), 1)
+            if self.state == OPEN else 0,
+            'last_error': self.last_error,
+        }
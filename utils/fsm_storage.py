@@ -0,0 +1,322 @@
+"""
+FSM-хранилище для всех ботов: LRU-кэш в процессе + постоянный backend
+
+Чтения обслуживаются из кэша, записи копятся (write-back) и раз в
+FSM_FLUSH_INTERVAL сек уходят в Mongo или SQLite одной пачкой.
+У каждого состояния свой TTL: брошенные анкеты удаляются сами.
+
+FSM_STORAGE=memory — только кэш (ограниченный, с TTL), без диска
+FSM_STORAGE=mongo  — Motor-клиент из database.py
+FSM_STORAGE=sqlite — локальный файл FSM_SQLITE_PATH
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory').lower()
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))
+FSM_TTL = int(os.getenv('FSM_TTL', 24 * 3600))
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', 2.0))
+FSM_MONGO_DB = os.getenv('FSM_MONGO_DB', 'bots_fsm')
+FSM_SQLITE_PATH = os.getenv('FSM_SQLITE_PATH', 'fsm_states.sqlite3')
+# TTL по группам/состояниям: {"Report": 7200, "BrandAnalysis:waiting_for_rtb": 3600}
+FSM_STATE_TTLS = json.loads(os.getenv('FSM_STATE_TTLS', '{}'))
+
+
+def storage_key_id(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:" \
+           f"{key.business_connection_id or ''}:{key.destiny}"
+
+
+class Record:
+    __slots__ = ('state', 'data', 'expires_at', 'dirty')
+
+    def __init__(self, state=None, data=None, expires_at=0.0, dirty=False):
+        self.state = state
+        self.data = data or {}
+        self.expires_at = expires_at
+        self.dirty = dirty
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+# --- BACKENDS ---
+
+class MongoBackend:
+    """Коллекция fsm_states; просроченные записи чистит TTL-индекс Mongo"""
+
+    def __init__(self, db_name: str = FSM_MONGO_DB):
+        self.db_name = db_name
+        self._collection = None
+
+    async def _get_collection(self):
+        if self._collection is None:
+            from database import db
+            await db.connect()
+            if db.mongo_client is None:
+                return None
+            self._collection = db.mongo_client[self.db_name].fsm_states
+            await self._collection.create_index('expires_at', expireAfterSeconds=0)
+        return self._collection
+
+    async def load(self, key_id: str) -> Optional[Record]:
+        collection = await self._get_collection()
+        if collection is None:
+            return None
+        doc = await collection.find_one({'_id': key_id})
+        if not doc:
+            return None
+        expires_at = doc['expires_at'].replace(tzinfo=timezone.utc).timestamp()
+        return Record(doc.get('state'), doc.get('data'), expires_at)
+
+    async def save(self, records: Dict[str, Record]):
+        collection = await self._get_collection()
+        if collection is None or not records:
+            return
+        from pymongo import DeleteOne, UpdateOne
+
+        ops = []
+        for key_id, rec in records.items():
+            if rec.empty:
+                ops.append(DeleteOne({'_id': key_id}))
+            else:
+                ops.append(UpdateOne({'_id': key_id}, {'$set': {
+                    'state': rec.state,
+                    'data': rec.data,
+                    'expires_at': datetime.fromtimestamp(rec.expires_at, tz=timezone.utc),
+                }}, upsert=True))
+        await collection.bulk_write(ops, ordered=False)
+
+    async def purge_expired(self, now: float):
+        # Удаление делает TTL-индекс
+        return
+
+
+class SQLiteBackend(SQLiteStore):
+    """Локальный SQLite-файл; запросы выполняются в потоке"""
+
+    def __init__(self, path: str = FSM_SQLITE_PATH):
+        super().__init__(
+            path,
+            'CREATE TABLE IF NOT EXISTS fsm_states ('
+            'key TEXT PRIMARY KEY, state TEXT, data TEXT, expires_at REAL);'
+            'CREATE INDEX IF NOT EXISTS fsm_expires ON fsm_states (expires_at);'
+        )
+
+    def _load(self, key_id):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT state, data, expires_at FROM fsm_states WHERE key = ?', (key_id,)
+            ).fetchone()
+
+    def _save(self, records):
+        with self._lock:
+            for key_id, rec in records.items():
+                if rec.empty:
+                    self._conn.execute('DELETE FROM fsm_states WHERE key = ?', (key_id,))
+                else:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO fsm_states VALUES (?, ?, ?, ?)',
+                        (key_id, rec.state, json.dumps(rec.data, ensure_ascii=False), rec.expires_at)
+                    )
+            self._conn.commit()
+
+    def _purge(self, now):
+        with self._lock:
+            self._conn.execute('DELETE FROM fsm_states WHERE expires_at < ?', (now,))
+            self._conn.commit()
+
+    async def load(self, key_id: str) -> Optional[Record]:
+        row = await self.run_in_thread(self._load, key_id)
+        if row is None:
+            return None
+        return Record(row[0], json.loads(row[1] or '{}'), row[2])
+
+    async def save(self, records: Dict[str, Record]):
+        if records:
+            await self.run_in_thread(self._save, records)
+
+    async def purge_expired(self, now: float):
+        await self.run_in_thread(self._purge, now)
+
+
+# --- STORAGE ---
+
+class CachedStorage(BaseStorage):
+    """aiogram-хранилище: LRU write-back кэш поверх backend (или без него)"""
+
+    def __init__(self, backend=None, max_entries: int = FSM_CACHE_SIZE, default_ttl: int = FSM_TTL,
+                 state_ttls: Optional[Dict[str, int]] = None, flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.state_ttls = state_ttls if state_ttls is not None else FSM_STATE_TTLS
+        self.flush_interval = flush_interval
+
+        self._cache: 'OrderedDict[str, Record]' = OrderedDict()
+        self._pending: Dict[str, Record] = {}  # грязные записи, вытесненные из кэша
+        self._flush_task = None
+        self._last_purge = time.time()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def ttl_for(self, state: Optional[str]) -> int:
+        """TTL по точному имени состояния, затем по группе (Report:comment → Report)"""
+        if state:
+            if state in self.state_ttls:
+                return self.state_ttls[state]
+            group = state.split(':', 1)[0]
+            if group in self.state_ttls:
+                return self.state_ttls[group]
+        return self.default_ttl
+
+    async def _get_record(self, key: StorageKey) -> Record:
+        key_id = storage_key_id(key)
+        now = time.time()
+
+        rec = self._cache.get(key_id)
+        if rec is not None:
+            self._cache.move_to_end(key_id)
+            self.hits += 1
+        else:
+            self.misses += 1
+            rec = self._pending.pop(key_id, None)
+            if rec is None and self.backend is not None:
+                try:
+                    rec = await self.backend.load(key_id)
+                except Exception as e:
+                    logger.error(f"⚠️ FSM load error: {e}")
+                # Пока ждали backend, тот же ключ мог загрузить и изменить
+                # параллельный апдейт — берём его запись, иначе его set_state потеряется
+                cached = self._cache.get(key_id)
+                if cached is not None:
+                    rec = cached
+            if rec is None:
+                rec = Record()
+            self._put(key_id, rec)
+
+        if not rec.empty and rec.expires_at < now:
+            # Брошенный сценарий — начинаем с чистого листа
+            self.expired += 1
+            rec.state, rec.data, rec.dirty = None, {}, True
+        return rec
+
+    def _put(self, key_id: str, rec: Record):
+        self._cache[key_id] = rec
+        self._cache.move_to_end(key_id)
+        while len(self._cache) > self.max_entries:
+            old_id, old = self._cache.popitem(last=False)
+            if old.dirty:
+                self._pending[old_id] = old
+
+    def _touch(self, rec: Record):
+        rec.expires_at = time.time() + self.ttl_for(rec.state)
+        rec.dirty = True
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Сбрасывает грязные записи в backend и выкидывает просроченные из кэша"""
+        now = time.time()
+        batch = dict(self._pending)
+        self._pending.clear()
+        for key_id, rec in list(self._cache.items()):
+            if not rec.empty and rec.expires_at < now:
+                rec.state, rec.data, rec.dirty = None, {}, True
+            if rec.dirty:
+                batch[key_id] = rec
+                rec.dirty = False
+            if rec.empty:
+                del self._cache[key_id]
+
+        if self.backend is None:
+            return
+        try:
+            await self.backend.save(batch)
+            if now - self._last_purge > 3600:
+                self._last_purge = now
+                await self.backend.purge_expired(now)
+        except Exception as e:
+            logger.error(f"⚠️ FSM flush error ({len(batch)} records): {e}")
+            # Вернём в очередь, попробуем в следующий раз
+            for key_id, rec in batch.items():
+                if key_id not in self._cache:
+                    self._pending.setdefault(key_id, rec)
+                else:
+                    self._cache[key_id].dirty = True
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        rec = await self._get_record(key)
+        rec.state = state.state if isinstance(state, State) else state
+        self._touch(rec)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        rec = await self._get_record(key)
+        rec.data = dict(data)
+        self._touch(rec)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._get_record(key)).data)
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        if hasattr(self.backend, 'close'):
+            self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            'backend': type(self.backend).__name__ if self.backend else 'memory',
+            'cached': len(self._cache),
+            'pending': len(self._pending),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+        }
+
+
+def build_fsm_storage() -> CachedStorage:
+    """Хранилище по FSM_STORAGE (одно на все боты: ключ содержит bot_id)"""
+    if FSM_STORAGE == 'mongo':
+        backend = MongoBackend()
+    elif FSM_STORAGE == 'sqlite':
+        backend = SQLiteBackend()
+    else:
+        backend = None
+    logger.info(f"💾 FSM storage: {FSM_STORAGE} (cache {FSM_CACHE_SIZE}, ttl {FSM_TTL}s)")
+    if backend is None:
+        logger.warning("⚠️ FSM_STORAGE=memory: незаконченные сценарии не переживут рестарт, "
+                       "для продакшена задайте FSM_STORAGE=mongo или sqlite")
+    return CachedStorage(backend)
@@ -0,0 +1,335 @@
+"""
+Общий HTTP-клиент к AI Gateway
+
+Один долгоживущий httpx.AsyncClient на процесс: пул соединений, keep-alive,
+опционально HTTP/2. Создаётся в on_startup, закрывается в on_shutdown.
+Время установки соединения (TCP/TLS) пишется в метрики — видно, сколько
+запросов переиспользуют соединение.
+
+Шлюзов может быть несколько (GATEWAY_URLS через запятую, OpenAI-совместимые).
+Для каждого считаем EWMA латентности и долю ошибок, запрос уходит на самый
+быстрый живой. Короткие интерактивные запросы можно хеджировать: если ответа
+нет дольше p95, шлём дубль на следующий шлюз и берём первый ответ.
+
+Поверх всего — circuit breaker: если шлюзы массово падают, вызовы сразу
+получают CircuitOpen вместо ожидания таймаута.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpen  # noqa: F401
+from utils.metrics import GATEWAY_CONNECT, GATEWAY_CONNECTIONS, GATEWAY_ENDPOINT_LATENCY, GATEWAY_HEDGED
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_MAX_CONNECTIONS = int(os.getenv('GATEWAY_MAX_CONNECTIONS', 20))
+GATEWAY_MAX_KEEPALIVE = int(os.getenv('GATEWAY_MAX_KEEPALIVE', 10))
+GATEWAY_KEEPALIVE_EXPIRY = float(os.getenv('GATEWAY_KEEPALIVE_EXPIRY', 60))
+GATEWAY_HTTP2 = os.getenv('GATEWAY_HTTP2', 'false').lower() == 'true'
+GATEWAY_CONNECT_TIMEOUT = float(os.getenv('GATEWAY_CONNECT_TIMEOUT', 5))
+GATEWAY_READ_TIMEOUT = float(os.getenv('GATEWAY_READ_TIMEOUT', 60))
+
+GATEWAY_URLS = [
+    u.strip() for u in os.getenv(
+        'GATEWAY_URLS', os.getenv('GATEWAY_BASE_URL', 'http://172.86.90.213:3000/v1')
+    ).split(',') if u.strip()
+]
+# Хеджирование: задержка дубля = p95 шлюза, но не меньше минимума
+GATEWAY_HEDGE = os.getenv('GATEWAY_HEDGE', 'false').lower() == 'true'
+GATEWAY_HEDGE_MIN_DELAY = float(os.getenv('GATEWAY_HEDGE_MIN_DELAY', 1.0))
+GATEWAY_HEDGE_DEFAULT_DELAY = float(os.getenv('GATEWAY_HEDGE_DEFAULT_DELAY', 5.0))
+EWMA_ALPHA = 0.2
+# Шлюз выводится из ротации после N ошибок подряд
+ENDPOINT_MAX_FAILURES = 3
+ENDPOINT_COOLDOWN = 30.0
+
+_client = None
+breaker = CircuitBreaker('gateway')
+
+
+class Endpoint:
+    """Один OpenAI-совместимый шлюз и его статистика"""
+    
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.chat_url = base_url if "/chat/completions" in base_url else f"{base_url.rstrip('/')}/chat/completions"
+        self.ewma = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.down_until = 0.0
+        self.inflight = 0
+        self._samples = deque(maxlen=200)
+    
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+    
+    def record(self, latency: float, ok: bool):
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (0.0 if ok else 1.0)
+        if ok:
+            self.failures = 0
+            self.ewma = latency if self.ewma is None else (1 - EWMA_ALPHA) * self.ewma + EWMA_ALPHA * latency
+            self._samples.append(latency)
+            GATEWAY_ENDPOINT_LATENCY.observe(latency, endpoint=self.base_url)
+        else:
+            self.failures += 1
+            if self.failures >= ENDPOINT_MAX_FAILURES:
+                self.down_until = time.monotonic() + ENDPOINT_COOLDOWN
+                logger.warning(f"⚠️ Gateway {self.base_url} marked down for {ENDPOINT_COOLDOWN:.0f}s")
+    
+    def record_cancelled(self, elapsed: float):
+        """Проигравший в хедже: ответ занял бы не меньше elapsed — учитываем как оценку снизу"""
+        if self.ewma is None or elapsed > self.ewma:
+            self.ewma = elapsed if self.ewma is None else (1 - EWMA_ALPHA) * self.ewma + EWMA_ALPHA * elapsed
+    
+    def p95(self):
+        if len(self._samples) < 20:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+    
+    def score(self) -> float:
+        # Неизмеренный шлюз пробуем первым, чтобы быстрее собрать статистику
+        latency = self.ewma if self.ewma is not None else 0.0
+        return latency * (1 + 5 * self.error_rate) + 0.05 * self.inflight
+    
+    def stats(self) -> dict:
+        p95 = self.p95()
+        return {
+            'url': self.base_url,
+            'healthy': self.healthy,
+            'ewma_sec': round(self.ewma, 3) if self.ewma is not None else None,
+            'p95_sec': round(p95, 3) if p95 is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'inflight': self.inflight,
+        }
+
+
+ENDPOINTS = [Endpoint(url) for url in GATEWAY_URLS]
+
+
+def pick_endpoint(exclude=()) -> Endpoint:
+    """Самый быстрый живой шлюз; если живых нет — лучший из всех"""
+    candidates = [e for e in ENDPOINTS if e not in exclude] or list(ENDPOINTS)
+    healthy = [e for e in candidates if e.healthy] or candidates
+    return min(healthy, key=lambda e: e.score())
+
+
+def endpoints_stats() -> list:
+    return [e.stats() for e in ENDPOINTS]
+
+
+def _build_client() -> httpx.AsyncClient:
+    http2 = GATEWAY_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️ GATEWAY_HTTP2=true, но пакет h2 не установлен — работаем по HTTP/1.1")
+            http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=GATEWAY_MAX_CONNECTIONS,
+            max_keepalive_connections=GATEWAY_MAX_KEEPALIVE,
+            keepalive_expiry=GATEWAY_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(GATEWAY_READ_TIMEOUT, connect=GATEWAY_CONNECT_TIMEOUT),
+    )
+
+
+async def start():
+    """Создаёт клиент (вызывается из on_startup)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+        logger.info(f"🔌 Gateway client: pool {GATEWAY_MAX_CONNECTIONS}, http2={GATEWAY_HTTP2}")
+
+
+async def close():
+    """Закрывает пул соединений (вызывается из on_shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    # Если приложение не запускало on_startup (скрипты, отладка) — создаём сами
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+class _ConnectTrace:
+    """httpx trace-хук: замер TCP/TLS handshake для нового соединения"""
+
+    def __init__(self):
+        self.started = {}
+        self.new_connection = False
+
+    async def __call__(self, event_name: str, info: dict):
+        # connection.connect_tcp.started / .complete, connection.start_tls.*
+        if not event_name.startswith('connection.'):
+            return
+        _, phase, stage = event_name.split('.', 2)
+        if phase not in ('connect_tcp', 'start_tls'):
+            return
+        if stage == 'started':
+            self.new_connection = True
+            self.started[phase] = time.perf_counter()
+        elif stage == 'complete' and phase in self.started:
+            label = 'tls' if phase == 'start_tls' else 'tcp'
+            GATEWAY_CONNECT.observe(time.perf_counter() - self.started.pop(phase), phase=label)
+
+
+async def post_json(url: str, payload: dict, headers: dict, read_timeout: float = None) -> httpx.Response:
+    """POST в шлюз через общий пул"""
+    trace = _ConnectTrace()
+    timeout = httpx.Timeout(read_timeout or GATEWAY_READ_TIMEOUT, connect=GATEWAY_CONNECT_TIMEOUT)
+    try:
+        return await get_client().post(
+            url, json=payload, headers=headers, timeout=timeout,
+            extensions={'trace': trace}
+        )
+    finally:
+        GATEWAY_CONNECTIONS.inc(kind='new' if trace.new_connection else 'reused')
+
+
+@asynccontextmanager
+async def stream_json(url: str, payload: dict, headers: dict, read_timeout: float = None):
+    """Потоковый POST (SSE): async with stream_json(...) as response: ..."""
+    trace = _ConnectTrace()
+    timeout = httpx.Timeout(read_timeout or GATEWAY_READ_TIMEOUT, connect=GATEWAY_CONNECT_TIMEOUT)
+    try:
+        async with get_client().stream(
+            'POST', url, json=payload, headers=headers, timeout=timeout,
+            extensions={'trace': trace}
+        ) as response:
+            yield response
+    finally:
+        GATEWAY_CONNECTIONS.inc(kind='new' if trace.new_connection else 'reused')
+
+
+async def _post_to(endpoint: Endpoint, payload: dict, headers: dict, read_timeout: float = None) -> httpx.Response:
+    endpoint.inflight += 1
+    started = time.perf_counter()
+    try:
+        response = await post_json(endpoint.chat_url, payload, headers, read_timeout)
+    except asyncio.CancelledError:
+        endpoint.record_cancelled(time.perf_counter() - started)
+        raise
+    except Exception:
+        endpoint.record(time.perf_counter() - started, ok=False)
+        raise
+    finally:
+        endpoint.inflight -= 1
+    endpoint.record(time.perf_counter() - started, ok=response.status_code < 500)
+    return response
+
+
+async def post_chat(payload: dict, headers: dict, read_timeout: float = None, hedge: bool = False) -> httpx.Response:
+    """
+    chat/completions на лучший шлюз.
+    hedge=True — если ответа нет дольше p95, дубль на следующий шлюз; проигравший отменяется.
+    При разомкнутой цепи сразу CircuitOpen
+    """
+    breaker.allow()
+    try:
+        response = await _post_chat(payload, headers, read_timeout, hedge)
+    except asyncio.CancelledError:
+        breaker.cancelled()
+        raise
+    except Exception as e:
+        breaker.record_failure(type(e).__name__)
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure(f"HTTP {response.status_code}")
+    else:
+        breaker.record_success()
+    return response
+
+
+async def _post_chat(payload: dict, headers: dict, read_timeout: float = None, hedge: bool = False) -> httpx.Response:
+    primary = pick_endpoint()
+    if not (hedge and GATEWAY_HEDGE and len(ENDPOINTS) > 1):
+        return await _post_to(primary, payload, headers, read_timeout)
+    
+    delay = max(GATEWAY_HEDGE_MIN_DELAY, primary.p95() or GATEWAY_HEDGE_DEFAULT_DELAY)
+    tasks = {asyncio.ensure_future(_post_to(primary, payload, headers, read_timeout))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            task = done.pop()
+            if task.exception() is None and task.result().status_code < 500:
+                return task.result()
+        
+        secondary = pick_endpoint(exclude={primary})
+        GATEWAY_HEDGED.inc(endpoint=secondary.base_url)
+        tasks.add(asyncio.ensure_future(_post_to(secondary, payload, headers, read_timeout)))
+        
+        # Первый удачный ответ побеждает; если оба плохие — отдаём последний
+        last_error, last_response = None, None
+        pending = {t for t in tasks if not t.done()}
+        finished = [t for t in tasks if t.done()]
+        while True:
+            for task in finished:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                elif task.result().status_code < 500:
+                    return task.result()
+                else:
+                    last_response = task.result()
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            finished = list(done)
+        
+        if last_response is not None:
+            return last_response
+        raise last_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+@asynccontextmanager
+async def stream_chat(payload: dict, headers: dict, read_timeout: float = None):
+    """Потоковый chat/completions на лучший шлюз (латентность — до заголовков ответа,
+    исход для предохранителя — по завершении потока)"""
+    breaker.allow()
+    endpoint = pick_endpoint()
+    endpoint.inflight += 1
+    started = time.perf_counter()
+    measured = settled = False
+    try:
+        async with stream_json(endpoint.chat_url, payload, headers, read_timeout) as response:
+            ok = response.status_code < 500
+            endpoint.record(time.perf_counter() - started, ok=ok)
+            measured = True
+            yield response
+        if ok:
+            breaker.record_success()
+        else:
+            breaker.record_failure(f"HTTP {response.status_code}")
+        settled = True
+    except httpx.TransportError as e:
+        # В том числе обрыв посреди потока
+        if not measured:
+            endpoint.record(time.perf_counter() - started, ok=False)
+        breaker.record_failure(type(e).__name__)
+        settled = True
+        raise
+    finally:
+        endpoint.inflight -= 1
+        if not settled:
+            breaker.cancelled()
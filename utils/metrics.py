@@ -0,0 +1,246 @@
+"""
+Минимальные метрики в формате Prometheus (text exposition 0.0.4)
+
+Без внешних зависимостей: Counter / Gauge / Histogram с лейблами,
+aiogram-middleware для апдейтов, хендлеров и Telegram API,
+и замер лага event loop. Всё отдаётся на /metrics.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def header(self) -> list:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self, extra=None) -> list:
+        return [f'{self.name}{_format_labels(self.labelnames, k, extra)} {v}'
+                for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with HIST.time(op='find'): ... — замер длительности блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self, extra=None) -> list:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames + ('le',), key + (repr(float(bound)),), extra)
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames + ('le',), key + ('+Inf',), extra)
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labelnames, key, extra)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def render(extra_labels: dict = None, headers: bool = True) -> str:
+    """Текст для /metrics. headers=False — только сэмплы (для склейки воркеров)"""
+    lines = []
+    for metric in _registry:
+        if headers:
+            lines.extend(metric.header())
+        lines.extend(metric.samples(extra_labels))
+    return '\n'.join(lines) + '\n'
+
+
+# --- ОБЩИЕ МЕТРИКИ ---
+
+UPDATES = Counter('bot_updates_total', 'Incoming updates', ('bot', 'type'))
+UPDATE_LATENCY = Histogram('bot_update_seconds', 'Full update processing time', ('bot', 'type'))
+HANDLER_LATENCY = Histogram('bot_handler_seconds', 'Handler execution time', ('bot', 'handler'))
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Handler exceptions', ('bot', 'handler', 'error'))
+HANDLERS_DROPPED = Counter('bot_updates_dropped_total', 'Updates dropped because lazy handlers failed to load',
+                           ('bot',))
+
+AI_LATENCY = Histogram('ai_request_seconds', 'AI gateway request latency', ('source', 'model'))
+AI_ERRORS = Counter('ai_request_errors_total', 'AI gateway errors', ('source', 'model', 'error'))
+AI_ROUTE_LATENCY = Histogram('ai_route_seconds', 'AI latency per call site route', ('route', 'tier'))
+AI_ROUTE_SLO_MISS = Counter('ai_route_slo_miss_total', 'AI calls slower than the route SLO', ('route', 'tier'))
+AI_FIRST_TOKEN = Histogram('ai_first_token_seconds', 'Time to first streamed token', ('source', 'model'))
+GATEWAY_CONNECT = Histogram('gateway_connect_seconds', 'AI gateway connection setup time', ('phase',),
+                            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+GATEWAY_ENDPOINT_LATENCY = Histogram('gateway_endpoint_seconds', 'Latency per gateway endpoint', ('endpoint',))
+GATEWAY_HEDGED = Counter('gateway_hedged_requests_total', 'Hedged duplicate requests sent', ('endpoint',))
+GATEWAY_CONNECTIONS = Counter('gateway_requests_by_connection_total',
+                              'AI gateway requests on new vs reused connections', ('kind',))
+BREAKER_STATE = Gauge('circuit_breaker_state', 'Circuit state: 0 closed, 1 half-open, 2 open', ('breaker',))
+BREAKER_REJECTED = Counter('circuit_breaker_rejected_total', 'Calls rejected by an open circuit', ('breaker',))
+
+AI_COALESCED = Counter('ai_coalesced_requests_total', 'Requests served by an identical in-flight request', ('source',))
+SCHED_ACTIVE = Gauge('ai_scheduler_active', 'AI gateway requests in progress')
+SCHED_QUEUED = Gauge('ai_scheduler_queued', 'AI gateway requests waiting for a slot')
+SCHED_REJECTED = Counter('ai_scheduler_rejected_total', 'AI requests rejected by full queue', ('priority',))
+SCHED_WAIT = Histogram('ai_scheduler_wait_seconds', 'Time spent waiting for a gateway slot', ('priority',))
+CACHE_REQUESTS = Counter('ai_cache_requests_total', 'AI response cache lookups', ('result',))
+CACHE_SIZE = Gauge('ai_cache_entries', 'AI response cache entries in memory')
+
+TELEGRAM_LATENCY = Histogram('telegram_api_seconds', 'Telegram Bot API call latency', ('bot', 'method'))
+TELEGRAM_ERRORS = Counter('telegram_api_errors_total', 'Telegram Bot API errors', ('bot', 'method', 'error'))
+
+TASK_EXTRACT = Counter('task_extract_total', 'Task extraction path (rules vs LLM)', ('bot', 'path'))
+VOICE_QUEUED = Gauge('voice_queued', 'Voice notes waiting for a transcription worker')
+VOICE_WAIT = Histogram('voice_wait_seconds', 'Time a voice note waits for a worker')
+VOICE_SECONDS = Histogram('voice_processing_seconds', 'Voice transcription time by stage', ('stage',))
+VOICE_CHUNKS = Histogram('voice_chunks', 'Silence-split chunks per voice note',
+                         buckets=(1, 2, 3, 5, 8, 12, 20, 30))
+VOICE_ERRORS = Counter('voice_errors_total', 'Voice transcription failures', ('error',))
+
+MONGO_LATENCY = Histogram('mongo_operation_seconds', 'MongoDB operation latency', ('db', 'op'))
+ACTIVITY_BUFFERED = Gauge('activity_buffered_users', 'Users with unflushed activity hits')
+SHEETS_LATENCY = Histogram('sheets_append_seconds', 'Google Sheets append latency', ('status',))
+SHEETS_SPOOL = Gauge('sheets_spool_rows', 'Report rows waiting in the local spool for Google Sheets')
+
+LOOP_LAG = Gauge('event_loop_lag_seconds', 'Last measured event loop lag')
+LOOP_LAG_HIST = Histogram('event_loop_lag_hist_seconds', 'Event loop lag distribution',
+                          buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+
+# --- AIOGRAM MIDDLEWARE ---
+
+class UpdateMetricsMiddleware:
+    """Outer-middleware на dp.update: счётчик и полное время обработки апдейта"""
+
+    def __init__(self, bot_name: str):
+        self.bot_name = bot_name
+
+    async def __call__(self, handler, event, data):
+        update_type = event.event_type if hasattr(event, 'event_type') else type(event).__name__
+        UPDATES.inc(bot=self.bot_name, type=update_type)
+        with UPDATE_LATENCY.time(bot=self.bot_name, type=update_type):
+            return await handler(event, data)
+
+
+class HandlerMetricsMiddleware:
+    """Inner-middleware на message/callback_query: время конкретного хендлера"""
+
+    def __init__(self, bot_name: str):
+        self.bot_name = bot_name
+
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get('handler')
+        name = getattr(getattr(handler_obj, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(bot=self.bot_name, handler=name, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, bot=self.bot_name, handler=name)
+
+
+class TelegramApiMetrics:
+    """Request-middleware для bot.session: латентность вызовов Bot API"""
+
+    def __init__(self, bot_name: str):
+        self.bot_name = bot_name
+
+    async def __call__(self, make_request, bot, method):
+        method_name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_ERRORS.inc(bot=self.bot_name, method=method_name, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, bot=self.bot_name, method=method_name)
+
+
+def instrument(bot_name: str, bot, dispatcher):
+    """Подключает все метрики к одному боту"""
+    dispatcher.update.outer_middleware(UpdateMetricsMiddleware(bot_name))
+    dispatcher.message.middleware(HandlerMetricsMiddleware(bot_name))
+    dispatcher.callback_query.middleware(HandlerMetricsMiddleware(bot_name))
+    bot.session.middleware(TelegramApiMetrics(bot_name))
+
+
+async def track_loop_lag(interval: float = 1.0):
+    """Фоновая задача: насколько позже запланированного просыпается loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_HIST.observe(lag)
+        if lag > 1:
+            logger.warning(f"🐢 Event loop lag {lag:.2f}s")
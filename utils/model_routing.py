@@ -0,0 +1,111 @@
+"""
+Маршрутизация моделей по местам вызова
+
+Каждое место вызова AI имеет имя маршрута "<бот>.<место>" и уровень модели
+(fast / default / large). У уровня своя модель, max_tokens, таймаут и SLO
+по латентности. Короткие классификации и извлечение JSON идут на маленькую
+быструю модель, генерация — на большую.
+
+Переопределение без деплоя кода:
+  MODEL_FAST / MODEL_DEFAULT / MODEL_LARGE — модели уровней
+  MODEL_TIERS  — JSON, параметры уровней: {"fast": {"max_tokens": 256, "slo": 2}}
+  MODEL_ROUTES — JSON, маршруты: {"nezabudka.extract": "default"}
+                 или {"zi_files.dlp": {"tier": "large", "timeout": 180}}
+"""
+import json
+import logging
+import os
+from typing import NamedTuple, Optional
+
+from utils.metrics import AI_ROUTE_LATENCY, AI_ROUTE_SLO_MISS
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = os.getenv('MODEL_NAME', 'auto')
+
+TIERS = {
+    'fast': {'model': os.getenv('MODEL_FAST', 'auto'), 'max_tokens': 512, 'timeout': 20.0, 'slo': 3.0},
+    'default': {'model': os.getenv('MODEL_DEFAULT', 'auto'), 'max_tokens': None, 'timeout': 60.0, 'slo': 15.0},
+    'large': {'model': os.getenv('MODEL_LARGE', MODEL_NAME), 'max_tokens': None, 'timeout': 120.0, 'slo': 60.0},
+}
+
+ROUTES = {
+    # Классификация и структурированный вывод — маленькая модель
+    'ai_team.analyze_input': {'tier': 'fast', 'max_tokens': 400},
+    'nezabudka.extract': {'tier': 'fast', 'max_tokens': 200},
+    'nezabudka.extract_batch': {'tier': 'fast', 'max_tokens': 1500},
+    # Генерация
+    # DLP-переписывание возвращает весь документ: без лимита токенов, иначе длинный текст обрежется
+    'zi_files.dlp': {'tier': 'default', 'timeout': 90.0},
+    'ai_team.agent': {'tier': 'large'},
+    'nezabudka.decompose': {'tier': 'default'},
+    'angry_bot.verdict': {'tier': 'default'},
+    'staff_bot.answer': {'tier': 'default'},
+    'prozrenie.strategy': {'tier': 'default'},
+}
+
+
+def _load_json_env(name: str) -> dict:
+    raw = os.getenv(name)
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+        return value if isinstance(value, dict) else {}
+    except ValueError as e:
+        logger.error(f"⚠️ {name} is not valid JSON: {e}")
+        return {}
+
+
+for _tier, _params in _load_json_env('MODEL_TIERS').items():
+    TIERS.setdefault(_tier, dict(TIERS['default'])).update(_params)
+
+for _name, _params in _load_json_env('MODEL_ROUTES').items():
+    ROUTES[_name] = {'tier': _params} if isinstance(_params, str) else _params
+
+
+class Route(NamedTuple):
+    name: str
+    tier: str
+    model: str
+    max_tokens: Optional[int]
+    timeout: float
+    slo: float
+
+
+def resolve(route: str = None, model: str = 'auto') -> Route:
+    """
+    Параметры вызова для маршрута.
+    Без маршрута — прежнее поведение (переданная модель, таймаут 60с).
+    Явно переданная модель (не "auto") важнее модели уровня
+    """
+    if route is None:
+        tier = TIERS['default']
+        return Route('unrouted', 'default', model, None, 60.0, tier['slo'])
+
+    params = ROUTES.get(route, {})
+    tier_name = params.get('tier', 'default')
+    if tier_name not in TIERS:
+        logger.warning(f"⚠️ Unknown model tier '{tier_name}' for route {route}")
+        tier_name = 'default'
+    merged = {**TIERS[tier_name], **{k: v for k, v in params.items() if k != 'tier'}}
+    return Route(
+        name=route,
+        tier=tier_name,
+        model=model if model != 'auto' else merged['model'],
+        max_tokens=merged.get('max_tokens'),
+        timeout=float(merged['timeout']),
+        slo=float(merged['slo']),
+    )
+
+
+def observe(route: Route, seconds: float):
+    """Латентность маршрута + счётчик превышений SLO"""
+    AI_ROUTE_LATENCY.observe(seconds, route=route.name, tier=route.tier)
+    if seconds > route.slo:
+        AI_ROUTE_SLO_MISS.inc(route=route.name, tier=route.tier)
+
+
+def routes_table() -> dict:
+    """Итоговая таблица маршрутов (для /health)"""
+    return {name: resolve(name)._asdict() for name in ROUTES}
@@ -0,0 +1,104 @@
+"""
+Индексы MongoDB для коллекций tasks / users и проверка планов запросов
+
+ensure_indexes(db) вызывается из Database.connect() обеих баз
+(nezabudka_ai и nezabudka_prod). create_index идемпотентен: существующий
+индекс с тем же именем и ключами не пересоздаётся.
+
+Проверить, что горячие запросы идут по индексам:
+    python -m utils.mongo_indexes [имя_базы ...]
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING
+
+from utils.metrics import MONGO_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# (коллекция, ключи, опции)
+INDEXES = [
+    # get_active_tasks: {user_id, status} + sort created_at desc
+    ('tasks', [('user_id', ASCENDING), ('status', ASCENDING), ('created_at', DESCENDING)],
+     {'name': 'user_status_created'}),
+    # То же только по незакрытым задачам — индекс в разы меньше
+    ('tasks', [('user_id', ASCENDING), ('created_at', DESCENDING)],
+     {'name': 'pending_by_user', 'partialFilterExpression': {'status': 'pending'}}),
+    # Активные пользователи за 24ч / 7д
+    ('users', [('last_active_at', DESCENDING)], {'name': 'last_active_at'}),
+    # Роллапы активности (utils/activity.py): часовые нужны только для окна 24ч, дневные храним 90 дней
+    ('activity_hours', [('hour', ASCENDING)], {'name': 'hour_ttl', 'expireAfterSeconds': 3 * 86400}),
+    ('activity_days', [('day', ASCENDING)], {'name': 'day_ttl', 'expireAfterSeconds': 90 * 86400}),
+]
+
+
+async def ensure_indexes(db):
+    """Создаёт недостающие индексы; ошибки логируются, но не мешают работе бота"""
+    for collection, keys, options in INDEXES:
+        try:
+            with MONGO_LATENCY.time(db=db.name, op=f"{collection}.create_index"):
+                await db[collection].create_index(keys, **options)
+        except Exception as e:
+            logger.error(f"⚠️ Index {db.name}.{collection}.{options['name']}: {e}")
+    logger.info(f"🗂 Mongo indexes ensured for {db.name}")
+
+
+def _plan_summary(plan: dict) -> str:
+    """LIMIT → FETCH → IXSCAN(pending_by_user)"""
+    plan = plan.get('queryPlan', plan)
+    stages = []
+    while plan:
+        stage = plan.get('stage', '?')
+        if plan.get('indexName'):
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return ' → '.join(stages)
+
+
+async def explain_hot_queries(db) -> list:
+    """[(название, план, docs examined, returned)] для горячих запросов"""
+    sample = await db.tasks.find_one({}, {'user_id': 1}) or {}
+    user_id = sample.get('user_id', 0)
+    day_ago = datetime.utcnow() - timedelta(days=1)
+
+    queries = [
+        ('get_active_tasks',
+         db.tasks.find({'user_id': user_id, 'status': 'pending'}).sort('created_at', -1).limit(50)),
+        ('pending_count', db.tasks.find({'status': 'pending'})),
+        ('users_active_24h', db.users.find({'last_active_at': {'$gte': day_ago}})),
+    ]
+    report = []
+    for name, cursor in queries:
+        explain = await cursor.explain()
+        stats = explain.get('executionStats', {})
+        report.append((
+            name,
+            _plan_summary(explain.get('queryPlanner', {}).get('winningPlan', {})),
+            stats.get('totalDocsExamined'),
+            stats.get('nReturned'),
+        ))
+    return report
+
+
+async def _main(db_names):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.getenv('MONGO_URI'), serverSelectionTimeoutMS=5000,
+                                tlsAllowInvalidCertificates=True)
+    for db_name in db_names:
+        db = client[db_name]
+        await ensure_indexes(db)
+        print(f"\n=== {db_name} ===")
+        for name, plan, examined, returned in await explain_hot_queries(db):
+            print(f"{name:<18} {plan}   docs examined: {examined}, returned: {returned}")
+    client.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(sys.argv[1:] or ['nezabudka_ai', 'nezabudka_prod']))
@@ -0,0 +1,128 @@
+"""
+Кэш ответов AI Gateway: LRU+TTL в памяти и опциональный SQLite-уровень на диске
+
+Ключ — sha256 от (system prompt, текст пользователя, модель, temperature, max_tokens).
+TTL задаётся на месте вызова (ask_brain(..., cache_ttl=...)).
+Просроченные записи не отдаются как свежие, но доступны с allow_stale=True
+(на случай, когда шлюз недоступен).
+"""
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from utils.metrics import CACHE_REQUESTS, CACHE_SIZE
+from utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'true').lower() == 'true'
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', 1000))
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 3600))
+# Путь к SQLite-файлу; пусто — только память
+AI_CACHE_DISK = os.getenv('AI_CACHE_DISK', '')
+
+
+def cache_key(sys_prompt: str, user_text: str, model: str, temperature: float,
+              max_tokens: Optional[int] = None) -> str:
+    # max_tokens в ключе: после смены лимита маршрута не отдаём ответы, обрезанные старым
+    raw = '\x1f'.join((sys_prompt, user_text, model, f'{temperature:.3f}', str(max_tokens or '')))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _DiskTier(SQLiteStore):
+    """SQLite-уровень: переживает рестарт, запросы выполняются в потоке"""
+
+    def __init__(self, path: str):
+        super().__init__(
+            path,
+            'CREATE TABLE IF NOT EXISTS ai_cache ('
+            'key TEXT PRIMARY KEY, content TEXT, model_info TEXT, expires_at REAL)'
+        )
+
+    def _get(self, key):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT content, model_info, expires_at FROM ai_cache WHERE key = ?', (key,)
+            ).fetchone()
+
+    def _set(self, key, content, model_info, expires_at):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ai_cache VALUES (?, ?, ?, ?)',
+                (key, content, model_info, expires_at)
+            )
+            # Заодно чистим совсем старое (устаревшее больше суток)
+            self._conn.execute('DELETE FROM ai_cache WHERE expires_at < ?', (time.time() - 86400,))
+            self._conn.commit()
+
+    async def get(self, key):
+        return await self.run_in_thread(self._get, key)
+
+    async def set(self, key, content, model_info, expires_at):
+        await self.run_in_thread(self._set, key, content, model_info, expires_at)
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = AI_CACHE_SIZE, default_ttl: int = AI_CACHE_TTL,
+                 disk_path: str = AI_CACHE_DISK):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._memory: 'OrderedDict[str, Tuple[float, str, str]]' = OrderedDict()
+        self._disk = None
+        if disk_path:
+            try:
+                self._disk = _DiskTier(disk_path)
+                logger.info(f"💾 AI cache disk tier: {disk_path}")
+            except Exception as e:
+                logger.error(f"⚠️ AI cache disk tier disabled: {e}")
+
+    def _remember(self, key: str, entry: Tuple[float, str, str]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+        CACHE_SIZE.set(len(self._memory))
+
+    async def get(self, key: str, allow_stale: bool = False) -> Optional[Tuple[str, str]]:
+        """(content, model_info) или None"""
+        now = time.time()
+        entry = self._memory.get(key)
+        tier = 'memory'
+
+        if entry is None and self._disk is not None:
+            try:
+                entry = await self._disk.get(key)
+            except Exception as e:
+                logger.error(f"⚠️ AI cache disk read: {e}")
+            if entry is not None:
+                tier = 'disk'
+                entry = (entry[2], entry[0], entry[1])
+                self._remember(key, entry)
+
+        if entry is None:
+            CACHE_REQUESTS.inc(result='miss')
+            return None
+
+        expires_at, content, model_info = entry
+        if expires_at < now and not allow_stale:
+            CACHE_REQUESTS.inc(result='expired')
+            return None
+
+        self._memory.move_to_end(key)
+        CACHE_REQUESTS.inc(result='stale' if expires_at < now else f'hit_{tier}')
+        return content, model_info
+
+    async def set(self, key: str, content: str, model_info: str, ttl: Optional[int] = None):
+        expires_at = time.time() + (ttl if ttl is not None else self.default_ttl)
+        self._remember(key, (expires_at, content, model_info))
+        if self._disk is not None:
+            try:
+                await self._disk.set(key, content, model_info, expires_at)
+            except Exception as e:
+                logger.error(f"⚠️ AI cache disk write: {e}")
+
+
+response_cache = ResponseCache()
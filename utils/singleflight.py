@@ -0,0 +1,71 @@
+"""
+Single-flight: одинаковые одновременные запросы делят один upstream-вызов
+
+Первый вызов с данным ключом выполняет работу, остальные ждут его результат.
+Ожидание идёт через asyncio.shield: отмена одного ожидающего (например,
+пользователь ушёл, апдейт отменён) не отменяет запрос для остальных.
+"""
+import asyncio
+import logging
+
+from utils.metrics import AI_COALESCED
+
+logger = logging.getLogger(__name__)
+
+
+def _consume_exception(future: asyncio.Future):
+    # Если все ожидающие отменились, ошибку никто не заберёт — гасим предупреждение
+    if not future.cancelled():
+        future.exception()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+
+    def running(self, key: str):
+        """Future уже выполняющегося запроса с этим ключом (или None)"""
+        return self._inflight.get(key)
+
+    async def do(self, key: str, fn):
+        """Выполняет fn() один раз на ключ; конкурентные вызовы получают тот же результат"""
+        future = self._inflight.get(key)
+        if future is not None:
+            AI_COALESCED.inc(source=self.name)
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(fn())
+        self._track(key, future)
+        return await asyncio.shield(future)
+
+    def begin(self, key: str) -> asyncio.Future:
+        """Для потоковых запросов: лидер сам завершит future через finish()"""
+        future = asyncio.get_running_loop().create_future()
+        self._track(key, future)
+        return future
+
+    def finish(self, future: asyncio.Future, result=None, error: BaseException = None):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def join(self, future: asyncio.Future):
+        AI_COALESCED.inc(source=self.name)
+        return await asyncio.shield(future)
+
+    def _track(self, key: str, future: asyncio.Future):
+        self._inflight[key] = future
+
+        def cleanup(done):
+            if self._inflight.get(key) is done:
+                del self._inflight[key]
+            _consume_exception(done)
+
+        future.add_done_callback(cleanup)
+
+    def __len__(self):
+        return len(self._inflight)
@@ -0,0 +1,30 @@
+"""
+Общая основа локальных SQLite-хранилищ (FSM, кэш ответов, spool и зеркало staff_bot)
+
+Одно соединение на файл под threading.Lock, журнал WAL. Методы
+наследников с запросами — синхронные (берут self._lock сами) и
+вызываются из event loop через run_in_thread.
+"""
+import asyncio
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    def __init__(self, path: str, schema: str = ''):
+        """schema — CREATE TABLE/INDEX IF NOT EXISTS, выполняется один раз при открытии"""
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            if schema:
+                self._conn.executescript(schema)
+            self._conn.commit()
+
+    async def run_in_thread(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,244 @@
+"""
+Многопроцессный режим: супервизор + N воркеров на одном порту (SO_REUSEPORT)
+
+Ядро раздаёт входящие соединения воркерам случайно, поэтому каждый воркер
+проверяет, кому принадлежит чат (crc32(chat_id) % N), и при необходимости
+пересылает апдейт владельцу через внутренний порт 127.0.0.1.
+Так FSM-сценарии (Report, BrandAnalysis...) всегда живут в одном процессе.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import time
+import zlib
+
+import aiohttp
+from aiohttp import web
+
+from utils.update_queue import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+INTERNAL_PORT_BASE = int(os.getenv('INTERNAL_PORT_BASE', 11000))
+INTERNAL_HEADER = 'X-Internal-Token'
+RESTART_DELAY = 1.0
+RESTART_DELAY_MAX = 30.0
+
+# Заполняются в дочернем процессе перед запуском event loop
+WORKER_INDEX = 0
+WORKER_COUNT = 1
+# Общий секрет для внутренних запросов: генерится до fork и наследуется
+INTERNAL_TOKEN = os.getenv('INTERNAL_TOKEN') or secrets.token_hex(16)
+
+
+def is_primary() -> bool:
+    """Воркер 0 отвечает за регистрацию webhook и self-ping"""
+    return WORKER_INDEX == 0
+
+
+def owner_of(chat_id: int) -> int:
+    """Номер воркера, которому принадлежит чат"""
+    if WORKER_COUNT <= 1:
+        return 0
+    return zlib.crc32(str(chat_id).encode()) % WORKER_COUNT
+
+
+def internal_port(index: int) -> int:
+    return INTERNAL_PORT_BASE + index
+
+
+def is_internal(request: web.Request) -> bool:
+    return request.headers.get(INTERNAL_HEADER) == INTERNAL_TOKEN
+
+
+class PeerClient:
+    """HTTP-клиент к соседним воркерам (пересылка апдейтов и сбор /health)"""
+
+    def __init__(self):
+        self._session = None
+        self.forwarded = 0
+        self.forward_errors = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=5),
+                headers={INTERNAL_HEADER: INTERNAL_TOKEN}
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def forward(self, index: int, path: str, body: bytes) -> int:
+        """Пересылает сырой апдейт воркеру-владельцу, возвращает HTTP-статус"""
+        url = f"http://127.0.0.1:{internal_port(index)}{path}"
+        try:
+            async with self._get_session().post(
+                url, data=body, headers={'Content-Type': 'application/json'}
+            ) as resp:
+                self.forwarded += 1
+                return resp.status
+        except Exception as e:
+            self.forward_errors += 1
+            logger.error(f"❌ Forward to worker {index} failed - {e}")
+            # Telegram повторит доставку, когда воркер поднимется
+            return 503
+
+    async def fetch_json(self, index: int, path: str):
+        url = f"http://127.0.0.1:{internal_port(index)}{path}"
+        try:
+            async with self._get_session().get(url) as resp:
+                return await resp.json()
+        except Exception as e:
+            return {'status': 'unreachable', 'error': str(e)}
+
+    async def fetch_text(self, index: int, path: str) -> str:
+        url = f"http://127.0.0.1:{internal_port(index)}{path}"
+        try:
+            async with self._get_session().get(url) as resp:
+                return await resp.text()
+        except Exception as e:
+            logger.error(f"❌ Worker {index} unreachable - {e}")
+            return ''
+
+    async def gather_json(self, path: str) -> dict:
+        """Собирает JSON со всех остальных воркеров"""
+        peers = [i for i in range(WORKER_COUNT) if i != WORKER_INDEX]
+        results = await asyncio.gather(*(self.fetch_json(i, path) for i in peers))
+        return dict(zip(peers, results))
+
+
+peers = PeerClient()
+
+
+def chat_affine(handler):
+    """
+    Оборачивает webhook-обработчик: чужие чаты пересылаются владельцу,
+    свои (и внутренние пересылки) обрабатываются локально
+    """
+    async def route(request: web.Request) -> web.Response:
+        if WORKER_COUNT <= 1 or is_internal(request):
+            return await handler(request)
+
+        body = await request.read()
+        try:
+            chat_id = update_chat_id(await request.json())
+        except Exception:
+            return web.Response(status=400)
+
+        owner = owner_of(chat_id)
+        if owner == WORKER_INDEX:
+            return await handler(request)
+
+        status = await peers.forward(owner, request.path, body)
+        return web.Response(status=200 if status < 300 else status)
+
+    return route
+
+
+def internal_only(handler):
+    """Внутренние маршруты доступны только соседям с токеном"""
+    async def guarded(request: web.Request) -> web.Response:
+        if not is_internal(request):
+            raise web.HTTPForbidden()
+        return await handler(request)
+
+    return guarded
+
+
+async def serve(app: web.Application, host: str, port: int):
+    """Запуск одного воркера: публичный порт (reuse_port) + внутренний"""
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+
+    await web.TCPSite(runner, host, port, reuse_port=WORKER_COUNT > 1).start()
+    if WORKER_COUNT > 1:
+        await web.TCPSite(runner, '127.0.0.1', internal_port(WORKER_INDEX)).start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"👷 Worker {WORKER_INDEX}/{WORKER_COUNT} (pid {os.getpid()}) listening on {port}")
+    try:
+        await stop.wait()
+    finally:
+        await peers.close()
+        await runner.cleanup()
+
+
+def run_supervisor(count: int, target):
+    """
+    Форкает count воркеров и перезапускает упавшие.
+    target(index) — функция, которая запускает воркер в дочернем процессе
+    """
+    global WORKER_INDEX, WORKER_COUNT
+    WORKER_COUNT = count
+    children = {}  # pid → index
+    restarts = [0] * count
+    started_at = [0.0] * count
+    stopping = False
+
+    def spawn(index: int):
+        global WORKER_INDEX
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            WORKER_INDEX = index
+            code = 0
+            try:
+                target(index)
+            except Exception as e:
+                logger.error(f"❌ Worker {index} crashed - {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+        started_at[index] = time.monotonic()
+        logger.info(f"🐣 Worker {index} started (pid {pid})")
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(count):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+
+        # Перезапуск с экспоненциальной паузой, чтобы не уйти в crash-loop
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started_at[index] > 60:
+            restarts[index] = 0
+        delay = min(RESTART_DELAY * 2 ** restarts[index], RESTART_DELAY_MAX)
+        restarts[index] += 1
+        logger.error(f"💥 Worker {index} (pid {pid}) exited with {code}, restart in {delay:.0f}s")
+        time.sleep(delay)
+        if not stopping:
+            spawn(index)
+
+    logger.info("🛑 Supervisor stopped")
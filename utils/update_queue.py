@@ -0,0 +1,176 @@
+"""
+Очередь входящих апдейтов для webhook-режима "queue"
+
+Telegram получает 200 сразу, а апдейт обрабатывается пулом воркеров.
+Апдейты копятся в очереди своего чата; чат в каждый момент обрабатывает
+не больше одного воркера, поэтому апдейты чата идут строго по порядку,
+а разные чаты разбирает общий пул воркеров параллельно.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Что делать, когда очередь переполнена
+OVERFLOW_DROP = 'drop'      # отвечаем 200 и выбрасываем апдейт
+OVERFLOW_REJECT = 'reject'  # отвечаем 503 — Telegram повторит доставку позже
+
+
+def update_chat_id(data: dict) -> int:
+    """Достаёт chat_id (или user_id) из сырого апдейта — ключ порядка обработки"""
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'business_message', 'edited_business_message'):
+        event = data.get(key)
+        if event and event.get('chat'):
+            return event['chat']['id']
+
+    callback = data.get('callback_query')
+    if callback:
+        message = callback.get('message')
+        if message and message.get('chat'):
+            return message['chat']['id']
+        return callback.get('from', {}).get('id', 0)
+
+    for event in data.values():
+        if isinstance(event, dict):
+            if event.get('chat'):
+                return event['chat'].get('id', 0)
+            if event.get('from'):
+                return event['from'].get('id', 0)
+            if event.get('user'):
+                return event['user'].get('id', 0)
+
+    return 0
+
+
+class UpdateQueue:
+    """Ограниченная очередь + пул воркеров одного бота"""
+
+    def __init__(self, name: str, dispatcher: Dispatcher, bot: Bot,
+                 workers: int = 4, maxsize: int = 1000, overflow: str = OVERFLOW_DROP):
+        self.name = name
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = max(1, workers)
+        self.maxsize = max(self.workers, maxsize)
+        self.overflow = overflow if overflow in (OVERFLOW_DROP, OVERFLOW_REJECT) else OVERFLOW_DROP
+
+        # chat_id → deque апдейтов; чат есть в словаре, пока он в _ready или в работе.
+        # Чат берёт один воркер за раз — порядок внутри чата сохраняется,
+        # а медленный чат не задерживает остальные
+        self._chats = {}
+        self._ready = asyncio.Queue()
+        self._depth = 0
+        self._tasks = []
+        self._busy = 0
+
+        self.accepted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.max_wait = 0.0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f'{self.name}-worker-{i}')
+            for i in range(self.workers)
+        ]
+        logger.info(f"📬 {self.name}: queue started ({self.workers} workers, max {self.maxsize})")
+
+    async def stop(self, timeout: float = 10.0):
+        """Даём воркерам дообработать очередь, потом отменяем"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ {self.name}: {self.depth} update(s) left in queue on shutdown")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def submit(self, data: dict) -> bool:
+        """Кладёт апдейт в очередь его чата. False — если очередь переполнена"""
+        if self._depth >= self.maxsize:
+            if self.overflow == OVERFLOW_REJECT:
+                self.rejected += 1
+            else:
+                self.dropped += 1
+            logger.warning(f"⚠️ {self.name}: queue full ({self.overflow})")
+            return False
+
+        chat_id = update_chat_id(data)
+        pending = self._chats.get(chat_id)
+        if pending is None:
+            pending = self._chats[chat_id] = deque()
+            self._ready.put_nowait(chat_id)
+        pending.append((time.monotonic(), data))
+        self._depth += 1
+        self.accepted += 1
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """aiohttp-обработчик webhook: подтверждаем сразу, обрабатываем потом"""
+        try:
+            data = await request.json()
+        except Exception:
+            return web.Response(status=400)
+
+        if not self.submit(data) and self.overflow == OVERFLOW_REJECT:
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            pending = self._chats[chat_id]
+            queued_at, data = pending.popleft()
+            self._depth -= 1
+            self.max_wait = max(self.max_wait, time.monotonic() - queued_at)
+            self._busy += 1
+            try:
+                await self.dispatcher.feed_raw_update(self.bot, data)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ {self.name}: update {data.get('update_id')} failed - {e}")
+            finally:
+                self._busy -= 1
+                # Следующий апдейт чата — в конец очереди, чтобы чаты чередовались
+                if pending:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._chats[chat_id]
+                self._ready.task_done()
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'busy': self._busy,
+            'depth': self.depth,
+            'chats': len(self._chats),
+            'maxsize': self.maxsize,
+            'overflow': self.overflow,
+            'accepted': self.accepted,
+            'processed': self.processed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'max_wait_sec': round(self.max_wait, 3),
+        }